@@ -0,0 +1,45 @@
+import sys
+import os
+from dotenv import load_dotenv
+from benchmark_utils import percentile, detail_routes, run_load
+
+load_dotenv()
+
+# Comparative benchmark of the Flask server (enhanced_api_server.py under
+# gunicorn) and the ASGI variant (enhanced_api_server_async.py under uvicorn).
+# Start both against the same database, then:
+#   python3 benchmark_async_api.py [seconds_per_case]
+# Every request carries a unique _bench parameter so the Flask response cache
+# doesn't answer it; the async server ignores unknown parameters.
+
+FLASK_URL = os.getenv('FLASK_URL', 'http://localhost:5000')
+ASYNC_URL = os.getenv('ASYNC_URL', 'http://localhost:8000')
+SECONDS_PER_CASE = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+CONCURRENCY_LEVELS = [1, 16, 64]
+
+# Function to pick the routes to compare, using real ids from the API
+def build_routes():
+    routes = ['/api/guides?limit=20', '/api/search?q=battery', '/api/stats']
+    for route in detail_routes(FLASK_URL, ['guide']):
+        routes.append(route)
+        # Without a precomputed document, the guide is built from the tables (the fan-out path)
+        routes.append(f"{route}?include=step_raw_data")
+    return routes + detail_routes(FLASK_URL, ['product'])
+
+# Function to hammer one URL with the given number of client threads; returns sorted latencies in ms and errors
+def run_case(base_url, route, concurrency):
+    results = run_load(base_url, [route], concurrency, SECONDS_PER_CASE).get(route, [])
+    return sorted(latency for latency, ok in results), sum(1 for latency, ok in results if not ok)
+
+if __name__ == "__main__":
+    print(f"{'route':<45} {'conc':>4} {'server':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for route in build_routes():
+        for concurrency in CONCURRENCY_LEVELS:
+            for name, base_url in (('flask', FLASK_URL), ('async', ASYNC_URL)):
+                latencies, errors = run_case(base_url, route, concurrency)
+                if not latencies:
+                    print(f"{route[:45]:<45} {concurrency:>4} {name:>6} no responses")
+                    continue
+                print(f"{route[:45]:<45} {concurrency:>4} {name:>6} {len(latencies) / SECONDS_PER_CASE:>8.1f} "
+                      f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+                      f"{percentile(latencies, 0.99):>8.1f} {errors:>6}")
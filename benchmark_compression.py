@@ -0,0 +1,49 @@
+import requests
+import time
+import sys
+import os
+from dotenv import load_dotenv
+from benchmark_utils import percentile, detail_routes, cache_busting_url
+
+load_dotenv()
+
+# Benchmark for response compression and streaming: requests API endpoints from
+# a running server with each Accept-Encoding and reports bytes on the wire, time
+# to first byte and total time. Each request gets a unique _bench parameter so
+# it misses the response cache and measures the handler itself.
+#   python3 benchmark_compression.py [requests_per_case]
+
+API_URL = os.getenv('API_URL', 'http://localhost:5000')
+REQUESTS_PER_CASE = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+ENCODINGS = ['identity', 'gzip', 'br']
+
+# Function to pick endpoints to measure, including the first guide's detail page
+def build_endpoints():
+    endpoints = ['/api/guides?limit=100', '/api/categories', '/api/tags?limit=500', '/api/stats']
+    return endpoints + detail_routes(API_URL, ['guide'])
+
+# Function to make one request and return (wire bytes, seconds to first byte, total seconds, encoding sent)
+def measure(path, encoding, run):
+    request_start = time.perf_counter()
+    response = requests.get(
+        cache_busting_url(API_URL, path, f"{time.time()}-{run}"),
+        headers={'Accept-Encoding': encoding},
+        stream=True
+    )
+    chunks = response.raw.stream(16384, decode_content=False)
+    first = next(chunks, b'')
+    first_byte = time.perf_counter() - request_start
+    wire_bytes = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - request_start
+    response.close()
+    return wire_bytes, first_byte, total, response.headers.get('Content-Encoding', 'identity')
+
+if __name__ == "__main__":
+    print(f"{'endpoint':<40} {'sent':>8} {'bytes':>10} {'ttfb p50':>9} {'total p50':>10} {'total p95':>10}")
+    for path in build_endpoints():
+        for encoding in ENCODINGS:
+            results = [measure(path, encoding, run) for run in range(REQUESTS_PER_CASE)]
+            first_bytes = sorted(result[1] * 1000 for result in results)
+            totals = sorted(result[2] * 1000 for result in results)
+            print(f"{path[:40]:<40} {results[-1][3]:>8} {results[-1][0]:>10} "
+                  f"{percentile(first_bytes, 0.5):>8.1f} {percentile(totals, 0.5):>10.1f} {percentile(totals, 0.95):>10.1f}")
@@ -0,0 +1,104 @@
+import psycopg2
+import psycopg2.extras
+import time
+import sys
+import os
+
+# Measure the handler itself, not the response cache
+os.environ['RESPONSE_CACHE_SIZE'] = '0'
+
+from enhanced_api_server import app, db_params
+from enhanced_ifixit_fetcher import guide_document_query
+from benchmark_utils import percentile
+
+# Latency benchmark for /api/guides/<guide_id>: seeds guides with increasing
+# step counts into the configured Postgres database, requests each one through
+# the Flask test client and reports median and p95 latency per step count,
+# first built from the guide tables, then served from guide_documents.
+#   python3 benchmark_guide_endpoint.py [requests_per_guide]
+
+STEP_COUNTS = [10, 30, 60, 120]
+IMAGES_PER_STEP = 3
+REQUESTS_PER_GUIDE = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+GUIDE_PREFIX = 'benchmark-latency-'
+
+# Function to seed one guide with the given number of steps and step images
+def seed_guide(cursor, step_count):
+    cursor.execute("""
+        INSERT INTO guides (source_id, external_id, title, category, modified_date)
+        VALUES (1, %s, %s, 'Benchmark', 0)
+        RETURNING id
+    """, (f"{GUIDE_PREFIX}{step_count}", f"Benchmark guide with {step_count} steps"))
+    guide_id = cursor.fetchone()[0]
+
+    step_ids = psycopg2.extras.execute_values(cursor, """
+        INSERT INTO steps (guide_id, external_id, orderby, title, raw_data)
+        VALUES %s
+        RETURNING id
+    """, [
+        (guide_id, f"step-{n}", n, f"Step {n}", psycopg2.extras.Json({'stepid': n, 'lines': [{'text_raw': 'x' * 200}]}))
+        for n in range(step_count)
+    ], fetch=True)
+
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO media (guide_id, step_id, media_type, external_id, original_url, s3_path)
+        VALUES %s
+    """, [
+        (guide_id, step_id, 'images', f"{step_id}-{n}", 'https://example.com/image.jpg', f"ifixit/images/{step_id}-{n}/original.jpg")
+        for (step_id,) in step_ids
+        for n in range(IMAGES_PER_STEP)
+    ])
+    return guide_id
+
+# Function to remove all benchmark guides
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM guides WHERE external_id LIKE %s", (f"{GUIDE_PREFIX}%",))
+    guide_ids = [row[0] for row in cursor.fetchall()]
+    if guide_ids:
+        cursor.execute("DELETE FROM guide_documents WHERE guide_id = ANY(%s)", (guide_ids,))
+        cursor.execute("DELETE FROM media WHERE guide_id = ANY(%s)", (guide_ids,))
+        cursor.execute("DELETE FROM steps WHERE guide_id = ANY(%s)", (guide_ids,))
+        cursor.execute("DELETE FROM guides WHERE id = ANY(%s)", (guide_ids,))
+    conn.commit()
+    cursor.close()
+
+# Function to request each seeded guide and print latency percentiles
+def run_requests(client, mode):
+    for step_count in STEP_COUNTS:
+        url = f"/api/guides/{GUIDE_PREFIX}{step_count}"
+        client.get(url)  # warm up
+
+        timings = []
+        for _ in range(REQUESTS_PER_GUIDE):
+            request_start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - request_start) * 1000)
+            if response.status_code != 200:
+                print(f"Request to {url} failed with {response.status_code}")
+                sys.exit(1)
+
+        timings.sort()
+        print(f"{mode:>9} {step_count:>6} {step_count * IMAGES_PER_STEP:>6} {percentile(timings, 0.5):>8.1f} {percentile(timings, 0.95):>8.1f}")
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(**db_params)
+    client = app.test_client()
+
+    try:
+        cleanup(conn)
+        cursor = conn.cursor()
+        guide_ids = [seed_guide(cursor, step_count) for step_count in STEP_COUNTS]
+        conn.commit()
+
+        print(f"{'source':>9} {'steps':>6} {'media':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        run_requests(client, 'tables')
+
+        for guide_id in guide_ids:
+            cursor.execute(guide_document_query, (guide_id,))
+        conn.commit()
+        cursor.close()
+        run_requests(client, 'document')
+    finally:
+        cleanup(conn)
+        conn.close()
@@ -0,0 +1,102 @@
+import psycopg2
+import psycopg2.extensions
+import time
+import sys
+from enhanced_ifixit_fetcher import db_params, store_guide_in_db
+
+# Benchmark for store_guide_in_db: counts the statements (round trips) sent to
+# Postgres for a synthetic guide and compares them with an estimate of the
+# per-row writes the fetcher used to issue (that code path no longer exists). Run against a database set up with enhanced_db_setup.py:
+#   python3 benchmark_guide_writes.py [steps] [images_per_step] [tags]
+
+STEPS = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+IMAGES_PER_STEP = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+TAGS = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+RUNS = 5
+BENCHMARK_GUIDE_ID = 'benchmark-guide'
+
+# Cursor that counts every statement sent to the server
+class CountingCursor(psycopg2.extensions.cursor):
+    executed = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.executed += 1
+        return super().execute(query, vars)
+
+# Function to build a synthetic guide with steps, step images and a main image
+def build_guide():
+    steps = []
+    media_paths = {}
+    for step_number in range(STEPS):
+        images = []
+        for image_number in range(IMAGES_PER_STEP):
+            image_id = f"bench-{step_number}-{image_number}"
+            images.append({'id': image_id, 'original': f"https://example.com/{image_id}.jpg"})
+            media_paths[image_id] = f"ifixit/images/{image_id}/original.jpg"
+        steps.append({
+            'stepid': f"bench-step-{step_number}",
+            'orderby': step_number,
+            'title': f"Step {step_number}",
+            'media': {'type': 'image', 'data': images}
+        })
+
+    media_paths['bench-main'] = "ifixit/images/bench-main/original.jpg"
+    guide = {
+        'guideid': BENCHMARK_GUIDE_ID,
+        'title': 'Benchmark guide',
+        'category': 'Benchmark',
+        'modified_date': int(time.time()),
+        'image': {'id': 'bench-main', 'original': 'https://example.com/bench-main.jpg'}
+    }
+    details = {'steps': steps, 'difficulty': {'name': 'Easy'}}
+    tags = [f"bench-tag-{tag_number}" for tag_number in range(TAGS)]
+    return guide, details, tags, media_paths
+
+# Estimated statements the per-row implementation issued for the same guide,
+# counted from its code rather than measured:
+# guide upsert, category lookup + update, one per step, one per image,
+# two for the main image and two per tag
+def legacy_round_trips():
+    return 1 + 2 + STEPS + STEPS * IMAGES_PER_STEP + 2 + 2 * TAGS
+
+# Function to remove the rows written by the benchmark
+def cleanup(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM guides WHERE source_id = 1 AND external_id = %s", (BENCHMARK_GUIDE_ID,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("UPDATE guides SET image_id = NULL WHERE id = %s", (row[0],))
+        cursor.execute("DELETE FROM guide_documents WHERE guide_id = %s", (row[0],))
+        cursor.execute("DELETE FROM guide_tags WHERE guide_id = %s", (row[0],))
+        cursor.execute("DELETE FROM media WHERE guide_id = %s", (row[0],))
+        cursor.execute("DELETE FROM steps WHERE guide_id = %s", (row[0],))
+        cursor.execute("DELETE FROM guides WHERE id = %s", (row[0],))
+    # Tags get a tag_stats row from a trigger when they are inserted
+    cursor.execute("DELETE FROM tag_stats WHERE tag_id IN (SELECT id FROM tags WHERE name LIKE 'bench-tag-%%')")
+    cursor.execute("DELETE FROM tags WHERE name LIKE 'bench-tag-%%'")
+    conn.commit()
+    cursor.close()
+
+if __name__ == "__main__":
+    guide, details, tags, media_paths = build_guide()
+    conn = psycopg2.connect(cursor_factory=CountingCursor, **db_params)
+
+    try:
+        cleanup(conn)
+        timings = []
+        for run in range(RUNS):
+            CountingCursor.executed = 0
+            run_start = time.time()
+            if not store_guide_in_db(guide, details, tags, conn, media_paths):
+                print("store_guide_in_db failed, see output above")
+                sys.exit(1)
+            timings.append(time.time() - run_start)
+            round_trips = CountingCursor.executed
+
+        print(f"Guide with {STEPS} steps, {STEPS * IMAGES_PER_STEP} step images and {TAGS} tags")
+        print(f"Round trips per guide before (per-row writes, estimated): {legacy_round_trips()}")
+        print(f"Round trips per guide after (batched writes, measured): {round_trips}")
+        print(f"Average store time over {RUNS} runs: {sum(timings) / len(timings) * 1000:.1f} ms")
+    finally:
+        cleanup(conn)
+        conn.close()
@@ -0,0 +1,72 @@
+import requests
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# Helpers shared by the benchmark and load test scripts: percentiles, routes built
+# from real ids the API returns, and concurrent timed clients against a running server.
+
+# Detail routes that can be built from the first row of a list endpoint:
+# kind -> (list route, list key, id field, detail route prefix)
+DETAIL_ROUTES = {
+    'guide': ('/api/guides?limit=1', 'guides', 'external_id', '/api/guides/'),
+    'category': ('/api/categories', 'categories', 'title', '/api/categories/'),
+    'product': ('/api/products?limit=1', 'products', 'itemcode', '/api/products/')
+}
+
+# Function to get a percentile from a sorted list of timings
+def percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+# Function to build detail routes for the first guide, category or product the API lists
+def detail_routes(api_url, kinds):
+    routes = []
+    for kind in kinds:
+        list_route, list_key, id_field, prefix = DETAIL_ROUTES[kind]
+        rows = requests.get(f"{api_url}{list_route}").json().get(list_key, [])
+        if rows:
+            routes.append(f"{prefix}{urllib.parse.quote(str(rows[0][id_field]))}")
+    return routes
+
+# Function to add a unique _bench parameter so a request misses the response cache
+def cache_busting_url(base_url, route, token):
+    return f"{base_url}{route}{'&' if '?' in route else '?'}_bench={token}"
+
+# Function to time one GET; returns (latency in ms, whether it answered 200)
+def timed_get(session, url):
+    request_start = time.perf_counter()
+    try:
+        ok = session.get(url, timeout=30).status_code == 200
+    except Exception:
+        ok = False
+    return (time.perf_counter() - request_start) * 1000, ok
+
+# Function to run concurrent clients requesting the routes round-robin until the
+# deadline; returns route -> list of (latency in ms, ok)
+def run_load(base_url, routes, concurrency, seconds, no_cache=True, headers=None):
+    results = {}
+    results_lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def client(client_number):
+        session = requests.Session()
+        session.headers.update(headers or {})
+        request_number = 0
+        while time.time() < deadline:
+            route = routes[(client_number + request_number) % len(routes)]
+            if no_cache:
+                url = cache_busting_url(base_url, route, f"{client_number}-{request_number}")
+            else:
+                url = f"{base_url}{route}"
+            request_number += 1
+
+            result = timed_get(session, url)
+            with results_lock:
+                results.setdefault(route, []).append(result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for client_number in range(concurrency):
+            executor.submit(client, client_number)
+    return results
@@ -0,0 +1,106 @@
+import psycopg2
+import sys
+from enhanced_ifixit_fetcher import db_params, refresh_aggregates
+
+# Check that refresh_aggregates fills and repairs category_stats and tag_stats,
+# both for a full refresh (no filter) and for the keys of one batch.
+# Run it against a local database set up with enhanced_db_setup.py:
+#   python3 check_aggregates.py
+# Seeds a few rows with stale counts, refreshes, and exits non-zero if any count
+# is wrong. The seeded rows are deleted afterwards.
+
+CHECK_CATEGORY = 'aggcheck-category'
+CHECK_TAG = 'aggcheck-tag'
+CHECK_GUIDES = 3
+CHECK_TAGGED_GUIDES = 2
+
+# Function to seed a category and tag with guides, and stats rows holding wrong counts
+def seed(cursor):
+    cursor.execute("INSERT INTO categories (title, display_title) VALUES (%s, %s) RETURNING id", (CHECK_CATEGORY, CHECK_CATEGORY))
+    category_id = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO tags (name) VALUES (%s) RETURNING id", (CHECK_TAG,))
+    tag_id = cursor.fetchone()[0]
+
+    guide_ids = []
+    for guide_number in range(CHECK_GUIDES):
+        cursor.execute("""
+            INSERT INTO guides (source_id, external_id, title, category)
+            VALUES (1, %s, %s, %s)
+            RETURNING id
+        """, (f"aggcheck-{guide_number}", f"Aggregate check {guide_number}", CHECK_CATEGORY))
+        guide_ids.append(cursor.fetchone()[0])
+    for guide_id in guide_ids[:CHECK_TAGGED_GUIDES]:
+        cursor.execute("INSERT INTO guide_tags (guide_id, tag_id) VALUES (%s, %s)", (guide_id, tag_id))
+
+    cursor.execute("INSERT INTO category_stats (category_id, title, guide_count) VALUES (%s, %s, 99)", (category_id, CHECK_CATEGORY))
+    # Tags get a tag_stats row from a trigger when they are inserted
+    cursor.execute("""
+        INSERT INTO tag_stats (tag_id, name, guide_count) VALUES (%s, %s, 99)
+        ON CONFLICT (tag_id) DO UPDATE SET guide_count = 99
+    """, (tag_id, CHECK_TAG))
+    return category_id, tag_id
+
+# Function to read the stored counts for the seeded category and tag
+def read_counts(cursor, category_id, tag_id):
+    cursor.execute("SELECT guide_count FROM category_stats WHERE category_id = %s", (category_id,))
+    category_count = cursor.fetchone()[0]
+    cursor.execute("SELECT guide_count FROM tag_stats WHERE tag_id = %s", (tag_id,))
+    tag_count = cursor.fetchone()[0]
+    return category_count, tag_count
+
+# Function to reset the seeded stats rows to wrong counts
+def make_stale(cursor, category_id, tag_id):
+    cursor.execute("UPDATE category_stats SET guide_count = 99 WHERE category_id = %s", (category_id,))
+    cursor.execute("UPDATE tag_stats SET guide_count = 99 WHERE tag_id = %s", (tag_id,))
+
+# Function to delete the seeded rows
+def cleanup(cursor):
+    cursor.execute("DELETE FROM guide_tags WHERE tag_id IN (SELECT id FROM tags WHERE name = %s)", (CHECK_TAG,))
+    cursor.execute("DELETE FROM tag_stats WHERE name = %s", (CHECK_TAG,))
+    cursor.execute("DELETE FROM category_stats WHERE title = %s", (CHECK_CATEGORY,))
+    cursor.execute("DELETE FROM guides WHERE external_id LIKE 'aggcheck-%%'")
+    cursor.execute("DELETE FROM tags WHERE name = %s", (CHECK_TAG,))
+    cursor.execute("DELETE FROM categories WHERE title = %s", (CHECK_CATEGORY,))
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    failures = []
+    try:
+        cleanup(cursor)
+        category_id, tag_id = seed(cursor)
+        conn.commit()
+
+        cases = [
+            ('full refresh', {}),
+            ('batch refresh', {'categories': {CHECK_CATEGORY}, 'tag_names': {CHECK_TAG}})
+        ]
+        for name, kwargs in cases:
+            make_stale(cursor, category_id, tag_id)
+            conn.commit()
+            refresh_aggregates(conn, **kwargs)
+            category_count, tag_count = read_counts(cursor, category_id, tag_id)
+            conn.commit()
+            print(f"{name}: category count {category_count} (expected {CHECK_GUIDES}), tag count {tag_count} (expected {CHECK_TAGGED_GUIDES})")
+            if category_count != CHECK_GUIDES or tag_count != CHECK_TAGGED_GUIDES:
+                failures.append(name)
+
+        # An empty batch must leave the counts alone
+        make_stale(cursor, category_id, tag_id)
+        conn.commit()
+        refresh_aggregates(conn, set(), set())
+        if read_counts(cursor, category_id, tag_id) != (99, 99):
+            failures.append('empty batch refresh')
+        conn.commit()
+    finally:
+        conn.rollback()
+        cleanup(cursor)
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK: aggregates refreshed")
@@ -0,0 +1,126 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# In-memory S3 and small parts, set before the fetcher creates its S3 client
+CHECK_STATE_DIR = tempfile.mkdtemp(prefix='media-resume-')
+os.environ.pop('S3_ENDPOINT_URL', None)
+os.environ['MEDIA_BUCKET'] = 'media-resume-check'
+os.environ['MEDIA_PART_SIZE'] = str(5 * 1024 * 1024)
+os.environ['MEDIA_UPLOAD_STATE_DIR'] = CHECK_STATE_DIR
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+mock = mock_aws()
+mock.start()
+
+import enhanced_ifixit_fetcher
+from enhanced_ifixit_fetcher import download_media, load_upload_state, s3_client, MEDIA_BUCKET, MEDIA_PART_SIZE
+
+# Check that an interrupted multipart media upload resumes at the right byte.
+# Needs moto (pip install moto); no database or network access:
+#   python3 check_media_resume.py
+# A local HTTP server serves a 12 MB image, gzip-encoded whenever the client accepts
+# gzip, and drops the first transfer after 7 MB. The second download_media call must
+# ask for the identity encoding, resume with a Range request from the end of the
+# uploaded part, and leave an S3 object identical to the image.
+
+MEDIA_ID = 'resume-check'
+PAYLOAD = os.urandom(12 * 1024 * 1024)
+INTERRUPT_AT = 7 * 1024 * 1024
+
+media_requests = []  # headers of each request the server answered
+interrupt_next = [True]
+
+class MediaHandler(BaseHTTPRequestHandler):
+    # Serve PAYLOAD with Range support, cutting the first transfer short
+    def do_GET(self):
+        media_requests.append({'Range': self.headers.get('Range'), 'Accept-Encoding': self.headers.get('Accept-Encoding')})
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(range_header.split('=')[1].split('-')[0])
+        body = PAYLOAD[start:]
+        gzipped = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if gzipped:
+            body = gzip.compress(body)
+
+        self.send_response(206 if range_header else 200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        if range_header:
+            self.send_header('Content-Range', f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        if interrupt_next[0]:
+            interrupt_next[0] = False
+            self.wfile.write(body[:INTERRUPT_AT])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    # The media index lives in Postgres; this check is about S3 only
+    enhanced_ifixit_fetcher.query_media_index = lambda query, params: None
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/media/{MEDIA_ID}.jpg"
+    failures = []
+    try:
+        s3_client.create_bucket(Bucket=MEDIA_BUCKET)
+
+        first = download_media(url, 'images', MEDIA_ID)
+        state = load_upload_state(f"ifixit/images/{MEDIA_ID}/original.jpg")
+        print(f"Interrupted download returned {first}; saved state: {len(state['parts']) if state else 0} parts, "
+              f"{state['bytes_uploaded'] if state else 0} bytes")
+        if first is not None:
+            failures.append("an interrupted download was reported as saved")
+        if not state or state['bytes_uploaded'] != MEDIA_PART_SIZE:
+            failures.append(f"expected one saved part of {MEDIA_PART_SIZE} bytes")
+
+        s3_path = download_media(url, 'images', MEDIA_ID)
+        print(f"Resumed download returned {s3_path}")
+        for number, headers in enumerate(media_requests, 1):
+            print(f"Request {number}: Range={headers['Range']}, Accept-Encoding={headers['Accept-Encoding']}")
+
+        if any(headers['Accept-Encoding'] != 'identity' for headers in media_requests):
+            failures.append("media requests must ask for the identity encoding")
+        if len(media_requests) != 2 or media_requests[1]['Range'] != f"bytes={MEDIA_PART_SIZE}-":
+            failures.append(f"expected the second request to resume from byte {MEDIA_PART_SIZE}")
+        if s3_path is None:
+            failures.append("the resumed download failed")
+        else:
+            stored = s3_client.get_object(Bucket=MEDIA_BUCKET, Key=s3_path)['Body'].read()
+            print(f"Stored object: {len(stored)} bytes (expected {len(PAYLOAD)})")
+            if stored != PAYLOAD:
+                failures.append("the stored object differs from the image")
+        if load_upload_state(f"ifixit/images/{MEDIA_ID}/original.jpg"):
+            failures.append("upload state was not cleared after completing")
+    finally:
+        server.shutdown()
+        mock.stop()
+        shutil.rmtree(CHECK_STATE_DIR, ignore_errors=True)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK: interrupted upload resumed from the last saved part")
@@ -0,0 +1,256 @@
+import psycopg2
+import psycopg2.extras
+import sys
+from datetime import datetime, timedelta
+from enhanced_api_server import (
+    db_params, build_guides_query, build_guide_query, build_steps_query, build_categories_query,
+    build_category_query, build_product_query, build_tags_query, build_export_query, build_prefix_tsquery,
+    GUIDE_DOCUMENT_QUERY, GUIDE_STEP_MEDIA_QUERY, GUIDE_TAGS_QUERY, SUBCATEGORIES_QUERY, CATEGORY_GUIDES_QUERY,
+    PRODUCTS_QUERY, PRODUCTS_AFTER_QUERY, PRODUCT_GUIDES_QUERY, PRODUCT_WIKIS_QUERY, SEARCH_QUERY,
+    TOP_CATEGORIES_QUERY, TOP_TAGS_QUERY, EXPORTS, RAW_DATA_INCLUDES
+)
+
+# EXPLAIN-based check that the API server's hot queries use indexes.
+# Run it against a local database set up with enhanced_db_setup.py:
+#   python3 check_query_plans.py --seed      seed a synthetic dataset, then check
+#   python3 check_query_plans.py             check against the data already there
+#   python3 check_query_plans.py --cleanup   remove the synthetic dataset
+# Exits non-zero if any checked query plans a sequential scan on a large table.
+# The queries come from the builders and constants enhanced_api_server.py and
+# enhanced_api_server_async.py both execute (the latter with $n placeholders),
+# so a change to the server's SQL is checked without editing this file.
+
+# Tables large enough in production that a sequential scan on them is a problem
+CHECKED_TABLES = {'guides', 'steps', 'media', 'categories', 'tags', 'guide_tags', 'products', 'product_guides',
+                  'product_wikis', 'guide_documents', 'category_stats', 'tag_stats'}
+
+SEED_GUIDES = 50000
+SEED_CATEGORIES = 5000
+SEED_TAGS = 2000
+SEED_PRODUCTS = 5000
+
+seed_statements = [
+    f"""
+    INSERT INTO categories (title, display_title, category_path, wikiid)
+    SELECT 'plancheck-cat-' || n, 'Plancheck Category ' || n, 'plancheck-cat-' || n, 900000000 + n
+    FROM generate_series(1, {SEED_CATEGORIES}) n
+    """,
+    """
+    INSERT INTO categories (title, display_title, category_path, parent_id)
+    SELECT 'plancheck-sub-' || c.id, 'Plancheck Subcategory ' || c.id, c.title || '/sub', c.id
+    FROM categories c WHERE c.title LIKE 'plancheck-cat-%'
+    """,
+    f"""
+    INSERT INTO guides (source_id, external_id, title, subject, type, difficulty, category, summary, modified_date)
+    SELECT 1, 'plancheck-' || n, 'Plancheck guide ' || n, 'Subject ' || n, 'replacement', 'Easy',
+           'plancheck-cat-' || (n % {SEED_CATEGORIES} + 1), 'Replace the part in device ' || n, 0
+    FROM generate_series(1, {SEED_GUIDES}) n
+    """,
+    """
+    INSERT INTO steps (guide_id, external_id, orderby, title)
+    SELECT g.id, 'plancheck-step-' || k, k, 'Step ' || k
+    FROM guides g, generate_series(1, 5) k
+    WHERE g.external_id LIKE 'plancheck-%'
+    """,
+    """
+    INSERT INTO media (guide_id, step_id, media_type, external_id, s3_path)
+    SELECT s.guide_id, s.id, 'images', 'plancheck-' || s.id || '-' || k, 'ifixit/images/plancheck/' || s.id || '-' || k
+    FROM steps s, generate_series(1, 2) k
+    WHERE s.external_id LIKE 'plancheck-step-%'
+    """,
+    """
+    INSERT INTO media (guide_id, step_id, media_type, external_id, s3_path)
+    SELECT g.id, NULL, 'images', 'plancheck-main-' || g.id, 'ifixit/images/plancheck/main-' || g.id
+    FROM guides g WHERE g.external_id LIKE 'plancheck-%'
+    """,
+    f"""
+    INSERT INTO tags (name)
+    SELECT 'plancheck-tag-' || n FROM generate_series(1, {SEED_TAGS}) n
+    ON CONFLICT DO NOTHING
+    """,
+    f"""
+    INSERT INTO guide_tags (guide_id, tag_id)
+    SELECT g.id, t.id
+    FROM guides g, generate_series(0, 2) k, tags t
+    WHERE g.external_id LIKE 'plancheck-%'
+      AND t.name = 'plancheck-tag-' || ((g.id + k * 7) % {SEED_TAGS} + 1)
+    ON CONFLICT DO NOTHING
+    """,
+    f"""
+    INSERT INTO products (itemcode, productcode, title)
+    SELECT 'plancheck-' || n, 'PC' || n, 'Plancheck product ' || n
+    FROM generate_series(1, {SEED_PRODUCTS}) n
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO product_guides (product_id, guide_id)
+    SELECT p.id, g.id
+    FROM products p JOIN guides g ON g.external_id = 'plancheck-' || (p.id % 1000 + 1)
+    WHERE p.itemcode LIKE 'plancheck-%'
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO product_wikis (product_id, wiki_id)
+    SELECT p.id, 900000000 + (p.id % 1000 + 1)
+    FROM products p WHERE p.itemcode LIKE 'plancheck-%'
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO guide_documents (guide_id, external_id, document)
+    SELECT g.id, g.external_id, json_build_object('id', g.id, 'title', g.title)
+    FROM guides g WHERE g.external_id LIKE 'plancheck-%'
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO category_stats (category_id, title, display_title, guide_count)
+    SELECT c.id, c.title, c.display_title, COUNT(g.id)
+    FROM categories c
+    JOIN guides g ON c.title = g.category
+    WHERE c.title LIKE 'plancheck-cat-%'
+    GROUP BY c.id, c.title, c.display_title
+    ON CONFLICT (category_id) DO UPDATE SET guide_count = EXCLUDED.guide_count
+    """,
+    """
+    INSERT INTO tag_stats (tag_id, name, guide_count)
+    SELECT t.id, t.name, COUNT(gt.guide_id)
+    FROM tags t
+    JOIN guide_tags gt ON t.id = gt.tag_id
+    WHERE t.name LIKE 'plancheck-tag-%'
+    GROUP BY t.id, t.name
+    ON CONFLICT (tag_id) DO UPDATE SET guide_count = EXCLUDED.guide_count
+    """
+]
+
+cleanup_statements = [
+    "DELETE FROM product_wikis WHERE product_id IN (SELECT id FROM products WHERE itemcode LIKE 'plancheck-%')",
+    "DELETE FROM product_guides WHERE product_id IN (SELECT id FROM products WHERE itemcode LIKE 'plancheck-%')",
+    "DELETE FROM products WHERE itemcode LIKE 'plancheck-%'",
+    "DELETE FROM guide_tags WHERE guide_id IN (SELECT id FROM guides WHERE external_id LIKE 'plancheck-%')",
+    "DELETE FROM tag_stats WHERE tag_id IN (SELECT id FROM tags WHERE name LIKE 'plancheck-tag-%')",
+    "DELETE FROM tags WHERE name LIKE 'plancheck-tag-%'",
+    "DELETE FROM guide_documents WHERE guide_id IN (SELECT id FROM guides WHERE external_id LIKE 'plancheck-%')",
+    "DELETE FROM media WHERE guide_id IN (SELECT id FROM guides WHERE external_id LIKE 'plancheck-%')",
+    "DELETE FROM steps WHERE guide_id IN (SELECT id FROM guides WHERE external_id LIKE 'plancheck-%')",
+    "DELETE FROM guides WHERE external_id LIKE 'plancheck-%'",
+    "DELETE FROM category_stats WHERE category_id IN (SELECT id FROM categories WHERE title LIKE 'plancheck-%')",
+    "DELETE FROM categories WHERE title LIKE 'plancheck-sub-%'",
+    "DELETE FROM categories WHERE title LIKE 'plancheck-cat-%'"
+]
+
+# Function to pick sample parameter values from the middle of the data
+def sample_values(cursor):
+    cursor.execute("SELECT id, external_id, category FROM guides ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM guides) LIMIT 1")
+    guide = cursor.fetchone()
+    cursor.execute("SELECT id, title, display_title FROM categories WHERE parent_id IS NULL ORDER BY id OFFSET (SELECT COUNT(*) / 4 FROM categories) LIMIT 1")
+    category = cursor.fetchone()
+    cursor.execute("SELECT id, itemcode, COALESCE(title, '') AS title FROM products ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM products) LIMIT 1")
+    product = cursor.fetchone()
+    cursor.execute("SELECT id, name FROM tags ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM tags) LIMIT 1")
+    tag = cursor.fetchone()
+    cursor.execute("""
+        SELECT tag_id AS id, name, guide_count FROM tag_stats
+        ORDER BY -guide_count, name, tag_id OFFSET (SELECT COUNT(*) / 2 FROM tag_stats) LIMIT 1
+    """)
+    popular_tag = cursor.fetchone()
+    return guide, category, product, tag, popular_tag
+
+# Queries issued by enhanced_api_server.py, with sample parameters. Each check is
+# (name, query, params, streamed); streamed queries run on a server-side cursor and
+# are explained as DECLARE ... CURSOR so the planner sees them the same way.
+def build_checks(guide, category, product, tag, popular_tag):
+    recent = datetime.now() - timedelta(hours=1)
+    search_text = 'plancheck 4242'
+    checks = [
+        ("guide document", GUIDE_DOCUMENT_QUERY, (guide['external_id'],), False),
+        ("guide by external_id", build_guide_query(), (guide['external_id'],), False),
+        ("steps of a guide", build_steps_query(), (guide['id'],), False),
+        ("step media of a guide", GUIDE_STEP_MEDIA_QUERY, (guide['id'],), False),
+        ("tags of a guide", GUIDE_TAGS_QUERY, (guide['id'],), False),
+        ("top-level categories", *build_categories_query(None), True),
+        ("child categories", *build_categories_query(category['id']), True),
+        ("category by title", build_category_query(), (category['title'], category['title']), False),
+        ("subcategories", SUBCATEGORIES_QUERY, (category['id'],), False),
+        ("guides in category", CATEGORY_GUIDES_QUERY, (category['title'],), False),
+        ("products first page", PRODUCTS_QUERY, (20, 0), False),
+        ("products keyset page", PRODUCTS_AFTER_QUERY, (product['title'], product['id'], 20), False),
+        ("product by itemcode", build_product_query(), (product['itemcode'],), False),
+        ("guides of a product", PRODUCT_GUIDES_QUERY, (product['id'],), False),
+        ("wikis of a product", PRODUCT_WIKIS_QUERY, (product['id'],), False),
+        ("tags by name first page", *build_tags_query('name', None, 100, 0), False),
+        ("tags by name keyset page", *build_tags_query('name', (tag['name'], tag['id']), 100, 0), False),
+        ("tags by popularity first page", *build_tags_query('popularity', None, 100, 0), False),
+        ("tags by popularity keyset page",
+         *build_tags_query('popularity', (popular_tag['guide_count'], popular_tag['name'], popular_tag['id']), 100, 0), False),
+        ("search", SEARCH_QUERY, (build_prefix_tsquery(search_text), search_text, 20, 0), False),
+        ("top categories", TOP_CATEGORIES_QUERY, (), False),
+        ("top tags", TOP_TAGS_QUERY, (), False)
+    ]
+
+    guide_lists = [
+        ("guides first page", (None, None, None, None)),
+        ("guides keyset page", (None, None, None, (guide['id'],))),
+        ("guides by category", (guide['category'], None, None, None)),
+        ("guides by tag", (None, tag['name'], None, None)),
+        ("guides by search", (None, None, search_text, None))
+    ]
+    for name, (category_filter, tag_filter, search_filter, after) in guide_lists:
+        checks.append((name, *build_guides_query(category_filter, tag_filter, search_filter, after, 20, 0), False))
+
+    for entity in EXPORTS:
+        checks.append((f"{entity} export since", *build_export_query(entity, RAW_DATA_INCLUDES, recent), True))
+    return checks
+
+# Function to collect sequential scans on checked tables from a JSON plan
+def find_seq_scans(plan):
+    scans = []
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in CHECKED_TABLES:
+        scans.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        scans.extend(find_seq_scans(child))
+    return scans
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    try:
+        if '--cleanup' in sys.argv:
+            for statement in cleanup_statements:
+                cursor.execute(statement)
+            conn.commit()
+            print("Removed synthetic dataset")
+            sys.exit(0)
+
+        if '--seed' in sys.argv:
+            print("Seeding synthetic dataset...")
+            for statement in seed_statements:
+                cursor.execute(statement)
+            conn.commit()
+
+        conn.autocommit = True
+        cursor.execute("ANALYZE")
+
+        checks = build_checks(*sample_values(cursor))
+        failures = 0
+        for name, query, params, streamed in checks:
+            if streamed:
+                # DECLARE needs a transaction block; nothing is fetched, so it is rolled back
+                cursor.execute("BEGIN")
+                cursor.execute("EXPLAIN (FORMAT JSON) DECLARE plancheck_cursor CURSOR FOR " + query, params)
+                plan = cursor.fetchone()['QUERY PLAN'][0]['Plan']
+                cursor.execute("ROLLBACK")
+            else:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = cursor.fetchone()['QUERY PLAN'][0]['Plan']
+            seq_scans = find_seq_scans(plan)
+            if seq_scans:
+                failures += 1
+                print(f"FAIL  {name}: sequential scan on {', '.join(seq_scans)}")
+            else:
+                print(f"ok    {name}")
+
+        print(f"{failures} of {len(checks)} queries use sequential scans")
+        sys.exit(1 if failures else 0)
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+import random
+import multiprocessing
+
+# Short leases and backoff so expiry and retries happen within the check
+CHECK_CRAWL_ID = f"check-{os.getpid()}-{int(time.time())}"
+os.environ['CRAWL_ID'] = CHECK_CRAWL_ID
+os.environ['LEASE_SECONDS'] = '3'
+os.environ['RETRY_DELAY_SECONDS'] = '1'
+
+import psycopg2
+import enhanced_ifixit_fetcher
+from enhanced_ifixit_fetcher import db_params, enqueue_work, claim_work, finish_work, has_open_work
+
+# Multi-process check of the crawl_work queue behind enhanced_ifixit_fetcher.py --distributed.
+# Run it against a local Postgres set up with enhanced_db_setup.py:
+#   python3 check_work_queue.py [workers] [items]
+# Several worker processes lease synthetic items from one crawl. Every seventh item fails
+# on its first attempt and must be retried, and one worker exits while holding leases,
+# which must expire and be taken over. Exits non-zero if any item doesn't end up done
+# or is completed by more than one worker. The synthetic crawl is deleted afterwards.
+
+WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+ITEMS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+CLAIM_SIZE = 5
+CRASHED_ITEMS = 5
+
+# Function run by each worker process: lease and complete items until none are left
+def run_worker(worker_number, completions):
+    enhanced_ifixit_fetcher.WORKER_ID = f"check-worker-{worker_number}"
+
+    conn = psycopg2.connect(**db_params)
+    completed = []
+    try:
+        while True:
+            items = claim_work(conn, ['check'], CLAIM_SIZE)
+            if not items:
+                if not has_open_work(conn, ['check']):
+                    break
+                time.sleep(0.2)
+                continue
+
+            for item in items:
+                time.sleep(random.uniform(0, 0.01))
+                if int(item['work_key']) % 7 == 0 and item['attempts'] == 1:
+                    finish_work(conn, item, error=Exception("simulated failure"))
+                elif finish_work(conn, item):
+                    completed.append(item['work_key'])
+    finally:
+        conn.close()
+    completions.put((worker_number, completed))
+
+# Function run by the crashing worker: leases items and exits without finishing them
+def run_crashing_worker():
+    enhanced_ifixit_fetcher.WORKER_ID = 'check-worker-crashed'
+
+    conn = psycopg2.connect(**db_params)
+    items = claim_work(conn, ['check'], CRASHED_ITEMS)
+    print(f"Crashing worker leased {len(items)} items")
+    os._exit(0)
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(**db_params)
+    try:
+        enqueue_work(conn, 'check', [(item_number, None) for item_number in range(ITEMS)])
+        conn.commit()
+        print(f"Queued {ITEMS} items in crawl {CHECK_CRAWL_ID}")
+
+        crasher = multiprocessing.Process(target=run_crashing_worker)
+        crasher.start()
+        crasher.join()
+
+        check_start = time.time()
+        completions = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_worker, args=(worker_number, completions)) for worker_number in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        results = [completions.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        completed_by = {}
+        for worker_number, completed in results:
+            print(f"Worker {worker_number} completed {len(completed)} items")
+            for work_key in completed:
+                completed_by.setdefault(work_key, []).append(worker_number)
+        duplicates = {work_key: numbers for work_key, numbers in completed_by.items() if len(numbers) > 1}
+
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT status, COUNT(*)
+            FROM crawl_work
+            WHERE crawl_id = %s
+            GROUP BY status
+        """, (CHECK_CRAWL_ID,))
+        statuses = dict(cursor.fetchall())
+        cursor.execute("""
+            SELECT COUNT(*) FROM crawl_work
+            WHERE crawl_id = %s AND attempts > 1
+        """, (CHECK_CRAWL_ID,))
+        retried = cursor.fetchone()[0]
+        cursor.close()
+
+        print(f"Finished in {round(time.time() - check_start, 2)} seconds")
+        print(f"Statuses: {', '.join(f'{status}={count}' for status, count in statuses.items())}")
+        print(f"Items retried after a failure or an expired lease: {retried}")
+
+        failures = []
+        if statuses.get('done', 0) != ITEMS:
+            failures.append(f"expected {ITEMS} items done")
+        if len(completed_by) != ITEMS:
+            failures.append(f"{ITEMS - len(completed_by)} items were never completed by a worker")
+        if duplicates:
+            failures.append(f"{len(duplicates)} items completed more than once")
+        if retried < len(range(0, ITEMS, 7)):
+            failures.append("simulated failures and expired leases were not all retried")
+
+        if failures:
+            for failure in failures:
+                print(f"FAIL: {failure}")
+            sys.exit(1)
+        print("OK: every item was completed exactly once")
+    finally:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM crawl_work WHERE crawl_id = %s", (CHECK_CRAWL_ID,))
+        conn.commit()
+        cursor.close()
+        conn.close()
@@ -2,11 +2,36 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import os
+import threading
+import time
+import hashlib
+import hmac
+import urllib.parse
+import re
+import json
+import base64
+import functools
+import gzip
+import zlib
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import boto3
 from botocore.client import Config
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -22,18 +47,598 @@ db_params = {
 }
 
 # S3 configuration
-s3_client = boto3.client(
-    's3',
-    config=Config(signature_version='s3v4')
-)
+boto_session = boto3.session.Session()
+
+# Function to create the S3 client used for presigning
+def create_s3_client():
+    return boto_session.client(
+        's3',
+        config=Config(signature_version='s3v4')
+    )
+
+s3_client = create_s3_client()
 MEDIA_BUCKET = os.getenv('MEDIA_BUCKET')
 
-# Helper function to get DB connection
+# Presigned URL cache settings. URLs are signed with the start of the current
+# window as their timestamp, so the same key gets the same URL for the whole
+# window and browsers/CDNs can cache the image.
+PRESIGN_WINDOW = int(os.getenv('PRESIGN_WINDOW', '3600'))  # seconds a URL stays the same
+PRESIGN_CACHE_SIZE = int(os.getenv('PRESIGN_CACHE_SIZE', '50000'))  # max cached URLs (LRU)
+
+presign_lock = threading.Lock()
+presign_cache = OrderedDict()  # s3_path -> url signed for presign_window_start
+presign_window_start = None
+presign_signing_keys = {}  # (secret key, date, region) -> derived SigV4 signing key
+presign_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Function to URI-encode a value the way SigV4 expects
+def sigv4_quote(value, safe='-_.~'):
+    return urllib.parse.quote(value, safe=safe)
+
+# Function to get the SigV4 signing key for a date, derived once per day
+def get_signing_key(secret_key, date_stamp, region):
+    cache_key = (secret_key, date_stamp, region)
+    signing_key = presign_signing_keys.get(cache_key)
+    if signing_key is None:
+        signing_key = ('AWS4' + secret_key).encode('utf-8')
+        for part in (date_stamp, region, 's3', 'aws4_request'):
+            signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+        presign_signing_keys.clear()
+        presign_signing_keys[cache_key] = signing_key
+    return signing_key
+
+# Function to presign a GET for one key locally with SigV4 query parameters
+def sign_get_url(credentials, region, s3_path, window_start):
+    signed_at = datetime.fromtimestamp(window_start, tz=timezone.utc)
+    amz_date = signed_at.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = signed_at.strftime('%Y%m%d')
+    host = f"{MEDIA_BUCKET}.s3.{region}.amazonaws.com"
+    path = '/' + sigv4_quote(s3_path, safe='/-_.~')
+    
+    query = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f"{credentials.access_key}/{date_stamp}/{region}/s3/aws4_request",
+        'X-Amz-Date': amz_date,
+        # Valid for two windows, so a URL handed out late in its window still has a full window left
+        'X-Amz-Expires': str(min(2 * PRESIGN_WINDOW, 604800)),
+        'X-Amz-SignedHeaders': 'host'
+    }
+    if credentials.token:
+        query['X-Amz-Security-Token'] = credentials.token
+    canonical_query = '&'.join(f"{sigv4_quote(k)}={sigv4_quote(v)}" for k, v in sorted(query.items()))
+    
+    canonical_request = '\n'.join(['GET', path, canonical_query, f"host:{host}", '', 'host', 'UNSIGNED-PAYLOAD'])
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        f"{date_stamp}/{region}/s3/aws4_request",
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+    signature = hmac.new(
+        get_signing_key(credentials.secret_key, date_stamp, region),
+        string_to_sign.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    
+    return f"https://{host}{path}?{canonical_query}&X-Amz-Signature={signature}"
+
+# Function to get presigned URLs for a batch of S3 keys, from the cache where possible
+def presign_urls(s3_paths):
+    global presign_window_start
+    
+    window_start = int(time.time()) // PRESIGN_WINDOW * PRESIGN_WINDOW
+    urls = {}
+    missing = []
+    
+    with presign_lock:
+        # URLs from a past window expire sooner than promised, so drop them all
+        if presign_window_start != window_start:
+            presign_stats['evictions'] += len(presign_cache)
+            presign_cache.clear()
+            presign_window_start = window_start
+        
+        for s3_path in set(s3_paths):
+            url = presign_cache.get(s3_path)
+            if url:
+                presign_cache.move_to_end(s3_path)
+                urls[s3_path] = url
+                presign_stats['hits'] += 1
+            else:
+                missing.append(s3_path)
+                presign_stats['misses'] += 1
+    
+    if not missing:
+        return urls
+    
+    credentials = boto_session.get_credentials()
+    credentials = credentials.get_frozen_credentials() if credentials else None
+    region = s3_client.meta.region_name or 'us-east-1'
+    
+    for s3_path in missing:
+        try:
+            if credentials and '.' not in MEDIA_BUCKET:
+                urls[s3_path] = sign_get_url(credentials, region, s3_path, window_start)
+            else:
+                # Dotted bucket names need path-style URLs; let botocore handle them
+                urls[s3_path] = s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': MEDIA_BUCKET, 'Key': s3_path},
+                    ExpiresIn=PRESIGN_WINDOW
+                )
+        except Exception as e:
+            print(f"Error generating presigned URL: {e}")
+            urls[s3_path] = None
+    
+    with presign_lock:
+        if presign_window_start == window_start:
+            for s3_path in missing:
+                if urls[s3_path]:
+                    presign_cache[s3_path] = urls[s3_path]
+        while len(presign_cache) > PRESIGN_CACHE_SIZE:
+            presign_cache.popitem(last=False)
+            presign_stats['evictions'] += 1
+    
+    return urls
+
+# Connection pool settings. A request holds at most one connection, so by default each
+# process gets one connection per request thread (API_THREADS, as in gunicorn.conf.py).
+# The server as a whole opens up to API_WORKERS x DB_POOL_MAX connections, which must
+# stay below Postgres max_connections minus what the fetcher and other clients use.
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', os.getenv('API_THREADS', '4')))
+DB_POOL_MIN = min(int(os.getenv('DB_POOL_MIN', '2')), DB_POOL_MAX)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_HEALTH_CHECK_IDLE = float(os.getenv('DB_HEALTH_CHECK_IDLE', '30'))  # ping connections idle longer than this
+
+# Process-wide connection pool. It is created lazily and re-created if the
+# process id changes, so each forked WSGI worker gets its own connections.
+db_pool = None
+db_pool_pid = None
+db_pool_lock = threading.Lock()
+db_pool_slots = None  # semaphore bounding checkouts to DB_POOL_MAX, lets callers wait with a timeout
+db_last_used = {}  # id(conn) -> time the connection was returned to the pool
+db_pool_stats = {
+    'checkouts': 0,
+    'in_use': 0,
+    'checkout_timeouts': 0,
+    'broken_connections': 0,
+    'total_wait_seconds': 0.0,
+    'max_wait_seconds': 0.0
+}
+
+# Function to get the pool for this process, creating it on first use
+def get_db_pool():
+    global db_pool, db_pool_pid, db_pool_slots
+    
+    with db_pool_lock:
+        if db_pool is None or db_pool_pid != os.getpid():
+            db_pool = psycopg2.pool.ThreadedConnectionPool(
+                DB_POOL_MIN,
+                DB_POOL_MAX,
+                cursor_factory=psycopg2.extras.RealDictCursor,
+                **db_params
+            )
+            db_pool_pid = os.getpid()
+            db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+            db_last_used.clear()
+        return db_pool
+
+# Function to check that a pooled connection is still usable
+def is_connection_healthy(conn):
+    if conn.closed:
+        return False
+    if time.time() - db_last_used.get(id(conn), 0) < DB_HEALTH_CHECK_IDLE:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        conn.rollback()
+        return True
+    except Exception:
+        return False
+
+# Helper function to get DB connection from the pool
 def get_db_connection():
-    conn = psycopg2.connect(**db_params)
-    conn.cursor_factory = psycopg2.extras.RealDictCursor
+    pool = get_db_pool()
+    
+    wait_start = time.time()
+    if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with db_pool_lock:
+            db_pool_stats['checkout_timeouts'] += 1
+        raise Exception(f"Timed out after {DB_POOL_TIMEOUT}s waiting for a database connection")
+    wait_seconds = time.time() - wait_start
+    
+    try:
+        conn = pool.getconn()
+        if not is_connection_healthy(conn):
+            with db_pool_lock:
+                db_pool_stats['broken_connections'] += 1
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        db_pool_slots.release()
+        raise
+    
+    with db_pool_lock:
+        db_pool_stats['checkouts'] += 1
+        db_pool_stats['in_use'] += 1
+        db_pool_stats['total_wait_seconds'] += wait_seconds
+        db_pool_stats['max_wait_seconds'] = max(db_pool_stats['max_wait_seconds'], wait_seconds)
     return conn
 
+# Helper function to return a DB connection to the pool
+def release_db_connection(conn):
+    pool = get_db_pool()
+    db_last_used[id(conn)] = time.time()
+    try:
+        pool.putconn(conn, close=conn.closed != 0)
+    finally:
+        with db_pool_lock:
+            db_pool_stats['in_use'] -= 1
+        db_pool_slots.release()
+
+# Function to encode the sort key of the last row as an opaque page cursor
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+# Function to decode a page cursor; returns None if it is malformed or has the wrong number of keys
+def decode_cursor(page_cursor, key_count):
+    try:
+        padded = page_cursor + '=' * (-len(page_cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != key_count:
+        return None
+    return values
+
+# Function to build the response for a malformed cursor
+def invalid_cursor_response():
+    return jsonify({
+        "status": "error",
+        "message": "Invalid cursor"
+    }), 400
+
+# Compression and streaming settings
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # smaller bodies are sent as they are
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+STREAM_FETCH_SIZE = int(os.getenv('STREAM_FETCH_SIZE', '1000'))  # rows per round trip for streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes of JSON gathered before a chunk is sent
+
+# Function to pick the response encoding from Accept-Encoding: br when the brotli package is installed, else gzip
+def negotiate_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+# Function to compress a stream of byte chunks. The first chunk is flushed
+# right away so clients get the start of the response without waiting.
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    
+    first = True
+    for chunk in chunks:
+        data = compress(chunk)
+        if first:
+            data += flush()
+            first = False
+        if data:
+            yield data
+    yield finish()
+
+# Function to compress a response in place if it is large enough (streamed responses always are)
+def compress_response(response, encoding):
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return
+    
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        else:
+            response.set_data(gzip.compress(data, GZIP_LEVEL))
+    
+    response.headers['Content-Encoding'] = encoding
+    # A compressed body is a different representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+
+@app.after_request
+def compress_after_request(response):
+    if response.status_code == 200:
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding()
+        if encoding:
+            compress_response(response, encoding)
+    return response
+
+# Function to open a named (server-side) cursor that fetches STREAM_FETCH_SIZE rows per round trip
+def open_stream_cursor(conn):
+    cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+    cursor.itersize = STREAM_FETCH_SIZE
+    return cursor
+
+# Function to stream {"status": "success", "<list_key>": [...], "count": n} from a cursor,
+# encoding rows as they are fetched instead of building the list in memory
+def stream_json_rows(cursor, list_key):
+    parts = [f'{{"status": "success", "{list_key}": [']
+    size = 0
+    count = 0
+    try:
+        for row in cursor:
+            item = app.json.dumps(row)
+            parts.append(item if count == 0 else ',' + item)
+            size += len(item)
+            count += 1
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(parts).encode('utf-8')
+                parts = []
+                size = 0
+    except Exception as e:
+        # Headers are already sent, so the response can only be cut off. Re-raising makes the
+        # server abort it instead of ending it cleanly, and keeps cache_stream from caching it.
+        print(f"Error streaming {list_key}: {e}")
+        raise
+    parts.append(f'], "count": {count}}}')
+    yield ''.join(parts).encode('utf-8')
+
+# Function to encode values json can't; timestamps become ISO 8601 so they can be passed back as updated_since
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Function to stream rows from a cursor as newline-delimited JSON, one object per line
+def stream_ndjson_rows(cursor, label):
+    parts = []
+    size = 0
+    try:
+        for row in cursor:
+            line = json.dumps(row, default=export_json_default) + '\n'
+            parts.append(line)
+            size += len(line)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(parts).encode('utf-8')
+                parts = []
+                size = 0
+    except Exception as e:
+        # Headers are already sent; re-raising aborts the response so the client sees
+        # a broken transfer rather than an export that looks complete
+        print(f"Error streaming {label}: {e}")
+        raise
+    if parts:
+        yield ''.join(parts).encode('utf-8')
+
+# Function to wrap a streaming body in a response that closes the cursor and
+# returns the connection to the pool once the response is done
+def stream_response(body, conn, cursor, mimetype='application/json'):
+    def close():
+        try:
+            cursor.close()
+        finally:
+            release_db_connection(conn)
+    
+    response = app.response_class(body, mimetype=mimetype)
+    response.call_on_close(close)
+    return response
+
+# Response cache settings. Entries are keyed on the data version, the presign
+# window and the normalized request, so a fetcher write or a new presign window
+# makes old entries unreachable; the TTL and LRU size bound what is left over.
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2000'))  # max cached responses per process (LRU)
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '300'))  # seconds a cached response is kept
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', '0'))  # Cache-Control max-age sent to clients
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL')  # optional cache shared between workers
+RESPONSE_CACHE_MAX_BODY = int(os.getenv('RESPONSE_CACHE_MAX_BODY', str(4 * 1024 * 1024)))  # larger bodies aren't cached
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv('DATA_VERSION_CHECK_INTERVAL', '5'))  # seconds between data version reads
+
+response_cache_lock = threading.Lock()
+response_cache = OrderedDict()  # cache key -> (expires_at, body, content encoding or '')
+response_cache_stats = {
+    'hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+    'not_modified': 0,
+    'evictions': 0,
+    'expired': 0,
+    'shared_errors': 0
+}
+data_version_state = {'version': None, 'updated_at': None, 'checked_at': 0}
+shared_cache = None
+
+# Function to get the shared cache client, or None when it is not configured
+def get_shared_cache():
+    global shared_cache
+    
+    if not RESPONSE_CACHE_REDIS_URL or redis is None:
+        return None
+    if shared_cache is None:
+        shared_cache = redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL, socket_timeout=0.5)
+    return shared_cache
+
+# Function to get the current data version, re-read at most every DATA_VERSION_CHECK_INTERVAL seconds
+def get_data_version():
+    now = time.time()
+    with response_cache_lock:
+        if now - data_version_state['checked_at'] < DATA_VERSION_CHECK_INTERVAL:
+            return data_version_state['version'], data_version_state['updated_at']
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT version, updated_at FROM data_version WHERE id = 1")
+        row = cursor.fetchone()
+        conn.rollback()
+    except Exception as e:
+        print(f"Error reading data version: {e}")
+        row = None
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+        if 'conn' in locals() and conn:
+            release_db_connection(conn)
+    
+    with response_cache_lock:
+        if row:
+            if row['version'] != data_version_state['version']:
+                # Everything cached so far belongs to an older version
+                response_cache_stats['evictions'] += len(response_cache)
+                response_cache.clear()
+            data_version_state['version'] = row['version']
+            data_version_state['updated_at'] = row['updated_at']
+        data_version_state['checked_at'] = now
+        return data_version_state['version'], data_version_state['updated_at']
+
+# Function to build the cache key part for the current request: route plus sorted, non-empty query args
+def normalized_request_key():
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if value != '')
+    return f"{request.path}?{urllib.parse.urlencode(args)}"
+
+# Function to look up a cached (body, content encoding), falling back to the shared cache
+def get_cached_response(cache_key):
+    now = time.time()
+    with response_cache_lock:
+        entry = response_cache.get(cache_key)
+        if entry and entry[0] > now:
+            response_cache.move_to_end(cache_key)
+            response_cache_stats['hits'] += 1
+            return entry[1], entry[2]
+        if entry:
+            del response_cache[cache_key]
+            response_cache_stats['expired'] += 1
+    
+    value = None
+    client = get_shared_cache()
+    if client:
+        try:
+            value = client.get(f"ifixit-api:{cache_key}")
+        except Exception as e:
+            print(f"Error reading shared response cache: {e}")
+            with response_cache_lock:
+                response_cache_stats['shared_errors'] += 1
+    
+    with response_cache_lock:
+        if value is None:
+            response_cache_stats['misses'] += 1
+            return None
+        # Shared entries are stored as b"<content encoding>:<body>"
+        content_encoding, body = value.split(b':', 1)
+        content_encoding = content_encoding.decode('ascii')
+        response_cache_stats['shared_hits'] += 1
+        response_cache[cache_key] = (now + RESPONSE_CACHE_TTL, body, content_encoding)
+    return body, content_encoding
+
+# Function to store a response body in the local and shared caches
+def store_cached_response(cache_key, body, content_encoding):
+    if len(body) > RESPONSE_CACHE_MAX_BODY:
+        return
+    
+    with response_cache_lock:
+        response_cache[cache_key] = (time.time() + RESPONSE_CACHE_TTL, body, content_encoding)
+        response_cache.move_to_end(cache_key)
+        while len(response_cache) > RESPONSE_CACHE_SIZE:
+            response_cache.popitem(last=False)
+            response_cache_stats['evictions'] += 1
+    
+    client = get_shared_cache()
+    if client:
+        try:
+            client.setex(f"ifixit-api:{cache_key}", RESPONSE_CACHE_TTL, content_encoding.encode('ascii') + b':' + body)
+        except Exception as e:
+            print(f"Error writing shared response cache: {e}")
+            with response_cache_lock:
+                response_cache_stats['shared_errors'] += 1
+
+# Function to pass a streamed body through while keeping a copy for the cache, up to RESPONSE_CACHE_MAX_BODY.
+# Only a body whose chunks ran to the end is stored; an error mid-stream propagates before the store.
+def cache_stream(cache_key, chunks, content_encoding):
+    kept = []
+    size = 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size <= RESPONSE_CACHE_MAX_BODY:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None:
+        store_cached_response(cache_key, b''.join(kept), content_encoding)
+
+# Decorator for read endpoints: serves cached bodies, sets ETag/Last-Modified and answers conditional requests with 304
+def cached_response(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, version_updated_at = get_data_version()
+        if version is None:
+            # No data version to validate against (e.g. migrations not applied yet)
+            return view(*args, **kwargs)
+        
+        # Responses carry presigned URLs, so they also change with the presign window
+        window_start = int(time.time()) // PRESIGN_WINDOW * PRESIGN_WINDOW
+        request_key = normalized_request_key()
+        etag = hashlib.sha256(f"{version}:{window_start}:{request_key}".encode('utf-8')).hexdigest()[:32]
+        last_modified = max(version_updated_at, datetime.fromtimestamp(window_start, timezone.utc)).replace(microsecond=0)
+        
+        # Bodies are cached compressed, once per negotiated encoding
+        encoding = negotiate_encoding()
+        cache_key = f"{version}:{window_start}:{encoding or 'identity'}:{request_key}"
+        matched_etag = next((
+            candidate for candidate in (etag, f"{etag}-gzip", f"{etag}-br")
+            if request.if_none_match.contains(candidate)
+        ), None)
+        
+        if matched_etag or (
+            not request.if_none_match and request.if_modified_since and request.if_modified_since >= last_modified
+        ):
+            with response_cache_lock:
+                response_cache_stats['not_modified'] += 1
+            response = app.response_class(status=304)
+            response.set_etag(matched_etag or etag)
+        else:
+            cached = get_cached_response(cache_key)
+            if cached is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+                if encoding:
+                    compress_response(response, encoding)
+                content_encoding = response.headers.get('Content-Encoding', '')
+                if response.is_streamed:
+                    response.response = cache_stream(cache_key, response.iter_encoded(), content_encoding)
+                else:
+                    store_cached_response(cache_key, response.get_data(), content_encoding)
+            else:
+                body, content_encoding = cached
+                response = app.response_class(body, mimetype='application/json')
+                if content_encoding:
+                    response.headers['Content-Encoding'] = content_encoding
+                    response.set_etag(f"{etag}-{content_encoding}")
+                else:
+                    response.set_etag(etag)
+        
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = RESPONSE_CACHE_MAX_AGE
+        response.cache_control.must_revalidate = True
+        return response
+    return wrapper
+
 @app.route('/')
 def home():
     return jsonify({
@@ -46,11 +651,67 @@ def home():
             "/api/categories/<title>",
             "/api/products",
             "/api/products/<itemcode>",
-            "/api/tags"
+            "/api/tags",
+            "/api/search",
+            "/api/export/<guides|categories|products>",
+            "/api/stats",
+            "/api/pool",
+            "/api/cache"
         ]
     })
 
+# Queries are written with %s parameters. Both servers run the same SQL: the builders below take
+# placeholder(n), which renders the n-th parameter (%s here, $n for asyncpg in enhanced_api_server_async.py).
+PSYCOPG_PLACEHOLDER = lambda number: '%s'
+
+# Function to render the %s parameters of a query with placeholder(n)
+def render_placeholders(query, placeholder=PSYCOPG_PLACEHOLDER):
+    parts = query.split('%s')
+    return parts[0] + ''.join(placeholder(number) + part for number, part in enumerate(parts[1:], 1))
+
+# Function to build the /api/guides query and its parameters
+def build_guides_query(category, tag, search, after, limit, offset, placeholder=PSYCOPG_PLACEHOLDER):
+    query = """
+        SELECT g.id, g.external_id, g.title, g.subject, 
+               g.type, g.difficulty, g.category,
+               m.s3_path as image_path
+        FROM guides g
+        LEFT JOIN media m ON g.id = m.guide_id AND m.step_id IS NULL
+    """
+    
+    params = []
+    where_clauses = []
+    
+    if category:
+        where_clauses.append("g.category = %s")
+        params.append(category)
+    
+    if tag:
+        query += " JOIN guide_tags gt ON g.id = gt.guide_id JOIN tags t ON gt.tag_id = t.id"
+        where_clauses.append("t.name = %s")
+        params.append(tag)
+    
+    if search:
+        where_clauses.append("g.search_vector @@ to_tsquery('english', %s)")
+        params.append(build_prefix_tsquery(search))
+    
+    if after:
+        where_clauses.append("g.id > %s")
+        params.append(after[0])
+    
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    
+    if after:
+        query += " ORDER BY g.id LIMIT %s"
+        params.append(limit)
+    else:
+        query += " ORDER BY g.id LIMIT %s OFFSET %s"
+        params.extend([limit, offset])
+    return render_placeholders(query, placeholder), params
+
 @app.route('/api/guides', methods=['GET'])
+@cached_response
 def get_guides():
     try:
         # Parse query parameters
@@ -59,62 +720,34 @@ def get_guides():
         category = request.args.get('category')
         tag = request.args.get('tag')
         search = request.args.get('search')
+        page_cursor = request.args.get('cursor')
+        
+        # Keyset pagination: a cursor replaces the offset
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 1)
+            if after is None:
+                return invalid_cursor_response()
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Build query
-        query = """
-            SELECT g.id, g.external_id, g.title, g.subject, 
-                   g.type, g.difficulty, g.category,
-                   m.s3_path as image_path
-            FROM guides g
-            LEFT JOIN media m ON g.id = m.guide_id AND m.step_id IS NULL
-        """
-        
-        params = []
-        where_clauses = []
-        
-        if category:
-            where_clauses.append("g.category = %s")
-            params.append(category)
-        
-        if tag:
-            query += " JOIN guide_tags gt ON g.id = gt.guide_id JOIN tags t ON gt.tag_id = t.id"
-            where_clauses.append("t.name = %s")
-            params.append(tag)
-        
-        if search:
-            where_clauses.append("g.title ILIKE %s")
-            search_param = f"%{search}%"
-            params.append(search_param)
-        
-        if where_clauses:
-            query += " WHERE " + " AND ".join(where_clauses)
-        
-        query += " ORDER BY g.id LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        
+        query, params = build_guides_query(category, tag, search, after, limit, offset)
         cursor.execute(query, params)
         guides = cursor.fetchall()
+        next_cursor = encode_cursor([guides[-1]['id']]) if len(guides) == limit else None
         
-        # Generate presigned URLs for images
+        # Generate presigned URLs for images in one batch
+        urls = presign_urls([guide['image_path'] for guide in guides if guide['image_path']])
         for guide in guides:
             if guide['image_path']:
-                try:
-                    guide['image_url'] = s3_client.generate_presigned_url(
-                        'get_object',
-                        Params={'Bucket': MEDIA_BUCKET, 'Key': guide['image_path']},
-                        ExpiresIn=3600
-                    )
-                except Exception as e:
-                    print(f"Error generating presigned URL: {e}")
-                    guide['image_url'] = None
+                guide['image_url'] = urls.get(guide['image_path'])
         
         return jsonify({
             "status": "success",
             "count": len(guides),
-            "guides": guides
+            "guides": guides,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         print(f"Error in get_guides: {e}")
@@ -126,88 +759,161 @@ def get_guides():
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Fields a guide response can be projected to with ?fields=, and blobs it can add with ?include=.
+# Responses are lean by default: step text comes as each step's "lines", raw_data only on request.
+GUIDE_FIELDS = ['id', 'external_id', 'title', 'subject', 'type', 'difficulty', 'category', 'image', 'steps', 'tags']
+GUIDE_COLUMNS = ['external_id', 'title', 'subject', 'type', 'difficulty', 'category']
+GUIDE_INCLUDES = ['raw_data', 'step_raw_data']
+
+# Function to parse a comma-separated projection parameter; returns None if it names an unknown value.
+# args defaults to the Flask request's query string; the async server passes its own.
+def parse_projection(param, allowed, default, args=None):
+    value = (request.args if args is None else args).get(param)
+    if value is None:
+        return list(default)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    if any(name not in allowed for name in names):
+        return None
+    return names
+
+# Function to build the error message for an unknown projection value
+def invalid_projection_message(param, allowed):
+    return f"Invalid {param}; allowed values: {', '.join(allowed)}"
+
+# Function to build the response for an unknown projection value
+def invalid_projection_response(param, allowed):
+    return jsonify({
+        "status": "error",
+        "message": invalid_projection_message(param, allowed)
+    }), 400
+
+# Function to keep only the requested top-level fields of a guide document
+def project_guide(guide, fields):
+    keys = set(fields) | ({'image_path'} if 'image' in fields else set())
+    return {key: value for key, value in guide.items() if key in keys}
+
+# Queries behind the guide document. The SQL the views run lives in these constants and build_*_query
+# functions so check_query_plans.py can EXPLAIN exactly the same statements.
+GUIDE_DOCUMENT_QUERY = """
+    SELECT document FROM guide_documents WHERE external_id = %s LIMIT 1
+"""
+GUIDE_STEP_MEDIA_QUERY = """
+    SELECT step_id,
+           json_agg(json_build_object(
+               'id', id,
+               'media_type', media_type,
+               'external_id', external_id,
+               's3_path', s3_path
+           ) ORDER BY id) AS media
+    FROM media
+    WHERE guide_id = %s AND step_id IS NOT NULL
+    GROUP BY step_id
+"""
+GUIDE_TAGS_QUERY = """
+    SELECT t.id, t.name
+    FROM tags t
+    JOIN guide_tags gt ON t.id = gt.tag_id
+    WHERE gt.guide_id = %s
+"""
+
+# Function to build the guide details query; column names come from GUIDE_COLUMNS, never from the request
+def build_guide_query(fields=GUIDE_FIELDS, include=(), placeholder=PSYCOPG_PLACEHOLDER):
+    columns = ['g.id'] + [f"g.{field}" for field in GUIDE_COLUMNS if field in fields]
+    if 'image' in fields:
+        columns.append('m.s3_path as image_path')
+    if 'raw_data' in include:
+        columns.append('g.raw_data')
+    return f"""
+        SELECT {', '.join(columns)}
+        FROM guides g
+        {'LEFT JOIN media m ON g.id = m.guide_id AND m.step_id IS NULL' if 'image' in fields else ''}
+        WHERE g.external_id = {placeholder(1)}
+    """
+
+# Function to build the steps query, with only the lines of raw_data unless the whole blob was asked for
+def build_steps_query(include=(), placeholder=PSYCOPG_PLACEHOLDER):
+    return f"""
+        SELECT s.id, s.external_id, s.orderby, s.title, s.raw_data->'lines' AS lines
+               {', s.raw_data' if 'step_raw_data' in include else ''}
+        FROM steps s
+        WHERE s.guide_id = {placeholder(1)}
+        ORDER BY s.orderby
+    """
+
+# Function to build a guide document from the guide tables, selecting only the requested columns
+def build_guide_document(cursor, guide_id, fields=GUIDE_FIELDS, include=()):
+    # Get guide details
+    cursor.execute(build_guide_query(fields, include), (guide_id,))
+    
+    guide = cursor.fetchone()
+    if not guide:
+        return None
+    
+    if 'steps' in fields:
+        # Get steps
+        cursor.execute(build_steps_query(include), (guide['id'],))
+        
+        steps = cursor.fetchall()
+        guide['steps'] = steps
+        
+        # Get media for all steps in one query, grouped by step
+        cursor.execute(GUIDE_STEP_MEDIA_QUERY, (guide['id'],))
+        
+        step_media = {row['step_id']: row['media'] for row in cursor.fetchall()}
+        
+        for step in steps:
+            step['media'] = step_media.get(step['id'], [])
+    
+    if 'tags' in fields:
+        # Get tags
+        cursor.execute(GUIDE_TAGS_QUERY, (guide['id'],))
+        
+        guide['tags'] = cursor.fetchall()
+    
+    if 'id' not in fields:
+        guide.pop('id')
+    return guide
 
 @app.route('/api/guides/<guide_id>', methods=['GET'])
+@cached_response
 def get_guide(guide_id):
+    fields = parse_projection('fields', GUIDE_FIELDS, GUIDE_FIELDS)
+    if fields is None:
+        return invalid_projection_response('fields', GUIDE_FIELDS)
+    include = parse_projection('include', GUIDE_INCLUDES, [])
+    if include is None:
+        return invalid_projection_response('include', GUIDE_INCLUDES)
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get guide details
-        cursor.execute("""
-            SELECT g.id, g.external_id, g.title, g.subject, 
-                   g.type, g.difficulty, g.category,
-                   m.s3_path as image_path, g.raw_data
-            FROM guides g
-            LEFT JOIN media m ON g.id = m.guide_id AND m.step_id IS NULL
-            WHERE g.external_id = %s
-        """, (guide_id,))
-        
-        guide = cursor.fetchone()
-        if not guide:
+        row = None
+        if not include:
+            # Serve the lean document the fetcher precomputed with the guide: one index lookup
+            cursor.execute(GUIDE_DOCUMENT_QUERY, (guide_id,))
+            row = cursor.fetchone()
+        
+        if row:
+            guide = project_guide(row['document'], fields)
+        else:
+            guide = build_guide_document(cursor, guide_id, fields, include)
+        if guide is None:
             return jsonify({
                 "status": "error",
                 "message": "Guide not found"
             }), 404
         
-        # Get steps with raw_data
-        cursor.execute("""
-            SELECT s.id, s.external_id, s.orderby, s.title, s.raw_data
-            FROM steps s
-            WHERE s.guide_id = %s
-            ORDER BY s.orderby
-        """, (guide['id'],))
-        
-        steps = cursor.fetchall()
-        guide['steps'] = steps
-        
-        # Get media for each step
-        for step in steps:
-            cursor.execute("""
-                SELECT id, media_type, external_id, s3_path
-                FROM media
-                WHERE guide_id = %s AND step_id = %s
-            """, (guide['id'], step['id']))
-            
-            media = cursor.fetchall()
-            step['media'] = media
-            
-            # Generate presigned URLs for media
-            for item in media:
-                if item['s3_path']:
-                    try:
-                        item['url'] = s3_client.generate_presigned_url(
-                            'get_object',
-                            Params={'Bucket': MEDIA_BUCKET, 'Key': item['s3_path']},
-                            ExpiresIn=3600
-                        )
-                    except Exception as e:
-                        print(f"Error generating presigned URL: {e}")
-                        item['url'] = None
-        
-        # Get tags
-        cursor.execute("""
-            SELECT t.id, t.name
-            FROM tags t
-            JOIN guide_tags gt ON t.id = gt.tag_id
-            WHERE gt.guide_id = %s
-        """, (guide['id'],))
-        
-        tags = cursor.fetchall()
-        guide['tags'] = tags
-        
-        # Generate presigned URL for guide image
-        if guide['image_path']:
-            try:
-                guide['image_url'] = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': MEDIA_BUCKET, 'Key': guide['image_path']},
-                    ExpiresIn=3600
-                )
-            except Exception as e:
-                print(f"Error generating presigned URL: {e}")
-                guide['image_url'] = None
+        # Generate presigned URLs for step media and the guide image in one batch
+        media_items = [item for step in guide.get('steps', []) for item in step['media'] if item['s3_path']]
+        image_path = guide.get('image_path')
+        urls = presign_urls([item['s3_path'] for item in media_items] + ([image_path] if image_path else []))
+        for item in media_items:
+            item['url'] = urls.get(item['s3_path'])
+        if image_path:
+            guide['image_url'] = urls.get(image_path)
         
         return jsonify({
             "status": "success",
@@ -223,70 +929,103 @@ def get_guide(guide_id):
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Function to build the /api/categories query and its parameters
+def build_categories_query(parent_id, placeholder=PSYCOPG_PLACEHOLDER):
+    query = """
+        SELECT id, title, display_title, category_path, parent_id, wikiid
+        FROM categories
+    """
+    
+    params = []
+    where_clauses = []
+    
+    if parent_id:
+        where_clauses.append("parent_id = %s")
+        params.append(parent_id)
+    else:
+        # If no parent_id is specified, return top-level categories
+        where_clauses.append("parent_id IS NULL")
+    
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    
+    query += " ORDER BY title"
+    return render_placeholders(query, placeholder), params
 
 @app.route('/api/categories', methods=['GET'])
+@cached_response
 def get_categories():
     try:
         # Parse query parameters
         parent_id = request.args.get('parent_id')
         
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Build query
-        query = """
-            SELECT id, title, display_title, category_path, parent_id, wikiid
-            FROM categories
-        """
+        cursor = open_stream_cursor(conn)
         
-        params = []
-        where_clauses = []
-        
-        if parent_id:
-            where_clauses.append("parent_id = %s")
-            params.append(parent_id)
-        else:
-            # If no parent_id is specified, return top-level categories
-            where_clauses.append("parent_id IS NULL")
-        
-        if where_clauses:
-            query += " WHERE " + " AND ".join(where_clauses)
-        
-        query += " ORDER BY title"
+        query, params = build_categories_query(parent_id)
         
+        # Stream the rows from a server-side cursor; the response releases the connection when done
         cursor.execute(query, params)
-        categories = cursor.fetchall()
-        
-        return jsonify({
-            "status": "success",
-            "count": len(categories),
-            "categories": categories
-        })
+        return stream_response(stream_json_rows(cursor, 'categories'), conn, cursor)
     except Exception as e:
         print(f"Error in get_categories: {e}")
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+        if 'conn' in locals() and conn:
+            release_db_connection(conn)
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
+
+# Fields a category response can be projected to with ?fields=; raw_data only with ?include=raw_data
+CATEGORY_FIELDS = ['id', 'title', 'display_title', 'category_path', 'parent_id', 'wikiid', 'namespace', 'subcategories', 'guides']
+CATEGORY_COLUMNS = ['display_title', 'category_path', 'parent_id', 'wikiid', 'namespace']
+RAW_DATA_INCLUDES = ['raw_data']
+
+SUBCATEGORIES_QUERY = """
+    SELECT id, title, display_title, category_path, parent_id, wikiid
+    FROM categories
+    WHERE parent_id = %s
+    ORDER BY title
+"""
+CATEGORY_GUIDES_QUERY = """
+    SELECT id, external_id, title, subject, type, difficulty
+    FROM guides
+    WHERE category = %s
+    ORDER BY title
+    LIMIT 50
+"""
+
+# Function to build the category details query; column names come from CATEGORY_COLUMNS, never from the request
+def build_category_query(fields=CATEGORY_FIELDS, include=(), placeholder=PSYCOPG_PLACEHOLDER):
+    columns = ['id', 'title'] + [field for field in CATEGORY_COLUMNS if field in fields]
+    if 'raw_data' in include:
+        columns.append('raw_data')
+    return f"""
+        SELECT {', '.join(columns)}
+        FROM categories
+        WHERE title = {placeholder(1)} OR display_title = {placeholder(2)}
+    """
 
 @app.route('/api/categories/<path:title>', methods=['GET'])
+@cached_response
 def get_category(title):
+    fields = parse_projection('fields', CATEGORY_FIELDS, CATEGORY_FIELDS)
+    if fields is None:
+        return invalid_projection_response('fields', CATEGORY_FIELDS)
+    include = parse_projection('include', RAW_DATA_INCLUDES, [])
+    if include is None:
+        return invalid_projection_response('include', RAW_DATA_INCLUDES)
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # Get category details
-        cursor.execute("""
-            SELECT id, title, display_title, category_path, parent_id, wikiid, namespace, raw_data
-            FROM categories
-            WHERE title = %s OR display_title = %s
-        """, (title, title))
+        cursor.execute(build_category_query(fields, include), (title, title))
         
         category = cursor.fetchone()
         if not category:
@@ -295,28 +1034,23 @@ def get_category(title):
                 "message": "Category not found"
             }), 404
         
-        # Get subcategories
-        cursor.execute("""
-            SELECT id, title, display_title, category_path, parent_id, wikiid
-            FROM categories
-            WHERE parent_id = %s
-            ORDER BY title
-        """, (category['id'],))
-        
-        subcategories = cursor.fetchall()
-        category['subcategories'] = subcategories
-        
-        # Get guides in this category
-        cursor.execute("""
-            SELECT id, external_id, title, subject, type, difficulty
-            FROM guides
-            WHERE category = %s
-            ORDER BY title
-            LIMIT 50
-        """, (category['title'],))
+        if 'subcategories' in fields:
+            # Get subcategories
+            cursor.execute(SUBCATEGORIES_QUERY, (category['id'],))
+            
+            subcategories = cursor.fetchall()
+            category['subcategories'] = subcategories
         
-        guides = cursor.fetchall()
-        category['guides'] = guides
+        if 'guides' in fields:
+            # Get guides in this category
+            cursor.execute(CATEGORY_GUIDES_QUERY, (category['title'],))
+            
+            guides = cursor.fetchall()
+            category['guides'] = guides
+        
+        for key in ('id', 'title'):
+            if key not in fields:
+                category.pop(key)
         
         return jsonify({
             "status": "success",
@@ -332,32 +1066,57 @@ def get_category(title):
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Product list queries, ordered by (title, id) so a cursor can resume after any row
+PRODUCTS_QUERY = """
+    SELECT id, itemcode, productcode, title
+    FROM products
+    ORDER BY COALESCE(title, ''), id
+    LIMIT %s OFFSET %s
+"""
+PRODUCTS_AFTER_QUERY = """
+    SELECT id, itemcode, productcode, title
+    FROM products
+    WHERE (COALESCE(title, ''), id) > (%s, %s)
+    ORDER BY COALESCE(title, ''), id
+    LIMIT %s
+"""
 
 @app.route('/api/products', methods=['GET'])
+@cached_response
 def get_products():
     try:
         # Parse query parameters
         limit = min(int(request.args.get('limit', 20)), 100)  # Max 100 records
         offset = int(request.args.get('offset', 0))
+        page_cursor = request.args.get('cursor')
+        
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 2)
+            if after is None:
+                return invalid_cursor_response()
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # Get product list
-        cursor.execute("""
-            SELECT id, itemcode, productcode, title
-            FROM products
-            ORDER BY title
-            LIMIT %s OFFSET %s
-        """, (limit, offset))
+        if after:
+            cursor.execute(PRODUCTS_AFTER_QUERY, (after[0], after[1], limit))
+        else:
+            cursor.execute(PRODUCTS_QUERY, (limit, offset))
         
         products = cursor.fetchall()
+        next_cursor = None
+        if len(products) == limit:
+            next_cursor = encode_cursor([products[-1]['title'] or '', products[-1]['id']])
         
         return jsonify({
             "status": "success",
             "count": len(products),
-            "products": products
+            "products": products,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         print(f"Error in get_products: {e}")
@@ -369,20 +1128,43 @@ def get_products():
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+PRODUCT_GUIDES_QUERY = """
+    SELECT g.id, g.external_id, g.title, g.subject, g.type, g.difficulty
+    FROM guides g
+    JOIN product_guides pg ON g.id = pg.guide_id
+    WHERE pg.product_id = %s
+    ORDER BY g.title
+"""
+PRODUCT_WIKIS_QUERY = """
+    SELECT pw.wiki_id, c.title, c.display_title
+    FROM product_wikis pw
+    LEFT JOIN categories c ON pw.wiki_id = c.wikiid
+    WHERE pw.product_id = %s
+"""
+
+# Function to build the product details query, with raw_data only on request
+def build_product_query(include=(), placeholder=PSYCOPG_PLACEHOLDER):
+    return f"""
+        SELECT id, itemcode, productcode, title{', raw_data' if 'raw_data' in include else ''}
+        FROM products
+        WHERE itemcode = {placeholder(1)}
+    """
 
 @app.route('/api/products/<itemcode>', methods=['GET'])
+@cached_response
 def get_product(itemcode):
+    include = parse_projection('include', RAW_DATA_INCLUDES, [])
+    if include is None:
+        return invalid_projection_response('include', RAW_DATA_INCLUDES)
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
         # Get product details
-        cursor.execute("""
-            SELECT id, itemcode, productcode, title, raw_data
-            FROM products
-            WHERE itemcode = %s
-        """, (itemcode,))
+        cursor.execute(build_product_query(include), (itemcode,))
         
         product = cursor.fetchone()
         if not product:
@@ -392,24 +1174,13 @@ def get_product(itemcode):
             }), 404
         
         # Get related guides
-        cursor.execute("""
-            SELECT g.id, g.external_id, g.title, g.subject, g.type, g.difficulty
-            FROM guides g
-            JOIN product_guides pg ON g.id = pg.guide_id
-            WHERE pg.product_id = %s
-            ORDER BY g.title
-        """, (product['id'],))
+        cursor.execute(PRODUCT_GUIDES_QUERY, (product['id'],))
         
         guides = cursor.fetchall()
         product['guides'] = guides
         
         # Get related wikis
-        cursor.execute("""
-            SELECT pw.wiki_id, c.title, c.display_title
-            FROM product_wikis pw
-            LEFT JOIN categories c ON pw.wiki_id = c.wikiid
-            WHERE pw.product_id = %s
-        """, (product['id'],))
+        cursor.execute(PRODUCT_WIKIS_QUERY, (product['id'],))
         
         wikis = cursor.fetchall()
         product['wikis'] = wikis
@@ -428,46 +1199,77 @@ def get_product(itemcode):
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Function to build the /api/tags query and its parameters. Shared with enhanced_api_server_async.py
+# and check_query_plans.py; placeholder(n) renders the n-th parameter (%s here, $n for asyncpg).
+# Popularity reads tag_stats alone (every tag has a row) and pages with a row comparison
+# that matches idx_tag_stats_popularity ((-guide_count), name, tag_id).
+def build_tags_query(sort_by, after, limit, offset, placeholder=PSYCOPG_PLACEHOLDER):
+    if sort_by == 'popularity':
+        query = """
+            SELECT tag_id AS id, name, guide_count
+            FROM tag_stats
+        """
+        if after:
+            query += f" WHERE (-guide_count, name, tag_id) > (-{placeholder(1)}::integer, {placeholder(2)}::varchar, {placeholder(3)}::integer)"
+        query += " ORDER BY -guide_count, name, tag_id"
+    else:  # Default sort by name
+        query = """
+            SELECT t.id, t.name,
+                   (SELECT COUNT(*) FROM guide_tags gt WHERE gt.tag_id = t.id) as guide_count
+            FROM tags t
+        """
+        if after:
+            query += f" WHERE (t.name, t.id) > ({placeholder(1)}::varchar, {placeholder(2)}::integer)"
+        query += " ORDER BY t.name, t.id"
+    
+    params = list(after) if after else []
+    params.append(limit)
+    query += f" LIMIT {placeholder(len(params))}"
+    if not after:
+        params.append(offset)
+        query += f" OFFSET {placeholder(len(params))}"
+    return query, params
 
 @app.route('/api/tags', methods=['GET'])
+@cached_response
 def get_tags():
     try:
         # Parse query parameters
         limit = min(int(request.args.get('limit', 100)), 500)  # Max 500 records
         offset = int(request.args.get('offset', 0))
         sort_by = request.args.get('sort', 'name')  # Sort by name or popularity
+        page_cursor = request.args.get('cursor')
+        
+        # Keyset pagination: (guide_count, name, id) for popularity, (name, id) for name
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 3 if sort_by == 'popularity' else 2)
+            if after is None:
+                return invalid_cursor_response()
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Build query based on sort parameter
-        if sort_by == 'popularity':
-            query = """
-                SELECT t.id, t.name, COUNT(gt.guide_id) as guide_count
-                FROM tags t
-                LEFT JOIN guide_tags gt ON t.id = gt.tag_id
-                GROUP BY t.id, t.name
-                ORDER BY guide_count DESC, t.name
-                LIMIT %s OFFSET %s
-            """
-        else:  # Default sort by name
-            query = """
-                SELECT t.id, t.name, COUNT(gt.guide_id) as guide_count
-                FROM tags t
-                LEFT JOIN guide_tags gt ON t.id = gt.tag_id
-                GROUP BY t.id, t.name
-                ORDER BY t.name
-                LIMIT %s OFFSET %s
-            """
-        
-        cursor.execute(query, (limit, offset))
+        query, params = build_tags_query(sort_by, after, limit, offset)
+        
+        cursor.execute(query, params)
         tags = cursor.fetchall()
         
+        next_cursor = None
+        if len(tags) == limit:
+            last = tags[-1]
+            if sort_by == 'popularity':
+                next_cursor = encode_cursor([last['guide_count'], last['name'], last['id']])
+            else:
+                next_cursor = encode_cursor([last['name'], last['id']])
+        
         return jsonify({
             "status": "success",
             "count": len(tags),
-            "tags": tags
+            "tags": tags,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         print(f"Error in get_tags: {e}")
@@ -479,14 +1281,53 @@ def get_tags():
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Function to turn free text into a prefix-matching tsquery, e.g. "batt repl" -> "batt:* & repl:*"
+def build_prefix_tsquery(text):
+    terms = re.findall(r"\w+", text)
+    return ' & '.join(f"{term}:*" for term in terms)
+
+# Search all entity types in one ranked query over their search_vector indexes.
+# Exact title/identifier matches come first, then by rank.
+SEARCH_QUERY = """
+    WITH q AS (SELECT to_tsquery('english', %s) AS tsq, lower(%s) AS raw)
+    SELECT type, id, identifier, title, summary, rank
+    FROM (
+        SELECT 'guide' as type, g.id, g.external_id as identifier, g.title, '' as summary,
+               ts_rank_cd(g.search_vector, q.tsq) AS rank
+        FROM guides g, q
+        WHERE g.search_vector @@ q.tsq
+        UNION ALL
+        SELECT 'category' as type, c.id, c.title as identifier, c.display_title as title, '' as summary,
+               ts_rank_cd(c.search_vector, q.tsq) AS rank
+        FROM categories c, q
+        WHERE c.search_vector @@ q.tsq
+        UNION ALL
+        SELECT 'product' as type, p.id, p.itemcode as identifier, p.title, '' as summary,
+               ts_rank_cd(p.search_vector, q.tsq) AS rank
+        FROM products p, q
+        WHERE p.search_vector @@ q.tsq
+        UNION ALL
+        SELECT 'tag' as type, t.id, t.name as identifier, t.name as title, '' as summary,
+               ts_rank_cd(t.search_vector, q.tsq) AS rank
+        FROM tags t, q
+        WHERE t.search_vector @@ q.tsq
+    ) results, q
+    ORDER BY COALESCE(lower(results.title) = q.raw OR lower(results.identifier) = q.raw, false) DESC,
+             rank DESC,
+             results.title
+    LIMIT %s OFFSET %s
+"""
 
 @app.route('/api/search', methods=['GET'])
+@cached_response
 def search():
     try:
         # Parse query parameters
         query = request.args.get('q', '')
         limit = min(int(request.args.get('limit', 20)), 100)  # Max 100 records
+        offset = int(request.args.get('offset', 0))
         
         if not query:
             return jsonify({
@@ -494,63 +1335,25 @@ def search():
                 "message": "Query parameter 'q' is required"
             }), 400
         
+        tsquery = build_prefix_tsquery(query)
+        if not tsquery:
+            return jsonify({
+                "status": "success",
+                "count": 0,
+                "results": []
+            })
+        
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Search guides
-        cursor.execute("""
-            SELECT 'guide' as type, id, external_id as identifier, title, '' as summary
-            FROM guides
-            WHERE title ILIKE %s
-            LIMIT %s
-        """, (f"%{query}%", limit))
-        
-        guide_results = cursor.fetchall()
-        
-        # Search categories
-        cursor.execute("""
-            SELECT 'category' as type, id, title as identifier, display_title as title, '' as summary
-            FROM categories
-            WHERE title ILIKE %s OR display_title ILIKE %s
-            LIMIT %s
-        """, (f"%{query}%", f"%{query}%", limit))
-        
-        category_results = cursor.fetchall()
-        
-        # Search products
-        cursor.execute("""
-            SELECT 'product' as type, id, itemcode as identifier, title, '' as summary
-            FROM products
-            WHERE title ILIKE %s OR itemcode ILIKE %s
-            LIMIT %s
-        """, (f"%{query}%", f"%{query}%", limit))
-        
-        product_results = cursor.fetchall()
-        
-        # Search tags
-        cursor.execute("""
-            SELECT 'tag' as type, id, name as identifier, name as title, '' as summary
-            FROM tags
-            WHERE name ILIKE %s
-            LIMIT %s
-        """, (f"%{query}%", limit))
-        
-        tag_results = cursor.fetchall()
-        
-        # Combine results
-        all_results = guide_results + category_results + product_results + tag_results
-        
-        # Sort results by relevance (simple implementation: exact matches first, then by title)
-        all_results.sort(key=lambda x: (
-            0 if x['title'] and x['title'].lower() == query.lower() else 1,
-            0 if x['identifier'] and x['identifier'].lower() == query.lower() else 1,
-            x['title'] if x['title'] else ''
-        ))
+        cursor.execute(SEARCH_QUERY, (tsquery, query, limit, offset))
+        
+        all_results = cursor.fetchall()
         
         return jsonify({
             "status": "success",
             "count": len(all_results),
-            "results": all_results[:limit]  # Limit total results
+            "results": all_results
         })
     except Exception as e:
         print(f"Error in search: {e}")
@@ -562,58 +1365,121 @@ def search():
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+# Export settings and the columns each export streams. raw_data is added with ?include=raw_data.
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '5000'))  # default rows per round trip for exports
+EXPORT_MAX_FETCH_SIZE = int(os.getenv('EXPORT_MAX_FETCH_SIZE', '50000'))
+EXPORTS = {
+    'guides': ['id', 'external_id', 'title', 'subject', 'type', 'difficulty', 'category', 'locale',
+               'summary', 'public', 'modified_date', 'created_at', 'updated_at'],
+    'categories': ['id', 'title', 'display_title', 'category_path', 'parent_id', 'wikiid', 'namespace',
+                   'summary', 'created_at', 'updated_at'],
+    'products': ['id', 'itemcode', 'productcode', 'title', 'created_at', 'updated_at']
+}
+
+# Function to build an export query and its parameters; table and column names come from EXPORTS, never from the request
+def build_export_query(entity, include=(), updated_since=None):
+    columns = EXPORTS[entity] + (['raw_data'] if 'raw_data' in include else [])
+    query = f"SELECT {', '.join(columns)} FROM {entity}"
+    params = []
+    
+    if updated_since:
+        query += " WHERE updated_at >= %s"
+        params.append(updated_since)
+    
+    # (updated_at, id) order lets a client resume from the last updated_at it saw
+    query += " ORDER BY updated_at, id"
+    return query, params
+
+@app.route('/api/export/<entity>', methods=['GET'])
+def export(entity):
+    if entity not in EXPORTS:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown export; available: {', '.join(EXPORTS)}"
+        }), 404
+    
+    include = parse_projection('include', RAW_DATA_INCLUDES, [])
+    if include is None:
+        return invalid_projection_response('include', RAW_DATA_INCLUDES)
+    
+    try:
+        # Parse query parameters
+        fetch_size = min(max(int(request.args.get('fetch_size', EXPORT_FETCH_SIZE)), 1), EXPORT_MAX_FETCH_SIZE)
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = datetime.fromisoformat(updated_since.replace('Z', '+00:00'))
+            except ValueError:
+                return jsonify({
+                    "status": "error",
+                    "message": "Invalid updated_since; use an ISO 8601 timestamp"
+                }), 400
+        
+        conn = get_db_connection()
+        cursor = open_stream_cursor(conn)
+        cursor.itersize = fetch_size
+        
+        query, params = build_export_query(entity, include, updated_since)
+        cursor.execute(query, params)
+        return stream_response(stream_ndjson_rows(cursor, f"{entity} export"), conn, cursor, 'application/x-ndjson')
+    except Exception as e:
+        print(f"Error in export: {e}")
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+        if 'conn' in locals() and conn:
+            release_db_connection(conn)
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+# Statistics queries over the aggregates the fetcher maintains
+ENTITY_COUNTS_QUERY = "SELECT name, value, updated_at FROM entity_counts"
+TOP_CATEGORIES_QUERY = """
+    SELECT title, display_title, guide_count, updated_at
+    FROM category_stats
+    WHERE guide_count > 0
+    ORDER BY guide_count DESC
+    LIMIT 10
+"""
+TOP_TAGS_QUERY = """
+    SELECT name, guide_count, updated_at
+    FROM tag_stats
+    WHERE guide_count > 0
+    ORDER BY guide_count DESC
+    LIMIT 10
+"""
 
 @app.route('/api/stats', methods=['GET'])
+@cached_response
 def stats():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Collect various statistics
+        # Collect various statistics from the aggregates the fetcher maintains
         stats = {}
         
-        # Count guides
-        cursor.execute("SELECT COUNT(*) FROM guides")
-        stats['guides_count'] = cursor.fetchone()['count']
-        
-        # Count categories
-        cursor.execute("SELECT COUNT(*) FROM categories")
-        stats['categories_count'] = cursor.fetchone()['count']
-        
-        # Count tags
-        cursor.execute("SELECT COUNT(*) FROM tags")
-        stats['tags_count'] = cursor.fetchone()['count']
-        
-        # Count products
-        cursor.execute("SELECT COUNT(*) FROM products")
-        stats['products_count'] = cursor.fetchone()['count']
-        
-        # Count media
-        cursor.execute("SELECT COUNT(*) FROM media")
-        stats['media_count'] = cursor.fetchone()['count']
+        cursor.execute(ENTITY_COUNTS_QUERY)
+        counts = cursor.fetchall()
+        for row in counts:
+            stats[f"{row['name']}_count"] = row['value']
         
         # Get top categories by guide count
-        cursor.execute("""
-            SELECT c.title, c.display_title, COUNT(g.id) as guide_count
-            FROM categories c
-            JOIN guides g ON c.title = g.category
-            GROUP BY c.id, c.title, c.display_title
-            ORDER BY guide_count DESC
-            LIMIT 10
-        """)
-        stats['top_categories'] = cursor.fetchall()
+        cursor.execute(TOP_CATEGORIES_QUERY)
+        top_categories = cursor.fetchall()
         
         # Get top tags by guide count
-        cursor.execute("""
-            SELECT t.name, COUNT(gt.guide_id) as guide_count
-            FROM tags t
-            JOIN guide_tags gt ON t.id = gt.tag_id
-            GROUP BY t.id, t.name
-            ORDER BY guide_count DESC
-            LIMIT 10
-        """)
-        stats['top_tags'] = cursor.fetchall()
+        cursor.execute(TOP_TAGS_QUERY)
+        top_tags = cursor.fetchall()
+        
+        # Freshness: when any of the aggregates above was last updated
+        timestamps = [row.pop('updated_at') for row in counts + top_categories + top_tags]
+        stats['top_categories'] = top_categories
+        stats['top_tags'] = top_tags
+        stats['refreshed_at'] = max(timestamps).isoformat() if timestamps else None
         
         return jsonify({
             "status": "success",
@@ -629,7 +1495,69 @@ def stats():
         if 'cursor' in locals() and cursor:
             cursor.close()
         if 'conn' in locals() and conn:
-            conn.close()
+            release_db_connection(conn)
+
+@app.route('/api/pool', methods=['GET'])
+def pool_stats():
+    get_db_pool()
+    with db_pool_lock:
+        metrics = dict(db_pool_stats)
+    
+    metrics['min_size'] = DB_POOL_MIN
+    metrics['max_size'] = DB_POOL_MAX
+    metrics['checkout_timeout_seconds'] = DB_POOL_TIMEOUT
+    metrics['avg_wait_ms'] = round(metrics['total_wait_seconds'] / metrics['checkouts'] * 1000, 3) if metrics['checkouts'] else 0
+    metrics['max_wait_ms'] = round(metrics.pop('max_wait_seconds') * 1000, 3)
+    metrics.pop('total_wait_seconds')
+    metrics['pid'] = os.getpid()
+    
+    return jsonify({
+        "status": "success",
+        "pool": metrics
+    })
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    with presign_lock:
+        presign = dict(presign_stats)
+        presign['size'] = len(presign_cache)
+    lookups = presign['hits'] + presign['misses']
+    presign['hit_ratio'] = round(presign['hits'] / lookups, 4) if lookups else 0
+    presign['window_seconds'] = PRESIGN_WINDOW
+    
+    with response_cache_lock:
+        responses = dict(response_cache_stats)
+        responses['size'] = len(response_cache)
+        responses['data_version'] = data_version_state['version']
+    lookups = responses['hits'] + responses['shared_hits'] + responses['misses']
+    responses['hit_ratio'] = round((responses['hits'] + responses['shared_hits']) / lookups, 4) if lookups else 0
+    responses['ttl_seconds'] = RESPONSE_CACHE_TTL
+    responses['shared_backend'] = get_shared_cache() is not None
+    
+    return jsonify({
+        "status": "success",
+        "presign": presign,
+        "responses": responses
+    })
+
+# App factory for WSGI servers. gunicorn.conf.py loads it in the master before
+# forking (preload_app), so imports and botocore's service models are loaded once
+# and shared copy-on-write; init_worker then runs in each worker after the fork.
+def create_app():
+    return app
+
+# Function to reset per-process state in a freshly forked worker, so no worker
+# uses a connection, socket or client it inherited from the master
+def init_worker():
+    global db_pool, db_pool_pid, s3_client, shared_cache
+    
+    with db_pool_lock:
+        db_pool = None
+        db_pool_pid = None
+    s3_client = create_s3_client()
+    shared_cache = None
+    data_version_state['checked_at'] = 0
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -0,0 +1,486 @@
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from werkzeug.http import http_date
+from datetime import date
+import asyncpg
+import asyncio
+import json
+import decimal
+import uuid
+import os
+
+# Shared with the Flask server so both speak the same JSON contract and run the same SQL
+from enhanced_api_server import (
+    db_params, DB_POOL_TIMEOUT, COMPRESS_MIN_SIZE,
+    presign_urls, encode_cursor, decode_cursor, build_prefix_tsquery, project_guide,
+    parse_projection, invalid_projection_message, render_placeholders,
+    build_guides_query, build_guide_query, build_steps_query, build_categories_query,
+    build_category_query, build_product_query, build_tags_query,
+    GUIDE_FIELDS, GUIDE_INCLUDES, CATEGORY_FIELDS, RAW_DATA_INCLUDES,
+    GUIDE_DOCUMENT_QUERY, GUIDE_STEP_MEDIA_QUERY, GUIDE_TAGS_QUERY, SUBCATEGORIES_QUERY, CATEGORY_GUIDES_QUERY,
+    PRODUCTS_QUERY, PRODUCTS_AFTER_QUERY, PRODUCT_GUIDES_QUERY, PRODUCT_WIKIS_QUERY,
+    ENTITY_COUNTS_QUERY, TOP_CATEGORIES_QUERY, TOP_TAGS_QUERY
+)
+
+# ASGI variant of enhanced_api_server.py on asyncpg. Queries a request needs that
+# don't depend on each other run concurrently on separate pooled connections.
+#   uvicorn enhanced_api_server_async:app --host 0.0.0.0 --port 8000 --workers 4
+
+# Pool size per uvicorn worker. One event loop serves many requests at once, and search
+# and guide/category/product pages fan out over several connections each, so this is sized
+# for concurrent requests rather than the Flask server's threads (DB_POOL_MAX).
+# The server opens up to workers x ASYNC_DB_POOL_MAX connections: 4 x 16 = 64 with --workers 4.
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', '16'))
+ASYNC_DB_POOL_MIN = min(int(os.getenv('ASYNC_DB_POOL_MIN', '2')), ASYNC_DB_POOL_MAX)
+
+db_pool = None
+
+# asyncpg numbers its parameters: $1, $2, ...
+ASYNCPG_PLACEHOLDER = lambda number: f"${number}"
+
+# Function to set up each new connection: decode json/jsonb columns like psycopg2 does
+async def init_connection(conn):
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+async def open_db_pool():
+    global db_pool
+    db_pool = await asyncpg.create_pool(
+        database=db_params['dbname'],
+        user=db_params['user'],
+        password=db_params['password'],
+        host=db_params['host'],
+        port=int(db_params['port']),
+        min_size=ASYNC_DB_POOL_MIN,
+        max_size=ASYNC_DB_POOL_MAX,
+        init=init_connection
+    )
+
+async def close_db_pool():
+    if db_pool:
+        await db_pool.close()
+
+# Helper functions to run one query on a pooled connection and return rows as dicts
+async def fetch_all(query, *args):
+    async with db_pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        return [dict(row) for row in await conn.fetch(query, *args)]
+
+async def fetch_one(query, *args):
+    async with db_pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        row = await conn.fetchrow(query, *args)
+        return dict(row) if row else None
+
+# Function to encode values json can't, the same way Flask's jsonify does
+def json_default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class APIResponse(JSONResponse):
+    def render(self, content):
+        return json.dumps(content, default=json_default, separators=(',', ':')).encode('utf-8')
+
+def error_response(message, status_code):
+    return APIResponse({"status": "error", "message": message}, status_code=status_code)
+
+def invalid_projection_response(param, allowed):
+    return error_response(invalid_projection_message(param, allowed), 400)
+
+# Function to add presigned URLs without blocking the event loop on credential refreshes
+async def presign(s3_paths):
+    if not s3_paths:
+        return {}
+    return await asyncio.to_thread(presign_urls, s3_paths)
+
+async def home(request):
+    return APIResponse({
+        "status": "success",
+        "message": "iFixit API Server (async) is running",
+        "endpoints": [
+            "/api/guides",
+            "/api/guides/<guide_id>",
+            "/api/categories",
+            "/api/categories/<title>",
+            "/api/products",
+            "/api/products/<itemcode>",
+            "/api/tags",
+            "/api/search",
+            "/api/stats",
+            "/api/pool"
+        ]
+    })
+
+async def get_guides(request):
+    try:
+        # Parse query parameters
+        args = request.query_params
+        limit = min(int(args.get('limit', 20)), 100)  # Max 100 records
+        offset = int(args.get('offset', 0))
+        category = args.get('category')
+        tag = args.get('tag')
+        search = args.get('search')
+        page_cursor = args.get('cursor')
+
+        # Keyset pagination: a cursor replaces the offset
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 1)
+            if after is None:
+                return error_response("Invalid cursor", 400)
+
+        query, params = build_guides_query(category, tag, search, after, limit, offset, ASYNCPG_PLACEHOLDER)
+        guides = await fetch_all(query, *params)
+        next_cursor = encode_cursor([guides[-1]['id']]) if len(guides) == limit else None
+
+        # Generate presigned URLs for images in one batch
+        urls = await presign([guide['image_path'] for guide in guides if guide['image_path']])
+        for guide in guides:
+            if guide['image_path']:
+                guide['image_url'] = urls.get(guide['image_path'])
+
+        return APIResponse({
+            "status": "success",
+            "count": len(guides),
+            "guides": guides,
+            "next_cursor": next_cursor
+        })
+    except Exception as e:
+        print(f"Error in get_guides: {e}")
+        return error_response(str(e), 500)
+
+# Function to build a guide document from the guide tables; steps, step media and tags load concurrently
+async def build_guide_document(guide_id, fields, include):
+    guide = await fetch_one(build_guide_query(fields, include, ASYNCPG_PLACEHOLDER), guide_id)
+
+    if not guide:
+        return None
+
+    queries = {}
+    if 'steps' in fields:
+        queries['steps'] = fetch_all(build_steps_query(include, ASYNCPG_PLACEHOLDER), guide['id'])
+        queries['step_media'] = fetch_all(render_placeholders(GUIDE_STEP_MEDIA_QUERY, ASYNCPG_PLACEHOLDER), guide['id'])
+    if 'tags' in fields:
+        queries['tags'] = fetch_all(render_placeholders(GUIDE_TAGS_QUERY, ASYNCPG_PLACEHOLDER), guide['id'])
+
+    results = dict(zip(queries, await asyncio.gather(*queries.values())))
+
+    if 'steps' in fields:
+        step_media = {row['step_id']: row['media'] for row in results['step_media']}
+        for step in results['steps']:
+            step['media'] = step_media.get(step['id'], [])
+        guide['steps'] = results['steps']
+    if 'tags' in fields:
+        guide['tags'] = results['tags']
+
+    if 'id' not in fields:
+        guide.pop('id')
+    return guide
+
+async def get_guide(request):
+    guide_id = request.path_params['guide_id']
+    fields = parse_projection('fields', GUIDE_FIELDS, GUIDE_FIELDS, request.query_params)
+    if fields is None:
+        return invalid_projection_response('fields', GUIDE_FIELDS)
+    include = parse_projection('include', GUIDE_INCLUDES, [], request.query_params)
+    if include is None:
+        return invalid_projection_response('include', GUIDE_INCLUDES)
+
+    try:
+        row = None
+        if not include:
+            # Serve the lean document the fetcher precomputed with the guide: one index lookup
+            row = await fetch_one(render_placeholders(GUIDE_DOCUMENT_QUERY, ASYNCPG_PLACEHOLDER), guide_id)
+
+        if row:
+            guide = project_guide(row['document'], fields)
+        else:
+            guide = await build_guide_document(guide_id, fields, include)
+        if guide is None:
+            return error_response("Guide not found", 404)
+
+        # Generate presigned URLs for step media and the guide image in one batch
+        media_items = [item for step in guide.get('steps', []) for item in step['media'] if item['s3_path']]
+        image_path = guide.get('image_path')
+        urls = await presign([item['s3_path'] for item in media_items] + ([image_path] if image_path else []))
+        for item in media_items:
+            item['url'] = urls.get(item['s3_path'])
+        if image_path:
+            guide['image_url'] = urls.get(image_path)
+
+        return APIResponse({
+            "status": "success",
+            "guide": guide
+        })
+    except Exception as e:
+        print(f"Error in get_guide: {e}")
+        return error_response(str(e), 500)
+
+async def get_categories(request):
+    try:
+        parent_id = request.query_params.get('parent_id')
+
+        query, params = build_categories_query(int(parent_id) if parent_id else None, ASYNCPG_PLACEHOLDER)
+        categories = await fetch_all(query, *params)
+
+        return APIResponse({
+            "status": "success",
+            "categories": categories,
+            "count": len(categories)
+        })
+    except Exception as e:
+        print(f"Error in get_categories: {e}")
+        return error_response(str(e), 500)
+
+async def get_category(request):
+    title = request.path_params['title']
+    fields = parse_projection('fields', CATEGORY_FIELDS, CATEGORY_FIELDS, request.query_params)
+    if fields is None:
+        return invalid_projection_response('fields', CATEGORY_FIELDS)
+    include = parse_projection('include', RAW_DATA_INCLUDES, [], request.query_params)
+    if include is None:
+        return invalid_projection_response('include', RAW_DATA_INCLUDES)
+
+    try:
+        category = await fetch_one(build_category_query(fields, include, ASYNCPG_PLACEHOLDER), title, title)
+
+        if not category:
+            return error_response("Category not found", 404)
+
+        # Subcategories and guides load concurrently
+        queries = {}
+        if 'subcategories' in fields:
+            queries['subcategories'] = fetch_all(render_placeholders(SUBCATEGORIES_QUERY, ASYNCPG_PLACEHOLDER), category['id'])
+        if 'guides' in fields:
+            queries['guides'] = fetch_all(render_placeholders(CATEGORY_GUIDES_QUERY, ASYNCPG_PLACEHOLDER), category['title'])
+        category.update(zip(queries, await asyncio.gather(*queries.values())))
+
+        for key in ('id', 'title'):
+            if key not in fields:
+                category.pop(key)
+
+        return APIResponse({
+            "status": "success",
+            "category": category
+        })
+    except Exception as e:
+        print(f"Error in get_category: {e}")
+        return error_response(str(e), 500)
+
+async def get_products(request):
+    try:
+        args = request.query_params
+        limit = min(int(args.get('limit', 20)), 100)  # Max 100 records
+        offset = int(args.get('offset', 0))
+        page_cursor = args.get('cursor')
+
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 2)
+            if after is None:
+                return error_response("Invalid cursor", 400)
+
+        # Get product list
+        if after:
+            products = await fetch_all(render_placeholders(PRODUCTS_AFTER_QUERY, ASYNCPG_PLACEHOLDER), after[0], after[1], limit)
+        else:
+            products = await fetch_all(render_placeholders(PRODUCTS_QUERY, ASYNCPG_PLACEHOLDER), limit, offset)
+
+        next_cursor = None
+        if len(products) == limit:
+            next_cursor = encode_cursor([products[-1]['title'] or '', products[-1]['id']])
+
+        return APIResponse({
+            "status": "success",
+            "count": len(products),
+            "products": products,
+            "next_cursor": next_cursor
+        })
+    except Exception as e:
+        print(f"Error in get_products: {e}")
+        return error_response(str(e), 500)
+
+async def get_product(request):
+    itemcode = request.path_params['itemcode']
+    include = parse_projection('include', RAW_DATA_INCLUDES, [], request.query_params)
+    if include is None:
+        return invalid_projection_response('include', RAW_DATA_INCLUDES)
+
+    try:
+        product = await fetch_one(build_product_query(include, ASYNCPG_PLACEHOLDER), itemcode)
+
+        if not product:
+            return error_response("Product not found", 404)
+
+        # Related guides and wikis load concurrently
+        product['guides'], product['wikis'] = await asyncio.gather(
+            fetch_all(render_placeholders(PRODUCT_GUIDES_QUERY, ASYNCPG_PLACEHOLDER), product['id']),
+            fetch_all(render_placeholders(PRODUCT_WIKIS_QUERY, ASYNCPG_PLACEHOLDER), product['id'])
+        )
+
+        return APIResponse({
+            "status": "success",
+            "product": product
+        })
+    except Exception as e:
+        print(f"Error in get_product: {e}")
+        return error_response(str(e), 500)
+
+async def get_tags(request):
+    try:
+        args = request.query_params
+        limit = min(int(args.get('limit', 100)), 500)  # Max 500 records
+        offset = int(args.get('offset', 0))
+        sort_by = args.get('sort', 'name')  # Sort by name or popularity
+        page_cursor = args.get('cursor')
+
+        # Keyset pagination: (guide_count, name, id) for popularity, (name, id) for name
+        after = None
+        if page_cursor:
+            after = decode_cursor(page_cursor, 3 if sort_by == 'popularity' else 2)
+            if after is None:
+                return error_response("Invalid cursor", 400)
+
+        query, params = build_tags_query(sort_by, after, limit, offset, ASYNCPG_PLACEHOLDER)
+        tags = await fetch_all(query, *params)
+
+        next_cursor = None
+        if len(tags) == limit:
+            last = tags[-1]
+            if sort_by == 'popularity':
+                next_cursor = encode_cursor([last['guide_count'], last['name'], last['id']])
+            else:
+                next_cursor = encode_cursor([last['name'], last['id']])
+
+        return APIResponse({
+            "status": "success",
+            "count": len(tags),
+            "tags": tags,
+            "next_cursor": next_cursor
+        })
+    except Exception as e:
+        print(f"Error in get_tags: {e}")
+        return error_response(str(e), 500)
+
+# Per-entity search queries. Each returns its best offset + limit matches, ranked
+# the same way as the single UNION ALL query in the Flask server.
+search_queries = {
+    'guide': ("g.id", "g.external_id", "g.title", "guides g", "g.search_vector"),
+    'category': ("c.id", "c.title", "c.display_title", "categories c", "c.search_vector"),
+    'product': ("p.id", "p.itemcode", "p.title", "products p", "p.search_vector"),
+    'tag': ("t.id", "t.name", "t.name", "tags t", "t.search_vector")
+}
+
+async def search(request):
+    try:
+        # Parse query parameters
+        args = request.query_params
+        query = args.get('q', '')
+        limit = min(int(args.get('limit', 20)), 100)  # Max 100 records
+        offset = int(args.get('offset', 0))
+
+        if not query:
+            return error_response("Query parameter 'q' is required", 400)
+
+        tsquery = build_prefix_tsquery(query)
+        if not tsquery:
+            return APIResponse({
+                "status": "success",
+                "count": 0,
+                "results": []
+            })
+
+        # Run the four entity searches concurrently, then merge them in rank order:
+        # exact title/identifier matches first, then by rank, then by title
+        searches = [
+            fetch_all(f"""
+                WITH q AS (SELECT to_tsquery('english', $1) AS tsq, lower($2) AS raw)
+                SELECT '{entity_type}' as type, {id_column} as id, {identifier_column} as identifier,
+                       {title_column} as title, '' as summary,
+                       ts_rank_cd({vector_column}, q.tsq) AS rank,
+                       COALESCE(lower({title_column}) = q.raw OR lower({identifier_column}) = q.raw, false) AS exact
+                FROM {table}, q
+                WHERE {vector_column} @@ q.tsq
+                ORDER BY exact DESC, rank DESC, title
+                LIMIT $3
+            """, tsquery, query, offset + limit)
+            for entity_type, (id_column, identifier_column, title_column, table, vector_column) in search_queries.items()
+        ]
+
+        matches = [row for rows in await asyncio.gather(*searches) for row in rows]
+        matches.sort(key=lambda row: (not row['exact'], -row['rank'], row['title'] or ''))
+        all_results = matches[offset:offset + limit]
+        for row in all_results:
+            row.pop('exact')
+
+        return APIResponse({
+            "status": "success",
+            "count": len(all_results),
+            "results": all_results
+        })
+    except Exception as e:
+        print(f"Error in search: {e}")
+        return error_response(str(e), 500)
+
+async def stats(request):
+    try:
+        # The three aggregate reads are independent, so they run concurrently
+        counts, top_categories, top_tags = await asyncio.gather(
+            fetch_all(ENTITY_COUNTS_QUERY),
+            fetch_all(TOP_CATEGORIES_QUERY),
+            fetch_all(TOP_TAGS_QUERY)
+        )
+
+        stats = {f"{row['name']}_count": row['value'] for row in counts}
+
+        # Freshness: when any of the aggregates above was last updated
+        timestamps = [row.pop('updated_at') for row in counts + top_categories + top_tags]
+        stats['top_categories'] = top_categories
+        stats['top_tags'] = top_tags
+        stats['refreshed_at'] = max(timestamps).isoformat() if timestamps else None
+
+        return APIResponse({
+            "status": "success",
+            "stats": stats
+        })
+    except Exception as e:
+        print(f"Error in stats: {e}")
+        return error_response(str(e), 500)
+
+async def pool_stats(request):
+    return APIResponse({
+        "status": "success",
+        "pool": {
+            "min_size": db_pool.get_min_size(),
+            "max_size": db_pool.get_max_size(),
+            "size": db_pool.get_size(),
+            "idle": db_pool.get_idle_size()
+        }
+    })
+
+app = Starlette(
+    routes=[
+        Route('/', home),
+        Route('/api/guides', get_guides),
+        Route('/api/guides/{guide_id}', get_guide),
+        Route('/api/categories', get_categories),
+        Route('/api/categories/{title:path}', get_category),
+        Route('/api/products', get_products),
+        Route('/api/products/{itemcode}', get_product),
+        Route('/api/tags', get_tags),
+        Route('/api/search', search),
+        Route('/api/stats', stats),
+        Route('/api/pool', pool_stats)
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*']),
+        Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+    ],
+    on_startup=[open_db_pool],
+    on_shutdown=[close_db_pool]
+)
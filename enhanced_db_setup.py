@@ -141,32 +141,416 @@ tables = [
     """
 ]
 
+# Media index used by the fetcher to skip re-uploading media
+media_index = [
+    """
+    CREATE TABLE IF NOT EXISTS media_objects (
+        image_id VARCHAR(255) PRIMARY KEY,
+        s3_path TEXT NOT NULL,
+        etag VARCHAR(255),
+        size BIGINT,
+        content_hash VARCHAR(64),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_media_objects_content_hash ON media_objects (content_hash)
+    """
+]
+
+# Full-text search columns, kept current by a trigger on every upsert from the fetcher;
+# guides also index the text of their steps. A STORED generated column would rewrite
+# each table under an ACCESS EXCLUSIVE lock, blocking reads and writes for the whole
+# rewrite. Instead the column is added nullable (a catalog-only change that still takes
+# ACCESS EXCLUSIVE briefly, so lock_timeout makes it fail fast instead of queueing
+# behind long queries), the trigger covers new writes, and existing rows are backfilled
+# in committed batches. Rows not yet backfilled don't match searches until their batch runs.
+SEARCH_BACKFILL_BATCH_SIZE = int(os.getenv('SEARCH_BACKFILL_BATCH_SIZE', '5000'))
+
+# table -> (columns the vector is built from, expression over the row r)
+search_vector_sources = {
+    'guides': (['title', 'subject', 'category', 'summary', 'raw_data'], """
+        setweight(to_tsvector('english', coalesce(r.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(r.subject, '') || ' ' || coalesce(r.category, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(r.summary, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(jsonb_path_query_array(r.raw_data, '$.steps[*].lines[*].text_raw'), '[]'::jsonb)), 'C')
+    """),
+    'categories': (['title', 'display_title', 'summary'], """
+        setweight(to_tsvector('english', coalesce(r.title, '') || ' ' || coalesce(r.display_title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(r.summary, '')), 'B')
+    """),
+    'products': (['title', 'itemcode', 'productcode'], """
+        setweight(to_tsvector('english', coalesce(r.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(r.itemcode, '') || ' ' || coalesce(r.productcode, '')), 'B')
+    """),
+    'tags': (['name'], """
+        to_tsvector('english', coalesce(r.name, ''))
+    """)
+}
+
+search_columns = ["SET LOCAL lock_timeout = '5s'"]
+search_backfills = []
+for table, (columns, expression) in search_vector_sources.items():
+    search_columns += [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        f"""
+        CREATE OR REPLACE FUNCTION {table}_search_vector(r {table}) RETURNS tsvector AS $$
+            SELECT {expression}
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION set_{table}_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {table}_search_vector(NEW);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}",
+        f"""
+        CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {', '.join(columns)} ON {table}
+        FOR EACH ROW EXECUTE FUNCTION set_{table}_search_vector()
+        """
+    ]
+    # Walks the primary key, so each batch is an index range scan
+    search_backfills.append((table, f"""
+        WITH batch AS (SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s)
+        UPDATE {table} r SET search_vector = {table}_search_vector(r)
+        FROM batch WHERE r.id = batch.id
+        RETURNING r.id
+    """))
+
+search_indexes = [
+    ('idx_guides_search', 'guides USING GIN (search_vector)'),
+    ('idx_categories_search', 'categories USING GIN (search_vector)'),
+    ('idx_products_search', 'products USING GIN (search_vector)'),
+    ('idx_tags_search', 'tags USING GIN (search_vector)')
+]
+
+# Secondary indexes for the API server's lookups, joins and keyset pagination
+secondary_indexes = [
+    ('idx_guides_external_id', 'guides (external_id)'),
+    ('idx_guides_category', 'guides (category)'),
+    ('idx_guides_category_id', 'guides (category_id)'),
+    ('idx_media_guide_step', 'media (guide_id, step_id)'),
+    ('idx_steps_guide_orderby', 'steps (guide_id, orderby)'),
+    ('idx_categories_parent_id', 'categories (parent_id)'),
+    ('idx_categories_display_title', 'categories (display_title)'),
+    ('idx_categories_wikiid', 'categories (wikiid)'),
+    ('idx_guide_tags_tag_id', 'guide_tags (tag_id)'),
+    ('idx_product_guides_guide_id', 'product_guides (guide_id)'),
+    ('idx_products_title_id', "products ((COALESCE(title, '')), id)")
+]
+
+# Indexes for /api/export/<entity>?updated_since=..., which reads in (updated_at, id) order
+export_indexes = [
+    ('idx_guides_updated_at_id', 'guides (updated_at, id)'),
+    ('idx_categories_updated_at_id', 'categories (updated_at, id)'),
+    ('idx_products_updated_at_id', 'products (updated_at, id)')
+]
+
+# Aggregates read by /api/stats and /api/tags?sort=popularity instead of scanning.
+# entity_counts is kept exact by statement-level triggers; category_stats and
+# tag_stats are refreshed by the fetcher for the keys each batch touched.
+counted_tables = ['guides', 'steps', 'media', 'categories', 'tags', 'products']
+
+aggregates = [
+    """
+    CREATE TABLE IF NOT EXISTS entity_counts (
+        name VARCHAR(50) PRIMARY KEY,
+        value BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS category_stats (
+        category_id INTEGER PRIMARY KEY REFERENCES categories(id),
+        title VARCHAR(255),
+        display_title VARCHAR(255),
+        guide_count INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tag_stats (
+        tag_id INTEGER PRIMARY KEY REFERENCES tags(id),
+        name VARCHAR(255),
+        guide_count INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_category_stats_guide_count ON category_stats (guide_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_tag_stats_guide_count ON tag_stats (guide_count DESC, name, tag_id)",
+    """
+    CREATE OR REPLACE FUNCTION count_inserted_rows() RETURNS trigger AS $$
+    BEGIN
+        UPDATE entity_counts
+        SET value = value + (SELECT COUNT(*) FROM new_rows), updated_at = CURRENT_TIMESTAMP
+        WHERE name = TG_TABLE_NAME;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION count_deleted_rows() RETURNS trigger AS $$
+    BEGIN
+        UPDATE entity_counts
+        SET value = value - (SELECT COUNT(*) FROM old_rows), updated_at = CURRENT_TIMESTAMP
+        WHERE name = TG_TABLE_NAME;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """
+]
+
+for table in counted_tables:
+    # Triggers first: creating them locks the table, so no insert can slip in
+    # between them and the initial count
+    aggregates += [
+        f"DROP TRIGGER IF EXISTS {table}_count_insert ON {table}",
+        f"""
+        CREATE TRIGGER {table}_count_insert AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_inserted_rows()
+        """,
+        f"DROP TRIGGER IF EXISTS {table}_count_delete ON {table}",
+        f"""
+        CREATE TRIGGER {table}_count_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_deleted_rows()
+        """,
+        f"""
+        INSERT INTO entity_counts (name, value)
+        SELECT '{table}', COUNT(*) FROM {table}
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP
+        """
+    ]
+
+aggregates += [
+    """
+    INSERT INTO category_stats (category_id, title, display_title, guide_count)
+    SELECT c.id, c.title, c.display_title, COUNT(g.id)
+    FROM categories c
+    JOIN guides g ON c.title = g.category
+    GROUP BY c.id, c.title, c.display_title
+    ON CONFLICT (category_id) DO UPDATE SET
+        guide_count = EXCLUDED.guide_count,
+        updated_at = CURRENT_TIMESTAMP
+    """,
+    """
+    INSERT INTO tag_stats (tag_id, name, guide_count)
+    SELECT t.id, t.name, COUNT(gt.guide_id)
+    FROM tags t
+    JOIN guide_tags gt ON t.id = gt.tag_id
+    GROUP BY t.id, t.name
+    ON CONFLICT (tag_id) DO UPDATE SET
+        guide_count = EXCLUDED.guide_count,
+        updated_at = CURRENT_TIMESTAMP
+    """
+]
+
+# Data version the API server derives its ETags from. The fetcher bumps it
+# after every write batch, so cached responses and client ETags go stale together.
+data_version = [
+    """
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "INSERT INTO data_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING"
+]
+
+# Precomputed /api/guides/<guide_id> documents, rebuilt by the fetcher in the
+# same transaction that stores the guide. Large documents are compressed by TOAST.
+guide_documents = [
+    """
+    CREATE TABLE IF NOT EXISTS guide_documents (
+        guide_id INTEGER PRIMARY KEY REFERENCES guides(id),
+        external_id VARCHAR(255) NOT NULL,
+        document JSON NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_guide_documents_external_id ON guide_documents (external_id)"
+]
+
+# Work queue for distributed crawls (enhanced_ifixit_fetcher.py --distributed).
+# Fetchers lease rows with SELECT ... FOR UPDATE SKIP LOCKED. available_at is when
+# a pending row may be claimed (retry backoff) or when a leased row's lease expires.
+crawl_work = [
+    """
+    CREATE TABLE IF NOT EXISTS crawl_work (
+        id BIGSERIAL PRIMARY KEY,
+        crawl_id VARCHAR(100) NOT NULL,
+        kind VARCHAR(20) NOT NULL,
+        work_key VARCHAR(255) NOT NULL,
+        payload JSONB,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        leased_by VARCHAR(255),
+        available_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (crawl_id, kind, work_key)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_crawl_work_claimable ON crawl_work (crawl_id, available_at)
+    WHERE status IN ('pending', 'leased')
+    """
+]
+
+# /api/tags?sort=popularity reads tag_stats alone, so every tag gets a row when it
+# is inserted (count 0 until the fetcher refreshes it). Pages are fetched with a
+# (-guide_count, name, tag_id) row comparison, which this expression index serves.
+tag_popularity = [
+    """
+    CREATE OR REPLACE FUNCTION add_tag_stats_rows() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO tag_stats (tag_id, name, guide_count)
+        SELECT id, name, 0 FROM new_rows
+        ON CONFLICT (tag_id) DO NOTHING;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tags_stats_insert ON tags",
+    """
+    CREATE TRIGGER tags_stats_insert AFTER INSERT ON tags
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION add_tag_stats_rows()
+    """,
+    """
+    INSERT INTO tag_stats (tag_id, name, guide_count)
+    SELECT t.id, t.name, COUNT(gt.guide_id)
+    FROM tags t
+    LEFT JOIN guide_tags gt ON t.id = gt.tag_id
+    WHERE NOT EXISTS (SELECT 1 FROM tag_stats ts WHERE ts.tag_id = t.id)
+    GROUP BY t.id, t.name
+    ON CONFLICT (tag_id) DO NOTHING
+    """
+]
+
+tag_popularity_indexes = [
+    ('idx_tag_stats_popularity', 'tag_stats ((-guide_count), name, tag_id)')
+]
+
 # Insert initial source
 initial_data = [
     """
     INSERT INTO sources (name, description, api_base_url)
-    VALUES ('iFixit', 'iFixit repair guides and media', 'https://www.ifixit.com/api/2.0')
-    ON CONFLICT DO NOTHING
+    SELECT 'iFixit', 'iFixit repair guides and media', 'https://www.ifixit.com/api/2.0'
+    WHERE NOT EXISTS (SELECT 1 FROM sources WHERE name = 'iFixit')
     """
 ]
 
-# Connect to database and create tables
+# Versioned migrations. Each version is applied once and recorded in
+# schema_migrations. Statements run in one transaction; backfills then update
+# existing rows in committed batches, and indexes listed under concurrent_indexes
+# are built with CREATE INDEX CONCURRENTLY last, which can't run inside a
+# transaction and doesn't block writes from the fetcher.
+# Add new schema changes as a new version at the end, never edit applied ones.
+migrations = [
+    {'version': 1, 'name': 'base tables', 'statements': tables + initial_data},
+    {'version': 2, 'name': 'media index', 'statements': media_index},
+    {'version': 3, 'name': 'full-text search', 'statements': search_columns, 'backfills': search_backfills,
+     'concurrent_indexes': search_indexes},
+    {'version': 4, 'name': 'secondary indexes', 'concurrent_indexes': secondary_indexes},
+    {'version': 5, 'name': 'stats aggregates', 'statements': aggregates},
+    {'version': 6, 'name': 'data version', 'statements': data_version},
+    {'version': 7, 'name': 'guide documents', 'statements': guide_documents},
+    # Documents became lean (no raw_data); drop the old ones so they are rebuilt
+    # by the fetcher or by enhanced_ifixit_fetcher.py --rebuild-documents
+    {'version': 8, 'name': 'lean guide documents', 'statements': ["TRUNCATE guide_documents"]},
+    {'version': 9, 'name': 'export indexes', 'concurrent_indexes': export_indexes},
+    {'version': 10, 'name': 'crawl work queue', 'statements': crawl_work},
+    {'version': 11, 'name': 'tag popularity', 'statements': tag_popularity, 'concurrent_indexes': tag_popularity_indexes}
+]
+
+# Function to build an index concurrently, replacing an invalid leftover from an interrupted build
+def create_index_concurrently(cursor, name, definition):
+    cursor.execute("""
+        SELECT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s
+    """, (name,))
+    row = cursor.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        print(f"Dropping invalid index {name}")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    print(f"Creating index {name} on {definition}")
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+
+# Function to run a backfill in batches of SEARCH_BACKFILL_BATCH_SIZE rows, committing each
+# so no batch holds row locks for long and the fetcher keeps writing in between
+def run_backfill(conn, cursor, table, statement):
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute(statement, (last_id, SEARCH_BACKFILL_BATCH_SIZE))
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        if not ids:
+            break
+        last_id = max(ids)
+        total += len(ids)
+        print(f"Backfilled {total} rows of {table}")
+
+# Connect to database and apply pending migrations
 try:
     conn = psycopg2.connect(**db_params)
     cursor = conn.cursor()
     
-    # Create tables
-    for table in tables:
-        cursor.execute(table)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255),
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
     
-    # Insert initial data
-    for data in initial_data:
-        cursor.execute(data)
+    for migration in migrations:
+        if migration['version'] in applied:
+            continue
         
-    conn.commit()
+        print(f"Applying migration {migration['version']}: {migration['name']}")
+        for statement in migration.get('statements', []):
+            cursor.execute(statement)
+        conn.commit()
+        
+        for table, statement in migration.get('backfills', []):
+            run_backfill(conn, cursor, table, statement)
+        
+        if migration.get('concurrent_indexes'):
+            conn.autocommit = True
+            try:
+                for name, definition in migration['concurrent_indexes']:
+                    create_index_concurrently(cursor, name, definition)
+            finally:
+                conn.autocommit = False
+        
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration['version'], migration['name'])
+        )
+        conn.commit()
+    
     print("Database setup completed successfully")
 except Exception as e:
     print(f"Error setting up database: {e}")
+    if 'conn' in locals() and conn and not conn.autocommit:
+        conn.rollback()
 finally:
     if 'cursor' in locals() and cursor:
         cursor.close()
@@ -1,24 +1,43 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import boto3
 import os
 import time
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from datetime import datetime
 import signal
 import sys
 import pickle
+import hashlib
+import re
+import threading
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 import urllib.parse
+from collections import OrderedDict
 
 load_dotenv()
 
 # AWS S3 configuration
-s3_client = boto3.client('s3')
+# S3_ENDPOINT_URL points the client at a local S3 stand-in (MinIO, moto server) for testing
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
 RAW_BUCKET = os.getenv('RAW_BUCKET')
 MEDIA_BUCKET = os.getenv('MEDIA_BUCKET')
 
+# Media upload settings
+MEDIA_PART_SIZE = max(int(os.getenv('MEDIA_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)  # bytes per multipart part (S3 minimum is 5 MB)
+MEDIA_CHUNK_SIZE = 64 * 1024  # bytes read from the HTTP stream at a time
+MEDIA_UPLOAD_STATE_DIR = os.getenv('MEDIA_UPLOAD_STATE_DIR', 'media_uploads')  # in-progress multipart upload state
+VERIFIED_MEDIA_CACHE_SIZE = int(os.getenv('VERIFIED_MEDIA_CACHE_SIZE', '100000'))  # image ids remembered as present in S3
+MEDIA_INDEX_POOL_SIZE = int(os.getenv('MEDIA_INDEX_POOL_SIZE', '4'))  # media index connections shared by the download threads
+
 # Database connection
 db_params = {
     'dbname': os.getenv('DB_NAME'),
@@ -31,45 +50,130 @@ db_params = {
 # iFixit API base URL
 API_BASE_URL = "https://www.ifixit.com/api/2.0"
 
+# Incremental mode (--incremental) only fetches guides that are new or whose
+# modified_date changed since they were stored, and keeps its own checkpoint
+INCREMENTAL = '--incremental' in sys.argv
+
+# --rebuild-documents only (re)builds guide_documents for guides that have none,
+# e.g. guides stored before documents existed, and exits without fetching
+REBUILD_DOCUMENTS = '--rebuild-documents' in sys.argv
+
+# Distributed mode (--distributed): several fetcher processes or hosts share one
+# crawl by leasing work from the crawl_work table instead of a local checkpoint
+DISTRIBUTED = '--distributed' in sys.argv
+CRAWL_ID = os.getenv('CRAWL_ID', datetime.now().strftime('%Y%m%d') + ('-incremental' if INCREMENTAL else ''))  # fetchers with the same id share a crawl
+WORKER_ID = os.getenv('WORKER_ID', f"{socket.gethostname()}-{os.getpid()}")
+LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', '300'))  # leased work not renewed for this long goes back to the queue
+LEASE_MAX_ATTEMPTS = int(os.getenv('LEASE_MAX_ATTEMPTS', '5'))  # attempts before a work item is marked failed
+RETRY_DELAY_SECONDS = int(os.getenv('RETRY_DELAY_SECONDS', '30'))  # retry backoff per failed attempt
+QUEUE_POLL_SECONDS = float(os.getenv('QUEUE_POLL_SECONDS', '5'))  # wait when all remaining work is leased elsewhere
+GUIDE_LIST_LOOKAHEAD = int(os.getenv('GUIDE_LIST_LOOKAHEAD', '10'))  # guide list pages queued ahead of the last one listed
+GUIDE_LIST_MAX_FAILED_PAGES = int(os.getenv('GUIDE_LIST_MAX_FAILED_PAGES', '3'))  # failed pages in a row before a lookahead chain stops
+
 # Checkpoint file to save progress
-CHECKPOINT_FILE = "fetch_checkpoint.pkl"
+CHECKPOINT_FILE = "fetch_checkpoint_incremental.pkl" if INCREMENTAL else "fetch_checkpoint.pkl"
 STATS_FILE = "fetch_stats.json"
 
 # Global variables for tracking progress
 current_offset = 0
 guides_processed = 0
+guides_skipped = 0
+failed_guides = {}  # guide id -> guide list entry whose fetch or store failed, retried after the list
 wikis_processed = 0
 categories_processed = 0
+products_processed = 0
+category_load_seconds = None
 media_downloaded = 0
 start_time = datetime.now()
 last_checkpoint_time = datetime.now()
 checkpoint_interval = 60  # seconds between checkpoints
 stats_interval = 300  # seconds between stats updates
 
+# Guide pipeline settings
+GUIDE_LIST_BATCH_SIZE = int(os.getenv('GUIDE_LIST_BATCH_SIZE', '20'))  # guides per list request
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '4'))  # guides fetched concurrently
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '2'))  # starting API requests per second, shared by all workers
+API_RATE_MIN = float(os.getenv('API_RATE_MIN', '0.2'))  # floor the limiter backs off to
+API_RATE_MAX = float(os.getenv('API_RATE_MAX', '10'))  # ceiling the limiter ramps up to
+API_BURST = float(os.getenv('API_BURST', '5'))  # max requests that can go out back to back
+
+# Wiki crawler settings. Every namespace is paged at once and its API calls
+# go through the same rate limiter and HTTP session as the guide pipeline.
+WIKI_NAMESPACES = ['CATEGORY', 'ITEM', 'INFO']
+WIKI_LIST_BATCH_SIZE = int(os.getenv('WIKI_LIST_BATCH_SIZE', '20'))  # wikis per list request
+WIKI_TAG_WORKERS = int(os.getenv('WIKI_TAG_WORKERS', '8'))  # wiki tag fetches in flight
+WIKI_WRITE_BATCH_SIZE = int(os.getenv('WIKI_WRITE_BATCH_SIZE', '100'))  # wikis written per transaction
+WIKI_WRITE_FLUSH_SECONDS = 5  # longest a partial batch of wikis waits before it is written
+
+# HTTP session settings
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))  # seconds
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))  # seconds
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', str(max(FETCH_WORKERS, WIKI_TAG_WORKERS + len(WIKI_NAMESPACES), 10))))  # keep-alive connections per host
+ESTIMATED_TOTAL_GUIDES = int(os.getenv('ESTIMATED_TOTAL_GUIDES', '1000000'))
+
+# Lock protecting the counters below, which are updated from worker threads
+stats_lock = threading.Lock()
+
+# Per-stage counters for the guide pipeline (items handled and busy seconds)
+stage_stats = {
+    'fetch': {'items': 0, 'seconds': 0.0},
+    'media': {'items': 0, 'seconds': 0.0},
+    'store': {'items': 0, 'seconds': 0.0},
+    'wiki_list': {'items': 0, 'seconds': 0.0},
+    'wiki_tags': {'items': 0, 'seconds': 0.0},
+    'wiki_store': {'items': 0, 'seconds': 0.0}
+}
+
+# Run state of each crawl stage (categories, wikis, guides, ...). Finished stages
+# are saved in the checkpoint so a resumed run skips them.
+stage_runs = {}  # stage -> {'status', 'started_at', 'finished_at', 'seconds'}
+checkpoint_lock = threading.RLock()
+shutdown_event = threading.Event()  # set on SIGINT/SIGTERM; stages stop at their next batch
+
+# Function to record work done by a pipeline stage
+def record_stage(stage, seconds, items=1):
+    with stats_lock:
+        stage_stats[stage]['items'] += items
+        stage_stats[stage]['seconds'] += seconds
+
 # Function to save checkpoint
 def save_checkpoint():
-    global current_offset, guides_processed, wikis_processed, categories_processed, media_downloaded, last_checkpoint_time
+    global current_offset, guides_processed, guides_skipped, wikis_processed, categories_processed, products_processed, media_downloaded, last_checkpoint_time
+    
+    # A distributed crawl keeps its progress in crawl_work
+    if DISTRIBUTED:
+        last_checkpoint_time = datetime.now()
+        return
+    
+    with stats_lock:
+        completed_stages = [stage for stage, run in stage_runs.items() if run['status'] == 'done']
     
     checkpoint_data = {
         'offset': current_offset,
         'guides_processed': guides_processed,
+        'guides_skipped': guides_skipped,
         'wikis_processed': wikis_processed,
         'categories_processed': categories_processed,
+        'products_processed': products_processed,
         'media_downloaded': media_downloaded,
+        'completed_stages': completed_stages,
+        'failed_guides': dict(failed_guides),
         'timestamp': datetime.now().isoformat()
     }
     
-    try:
-        with open(CHECKPOINT_FILE, 'wb') as f:
-            pickle.dump(checkpoint_data, f)
-        print(f"Checkpoint saved at offset {current_offset}, {guides_processed} guides processed")
-        last_checkpoint_time = datetime.now()
-    except Exception as e:
-        print(f"Error saving checkpoint: {e}")
+    # Stages run on their own threads, so writes to the checkpoint file are serialized
+    with checkpoint_lock:
+        try:
+            with open(CHECKPOINT_FILE, 'wb') as f:
+                pickle.dump(checkpoint_data, f)
+            print(f"Checkpoint saved at offset {current_offset}, {guides_processed} guides processed, stages done: {', '.join(completed_stages) or 'none'}")
+            last_checkpoint_time = datetime.now()
+        except Exception as e:
+            print(f"Error saving checkpoint: {e}")
 
 # Function to load checkpoint
 def load_checkpoint():
-    global current_offset, guides_processed, wikis_processed, categories_processed, media_downloaded
+    global current_offset, guides_processed, guides_skipped, wikis_processed, categories_processed, products_processed, media_downloaded
     
     if os.path.exists(CHECKPOINT_FILE):
         try:
@@ -77,12 +181,19 @@ def load_checkpoint():
                 checkpoint_data = pickle.load(f)
                 current_offset = checkpoint_data.get('offset', 0)
                 guides_processed = checkpoint_data.get('guides_processed', 0)
+                guides_skipped = checkpoint_data.get('guides_skipped', 0)
                 wikis_processed = checkpoint_data.get('wikis_processed', 0)
                 categories_processed = checkpoint_data.get('categories_processed', 0)
+                products_processed = checkpoint_data.get('products_processed', 0)
                 media_downloaded = checkpoint_data.get('media_downloaded', 0)
+                failed_guides.update(checkpoint_data.get('failed_guides', {}))
+                for stage in checkpoint_data.get('completed_stages', []):
+                    stage_runs[stage] = {'status': 'done', 'started_at': None, 'finished_at': None, 'seconds': None}
                 timestamp = checkpoint_data.get('timestamp', 'unknown')
                 print(f"Loaded checkpoint from {timestamp}")
-                print(f"Resuming from offset {current_offset}, {guides_processed} guides processed")
+                print(f"Resuming from offset {current_offset}, {guides_processed} guides processed, {len(failed_guides)} failed guides to retry")
+                if stage_runs:
+                    print(f"Stages already done: {', '.join(stage_runs)}")
                 return True
         except Exception as e:
             print(f"Error loading checkpoint: {e}")
@@ -101,17 +212,39 @@ def update_stats():
     seconds = elapsed_seconds % 60
     
     guides_per_hour = (guides_processed / elapsed_seconds) * 3600 if elapsed_seconds > 0 else 0
+    guides_remaining = max(ESTIMATED_TOTAL_GUIDES - current_offset, 0)
+    
+    # Per-stage throughput: items/hour over wall time, and average busy time per item
+    stages = {}
+    with stats_lock:
+        for stage, counters in stage_stats.items():
+            stages[stage] = {
+                'items': counters['items'],
+                'items_per_hour': round((counters['items'] / elapsed_seconds) * 3600, 2) if elapsed_seconds > 0 else 0,
+                'avg_seconds': round(counters['seconds'] / counters['items'], 3) if counters['items'] > 0 else 0
+            }
+        runs = {stage: dict(run) for stage, run in stage_runs.items()}
     
     stats = {
         'timestamp': current_time.isoformat(),
         'elapsed_time': f"{int(hours)}h {int(minutes)}m {int(seconds)}s",
         'guides_processed': guides_processed,
+        'guides_skipped': guides_skipped,
+        'incremental': INCREMENTAL,
         'wikis_processed': wikis_processed,
         'categories_processed': categories_processed,
+        'products_processed': products_processed,
+        'category_load_seconds': category_load_seconds,
         'media_downloaded': media_downloaded,
         'current_offset': current_offset,
         'guides_per_hour': round(guides_per_hour, 2),
-        'est_completion_time': f"{round(1000000 / guides_per_hour if guides_per_hour > 0 else 0, 1)} hours"
+        'est_completion_time': f"{round(guides_remaining / guides_per_hour if guides_per_hour > 0 else 0, 1)} hours",
+        'fetch_workers': FETCH_WORKERS,
+        'stages': stages,
+        'stage_runs': runs,
+        'api_rate_limiter': get_rate_limiter_stats(),
+        'http_connections': get_http_pool_stats(),
+        'media_cache': dict(media_cache_stats)
     }
     
     try:
@@ -129,16 +262,28 @@ def display_progress():
     print(f"Time elapsed: {stats['elapsed_time']}")
     print(f"Current offset: {stats['current_offset']}")
     print(f"Guides processed: {stats['guides_processed']}")
+    print(f"Guides skipped (unchanged): {stats['guides_skipped']}")
     print(f"Wikis processed: {stats['wikis_processed']}")
     print(f"Categories processed: {stats['categories_processed']}")
+    print(f"Products processed: {stats['products_processed']}")
     print(f"Media files downloaded: {stats['media_downloaded']}")
+    print(f"Media cache: {stats['media_cache']['hits']} hits, {stats['media_cache']['hash_hits']} content hash hits, {stats['media_cache']['misses']} misses")
     print(f"Processing rate: {stats['guides_per_hour']} guides/hour")
     print(f"Estimated completion time: {stats['est_completion_time']}")
+    print(f"API request rate: {stats['api_rate_limiter']['current_rate']} requests/second")
+    for host, pool_data in stats['http_connections'].items():
+        print(f"Connections to {host}: {pool_data['connections_opened']} opened, {pool_data['connections_reused']} reused")
+    for stage, stage_data in stats['stages'].items():
+        print(f"Stage {stage}: {stage_data['items']} items, {stage_data['items_per_hour']}/hour, {stage_data['avg_seconds']}s avg")
+    for stage, run in stats['stage_runs'].items():
+        duration = f" in {run['seconds']}s" if run['seconds'] is not None else ''
+        print(f"Crawl stage {stage}: {run['status']}{duration}")
     print("------------------------\n")
 
 # Signal handler for graceful shutdown
 def signal_handler(sig, frame):
     print("\nReceived shutdown signal. Saving checkpoint and exiting...")
+    shutdown_event.set()
     save_checkpoint()
     sys.exit(0)
 
@@ -146,18 +291,130 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
+# Adaptive token bucket shared by every iFixit API call.
+# The rate grows additively while responses are healthy and is halved on 429 or 5xx.
+rate_lock = threading.Lock()
+rate_limiter = {
+    'rate': API_RATE_LIMIT,
+    'tokens': API_BURST,
+    'last_refill': time.monotonic(),
+    'paused_until': 0.0,
+    'healthy_streak': 0,
+    'throttled_responses': 0,
+    'server_errors': 0
+}
+RATE_INCREASE_STEP = 0.1  # requests/second added after each healthy streak
+RATE_HEALTHY_STREAK = 20  # consecutive healthy responses before increasing the rate
+
+# Function to take a token from the bucket, waiting until one is available
+def acquire_api_token():
+    while True:
+        with rate_lock:
+            now = time.monotonic()
+            elapsed = now - rate_limiter['last_refill']
+            rate_limiter['tokens'] = min(API_BURST, rate_limiter['tokens'] + elapsed * rate_limiter['rate'])
+            rate_limiter['last_refill'] = now
+            
+            if now < rate_limiter['paused_until']:
+                wait_seconds = rate_limiter['paused_until'] - now
+            elif rate_limiter['tokens'] >= 1:
+                rate_limiter['tokens'] -= 1
+                return
+            else:
+                wait_seconds = (1 - rate_limiter['tokens']) / rate_limiter['rate']
+        
+        time.sleep(wait_seconds)
+
+# Function to adjust the limiter based on an API response status
+def report_api_response(status_code, retry_after=None):
+    with rate_lock:
+        if status_code == 429 or status_code >= 500:
+            rate_limiter['rate'] = max(API_RATE_MIN, rate_limiter['rate'] / 2)
+            rate_limiter['tokens'] = 0
+            rate_limiter['healthy_streak'] = 0
+            if status_code == 429:
+                rate_limiter['throttled_responses'] += 1
+            else:
+                rate_limiter['server_errors'] += 1
+            if retry_after:
+                rate_limiter['paused_until'] = time.monotonic() + retry_after
+            print(f"API returned {status_code}, limiter backing off to {rate_limiter['rate']:.2f} requests/second")
+        else:
+            rate_limiter['healthy_streak'] += 1
+            if rate_limiter['healthy_streak'] >= RATE_HEALTHY_STREAK:
+                rate_limiter['rate'] = min(API_RATE_MAX, rate_limiter['rate'] + RATE_INCREASE_STEP)
+                rate_limiter['healthy_streak'] = 0
+
+# Function to get a snapshot of the limiter state for stats
+def get_rate_limiter_stats():
+    with rate_lock:
+        return {
+            'current_rate': round(rate_limiter['rate'], 3),
+            'min_rate': API_RATE_MIN,
+            'max_rate': API_RATE_MAX,
+            'throttled_responses': rate_limiter['throttled_responses'],
+            'server_errors': rate_limiter['server_errors']
+        }
+
+# Function to create the shared HTTP session used for API calls and media downloads
+def create_http_session():
+    session = requests.Session()
+    
+    # Retry transport failures (connect/read errors) at the adapter level only.
+    # Status-based retries stay in make_api_request so the rate limiter sees 429/5xx.
+    retries = Retry(total=3, connect=3, read=2, status=0, backoff_factor=1, allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'User-Agent': 'ifixit-aws-integration/1.0'
+    })
+    return session
+
+# Shared session: keeps one keep-alive connection pool per host (API and image CDN)
+http_session = create_http_session()
+
+# Function to make a GET request on the shared session with default timeouts
+def http_get(url, **kwargs):
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return http_session.get(url, **kwargs)
+
+# Function to report connection reuse per host from the session's pools
+def get_http_pool_stats():
+    hosts = {}
+    for adapter in set(http_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[pool.host] = {
+                'requests': pool.num_requests,
+                'connections_opened': pool.num_connections,
+                'connections_reused': max(pool.num_requests - pool.num_connections, 0)
+            }
+    return hosts
+
 # Function to make an API request with retries
 def make_api_request(url, max_retries=3, retry_delay=5):
     retries = 0
     while retries < max_retries:
         try:
+            acquire_api_token()
             print(f"Requesting: {url}")
-            response = requests.get(url)
+            response = http_get(url)
+            if response.status_code == 429:  # Rate limited
+                retry_after = response.headers.get('Retry-After')
+                report_api_response(429, int(retry_after) if retry_after and retry_after.isdigit() else retry_delay)
+                print("Rate limited. Limiter paused before retry.")
+                retries += 1
+                continue
+            
+            report_api_response(response.status_code)
             if response.status_code == 200:
                 return response.json()
-            elif response.status_code == 429:  # Rate limited
-                retry_delay = int(response.headers.get('Retry-After', retry_delay * 2))
-                print(f"Rate limited. Waiting {retry_delay} seconds before retry.")
             else:
                 print(f"API Error: {response.status_code} - {response.text}")
             
@@ -241,181 +498,617 @@ def fetch_all_tags(limit=100, offset=0, order='ASC'):
     print(f"Fetching tags from {url}")
     return make_api_request(url)
 
+# Function to get the local state file for an in-progress multipart upload
+def get_upload_state_file(s3_path):
+    return os.path.join(MEDIA_UPLOAD_STATE_DIR, s3_path.replace('/', '_') + '.json')
+
+# Function to load the state of an unfinished multipart upload, if any
+def load_upload_state(s3_path):
+    state_file = get_upload_state_file(s3_path)
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading upload state for {s3_path}: {e}")
+    return None
+
+# Function to save multipart upload state after each completed part
+def save_upload_state(s3_path, state):
+    os.makedirs(MEDIA_UPLOAD_STATE_DIR, exist_ok=True)
+    with open(get_upload_state_file(s3_path), 'w') as f:
+        json.dump(state, f)
+
+# Function to remove multipart upload state once the upload is finished or abandoned
+def clear_upload_state(s3_path):
+    state_file = get_upload_state_file(s3_path)
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+# Function to abort an unfinished multipart upload and forget its state
+def abort_multipart_upload(s3_path, state):
+    try:
+        s3_client.abort_multipart_upload(Bucket=MEDIA_BUCKET, Key=s3_path, UploadId=state['upload_id'])
+    except Exception as e:
+        print(f"Error aborting multipart upload for {s3_path}: {e}")
+    clear_upload_state(s3_path)
+
+# Function to upload one buffered part and record it in the upload state
+def upload_media_part(s3_path, state, data):
+    part_number = len(state['parts']) + 1
+    response = s3_client.upload_part(
+        Bucket=MEDIA_BUCKET,
+        Key=s3_path,
+        UploadId=state['upload_id'],
+        PartNumber=part_number,
+        Body=data
+    )
+    state['parts'].append({'PartNumber': part_number, 'ETag': response['ETag']})
+    state['bytes_uploaded'] += len(data)
+    save_upload_state(s3_path, state)
+
+# Function to stream an HTTP response body into a multipart upload.
+# Memory is bounded by MEDIA_PART_SIZE; completed parts survive a failed
+# transfer so the next attempt resumes with an HTTP Range request.
+# Returns the object's ETag and size; hasher, if given, sees every byte streamed.
+# With expected_size, a body that ends early raises before its last partial part
+# is uploaded, so the saved parts stay a valid prefix to resume from.
+def stream_media_multipart(response, s3_path, content_type, state, hasher=None, expected_size=None):
+    if state is None:
+        upload = s3_client.create_multipart_upload(
+            Bucket=MEDIA_BUCKET,
+            Key=s3_path,
+            ContentType=content_type
+        )
+        state = {'upload_id': upload['UploadId'], 'parts': [], 'bytes_uploaded': 0}
+        save_upload_state(s3_path, state)
+    
+    buffer = bytearray()
+    for chunk in response.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+        if hasher:
+            hasher.update(chunk)
+        buffer.extend(chunk)
+        if len(buffer) >= MEDIA_PART_SIZE:
+            upload_media_part(s3_path, state, bytes(buffer))
+            buffer = bytearray()
+    
+    received = state['bytes_uploaded'] + len(buffer)
+    if expected_size is not None and received != expected_size:
+        raise Exception(f"Transfer of {s3_path} ended at byte {received} of {expected_size}")
+    
+    if buffer or not state['parts']:
+        upload_media_part(s3_path, state, bytes(buffer))
+    
+    result = s3_client.complete_multipart_upload(
+        Bucket=MEDIA_BUCKET,
+        Key=s3_path,
+        UploadId=state['upload_id'],
+        MultipartUpload={'Parts': state['parts']}
+    )
+    clear_upload_state(s3_path)
+    return result.get('ETag'), state['bytes_uploaded']
+
+# Media index: maps iFixit image ids and content hashes to objects already in S3,
+# so re-crawls and images shared between guides skip the download and the PUT.
+# Uses its own small pool of autocommit connections because download_media runs on worker
+# threads; media_index_lock only guards the in-memory cache, never a database round trip.
+media_index_lock = threading.Lock()
+media_index_pool = None
+media_index_pool_lock = threading.Lock()
+media_index_slots = threading.BoundedSemaphore(MEDIA_INDEX_POOL_SIZE)  # lets extra threads wait for a connection
+verified_media = OrderedDict()  # image id -> s3_path confirmed in S3 during this run, least recently used first
+media_cache_stats = {'hits': 0, 'hash_hits': 0, 'misses': 0}
+
+# Function to get the media index pool, creating it on first use
+def get_media_index_pool():
+    global media_index_pool
+    
+    with media_index_pool_lock:
+        if media_index_pool is None:
+            media_index_pool = psycopg2.pool.ThreadedConnectionPool(1, MEDIA_INDEX_POOL_SIZE, **db_params)
+        return media_index_pool
+
+# Function to run a query against the media index, returning the first row if any
+def query_media_index(query, params):
+    with media_index_slots:
+        try:
+            pool = get_media_index_pool()
+            conn = pool.getconn()
+        except Exception as e:
+            print(f"Error connecting to media index: {e}")
+            return None
+        
+        broken = False
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchone() if cursor.description else None
+            finally:
+                cursor.close()
+        except Exception as e:
+            print(f"Error querying media index: {e}")
+            # Don't hand a connection in an unknown state to the next thread
+            broken = True
+            return None
+        finally:
+            pool.putconn(conn, close=broken)
+
+# Function to record an uploaded media object in the index
+def record_media_object(image_id, s3_path, etag, size, content_hash):
+    query_media_index("""
+        INSERT INTO media_objects (image_id, s3_path, etag, size, content_hash)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (image_id) DO UPDATE SET
+            s3_path = EXCLUDED.s3_path,
+            etag = EXCLUDED.etag,
+            size = EXCLUDED.size,
+            content_hash = COALESCE(EXCLUDED.content_hash, media_objects.content_hash),
+            updated_at = CURRENT_TIMESTAMP
+    """, (str(image_id), s3_path, etag, size, content_hash))
+
+# Function to check that an indexed object still exists in S3 with the same ETag or size
+def media_object_exists(indexed):
+    try:
+        head = s3_client.head_object(Bucket=MEDIA_BUCKET, Key=indexed['s3_path'])
+    except Exception:
+        return False
+    if indexed['etag'] and head.get('ETag') == indexed['etag']:
+        return True
+    return indexed['size'] is not None and head.get('ContentLength') == indexed['size']
+
+# Function to find an already uploaded copy of an image by its iFixit id
+def find_cached_media(image_id):
+    with media_index_lock:
+        s3_path = verified_media.get(str(image_id))
+        if s3_path:
+            verified_media.move_to_end(str(image_id))
+    if s3_path:
+        return s3_path
+    
+    indexed = query_media_index(
+        "SELECT s3_path, etag, size FROM media_objects WHERE image_id = %s",
+        (str(image_id),)
+    )
+    if indexed and media_object_exists(indexed):
+        with media_index_lock:
+            verified_media[str(image_id)] = indexed['s3_path']
+            # Bounded LRU: a long crawl sees millions of images, and an evicted id only costs an index lookup
+            while len(verified_media) > VERIFIED_MEDIA_CACHE_SIZE:
+                verified_media.popitem(last=False)
+        return indexed['s3_path']
+    return None
+
+# Function to count media cache hits and misses
+def record_media_cache(outcome):
+    with stats_lock:
+        media_cache_stats[outcome] += 1
+
+# Function to get the total size of a media object from a response, if the server gave it
+def get_media_size(response):
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get('Content-Length')
+    return int(content_length) if content_length else None
+
+# Function to get the first byte a 206 response starts at
+def get_range_start(response):
+    match = re.match(r"bytes (\d+)-", response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
 # Function to download media
 def download_media(url, media_type, media_id):
     global media_downloaded
     
+    file_extension = url.split('.')[-1] if '.' in url else 'jpg'
+    s3_path = f"ifixit/{media_type}/{media_id}/original.{file_extension}"
+    
+    # Skip the HTTP fetch and the PUT when this image is already in S3
+    cached_path = find_cached_media(media_id)
+    if cached_path:
+        record_media_cache('hits')
+        return cached_path
+    
     try:
         print(f"Downloading media: {url}")
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            file_extension = url.split('.')[-1] if '.' in url else 'jpg'
-            s3_path = f"ifixit/{media_type}/{media_id}/original.{file_extension}"
+        
+        # Resume an unfinished multipart upload from the first byte not yet uploaded.
+        # Byte offsets are only meaningful in the identity encoding: with gzip a Range
+        # would count bytes of the compressed stream, so media is never content-encoded.
+        state = load_upload_state(s3_path)
+        headers = {'Accept-Encoding': 'identity'}
+        if state:
+            headers['Range'] = f"bytes={state['bytes_uploaded']}-"
+        
+        with http_get(url, stream=True, headers=headers) as response:
+            if state and (response.status_code != 206 or response.headers.get('Content-Encoding')
+                          or get_range_start(response) != state['bytes_uploaded']):
+                # Server ignored the range request or answered another one, start the upload over
+                abort_multipart_upload(s3_path, state)
+                state = None
+                if response.status_code == 206:
+                    print(f"Unusable partial response for {url}, restarting on the next attempt")
+                    return None
             
-            s3_client.put_object(
-                Bucket=MEDIA_BUCKET,
-                Key=s3_path,
-                Body=response.content
-            )
+            if response.status_code not in (200, 206):
+                print(f"Error downloading media {url}: {response.status_code}")
+                return None
+            
+            content_type = response.headers.get('Content-Type', 'application/octet-stream')
+            # Sizes only match the body we read when it isn't content-encoded
+            media_size = None if response.headers.get('Content-Encoding') else get_media_size(response)
+            
+            if state is None and media_size and media_size <= MEDIA_PART_SIZE:
+                # Small file: a single PUT, holding at most one part in memory
+                body = response.content
+                if len(body) != media_size:
+                    raise Exception(f"Download of {url} ended at byte {len(body)} of {media_size}")
+                content_hash = hashlib.sha256(body).hexdigest()
+                
+                # Same bytes already uploaded under another image id: reuse that object
+                duplicate = query_media_index(
+                    "SELECT s3_path, etag, size FROM media_objects WHERE content_hash = %s LIMIT 1",
+                    (content_hash,)
+                )
+                if duplicate and media_object_exists(duplicate):
+                    record_media_object(media_id, duplicate['s3_path'], duplicate['etag'], duplicate['size'], content_hash)
+                    record_media_cache('hash_hits')
+                    return duplicate['s3_path']
+                
+                result = s3_client.put_object(
+                    Bucket=MEDIA_BUCKET,
+                    Key=s3_path,
+                    Body=body,
+                    ContentType=content_type,
+                    ContentLength=media_size
+                )
+                etag, size = result.get('ETag'), len(body)
+            else:
+                # A resumed upload only streams the remaining bytes, so it can't be hashed
+                hasher = hashlib.sha256() if state is None else None
+                etag, size = stream_media_multipart(response, s3_path, content_type, state, hasher, media_size)
+                content_hash = hasher.hexdigest() if hasher else None
+            
+            record_media_object(media_id, s3_path, etag, size, content_hash)
+            record_media_cache('misses')
             print(f"Saved media to S3: {s3_path}")
-            media_downloaded += 1
+            with stats_lock:
+                media_downloaded += 1
             return s3_path
-        else:
-            print(f"Error downloading media {url}: {response.status_code}")
-            return None
     except Exception as e:
         print(f"Error processing media {url}: {e}")
+        if 'NoSuchUpload' in str(e):
+            # The multipart upload expired on the S3 side, so the saved parts are gone
+            clear_upload_state(s3_path)
         return None
 
-# Function to process category hierarchy recursively
-def process_category_hierarchy(hierarchy, parent_id=None, path=''):
-    global categories_processed
+# Function to flatten the category hierarchy into levels of (title, path, parent path)
+def flatten_category_hierarchy(hierarchy):
+    levels = []
+    pending = [(hierarchy, None)]
     
-    for title, children in hierarchy.items():
-        try:
-            # Create full path for this category
-            current_path = f"{path}/{title}" if path else title
-            
-            # Insert or update category in database
-            conn = psycopg2.connect(**db_params)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO categories (title, display_title, category_path, parent_id) 
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (title, parent_id) DO UPDATE SET
-                    display_title = EXCLUDED.display_title,
-                    category_path = EXCLUDED.category_path,
-                    updated_at = CURRENT_TIMESTAMP
-                RETURNING id
-            """, (title, title, current_path, parent_id))
-            
-            category_id = cursor.fetchone()[0]
-            categories_processed += 1
-            
-            conn.commit()
-            
-            print(f"Processed category: {title} (ID: {category_id}, Path: {current_path})")
-            
-            # Process child categories recursively if any
-            if children is not None:
-                process_category_hierarchy(children, category_id, current_path)
-            
-        except Exception as e:
-            print(f"Error processing category {title}: {e}")
-            if 'conn' in locals() and conn:
-                conn.rollback()
-        finally:
-            if 'cursor' in locals() and cursor:
-                cursor.close()
-            if 'conn' in locals() and conn:
-                conn.close()
+    while pending:
+        level = []
+        next_pending = []
+        for children, parent_path in pending:
+            for title, grandchildren in children.items():
+                current_path = f"{parent_path}/{title}" if parent_path else title
+                level.append((title, current_path, parent_path))
+                if grandchildren is not None:
+                    next_pending.append((grandchildren, current_path))
+        if level:
+            levels.append(level)
+        pending = next_pending
+    
+    return levels
 
-# Function to store wiki in database
-def store_wiki_in_db(wiki_data, tags, conn):
+# Function to bulk-load the category hierarchy in a single transaction.
+# Categories are written level by level with multi-row upserts, so every
+# parent_id is known from the previous level's RETURNING ids.
+def load_category_hierarchy(hierarchy, conn):
+    global categories_processed, category_load_seconds
+    
+    load_start = time.time()
+    levels = flatten_category_hierarchy(hierarchy)
+    path_ids = {}
+    
     try:
         cursor = conn.cursor()
         
-        # Check if this is a category wiki
-        if wiki_data.get('namespace') == 'CATEGORY':
-            # Try to find or update the existing category
-            cursor.execute("""
-                UPDATE categories
-                SET wikiid = %s,
-                    summary = %s,
-                    namespace = %s,
-                    raw_data = %s,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE title = %s OR display_title = %s
-                RETURNING id
-            """, (
-                wiki_data.get('wikiid'),
-                wiki_data.get('summary'),
-                wiki_data.get('namespace'),
-                json.dumps(wiki_data),
-                wiki_data.get('title'),
-                wiki_data.get('display_title')
-            ))
-            
-            result = cursor.fetchone()
-            
-            if not result:
-                # If no category was updated, insert as new category
-                cursor.execute("""
-                    INSERT INTO categories
-                    (title, display_title, wikiid, namespace, summary, raw_data)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    wiki_data.get('title'),
-                    wiki_data.get('display_title'),
-                    wiki_data.get('wikiid'),
-                    wiki_data.get('namespace'),
-                    wiki_data.get('summary'),
-                    json.dumps(wiki_data)
-                ))
+        # Top-level categories have a NULL parent_id, which the (title, parent_id)
+        # unique constraint never matches, so existing ones are updated by id
+        top_titles = [title for title, current_path, parent_path in levels[0]] if levels else []
+        cursor.execute("""
+            SELECT title, MIN(id)
+            FROM categories
+            WHERE parent_id IS NULL AND title = ANY(%s)
+            GROUP BY title
+        """, (top_titles,))
+        existing_top = dict(cursor.fetchall())
+        
+        for depth, level in enumerate(levels):
+            if depth == 0:
+                updates = [(existing_top[title], title, current_path) for title, current_path, parent_path in level if title in existing_top]
+                inserts = [(title, title, current_path, None) for title, current_path, parent_path in level if title not in existing_top]
                 
-                category_id = cursor.fetchone()[0]
-                print(f"Created new category from wiki: {wiki_data.get('title')} (ID: {category_id})")
+                if updates:
+                    psycopg2.extras.execute_values(cursor, """
+                        UPDATE categories c
+                        SET display_title = v.title,
+                            category_path = v.path,
+                            updated_at = CURRENT_TIMESTAMP
+                        FROM (VALUES %s) AS v(id, title, path)
+                        WHERE c.id = v.id
+                    """, updates, page_size=1000)
+                    path_ids.update({current_path: category_id for category_id, title, current_path in updates})
             else:
-                category_id = result[0]
-                print(f"Updated existing category from wiki: {wiki_data.get('title')} (ID: {category_id})")
+                inserts = [
+                    (title, title, current_path, path_ids[parent_path])
+                    for title, current_path, parent_path in level if parent_path in path_ids
+                ]
             
-            # Process image if available
-            if 'image' in wiki_data and wiki_data['image'] is not None and 'original' in wiki_data['image']:
-                image_url = wiki_data['image']['original']
-                s3_path = download_media(image_url, 'images', wiki_data['image']['id'])
-                
-                if s3_path:
-                    # Update the category with the image URL
-                    cursor.execute("""
-                        UPDATE categories
-                        SET image_url = %s
-                        WHERE id = %s
-                    """, (s3_path, category_id))
+            if inserts:
+                results = psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO categories (title, display_title, category_path, parent_id) 
+                    VALUES %s
+                    ON CONFLICT (title, parent_id) DO UPDATE SET
+                        display_title = EXCLUDED.display_title,
+                        category_path = EXCLUDED.category_path,
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING category_path, id
+                """, inserts, page_size=1000, fetch=True)
+                path_ids.update(dict(results))
             
-            # Add tags to the wiki
-            if tags:
-                for tag_name in tags:
-                    try:
-                        # Insert or get tag
-                        cursor.execute("""
-                            INSERT INTO tags (name)
-                            VALUES (%s)
-                            ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
-                            RETURNING id
-                        """, (tag_name,))
-                        tag_id = cursor.fetchone()[0]
-                        
-                        # Link tag to wiki
-                        cursor.execute("""
-                            INSERT INTO wiki_tags (wiki_id, tag_id)
-                            VALUES (%s, %s)
-                            ON CONFLICT DO NOTHING
-                        """, (wiki_data.get('wikiid'), tag_id))
-                        
-                        print(f"Added tag '{tag_name}' to wiki {wiki_data.get('wikiid')}")
-                    except Exception as e:
-                        print(f"Error processing tag '{tag_name}' for wiki: {e}")
+            print(f"Loaded {len(level)} categories at depth {depth}")
         
         conn.commit()
-        return True
+        categories_processed += len(path_ids)
+        category_load_seconds = round(time.time() - load_start, 2)
+        print(f"Loaded {len(path_ids)} categories in {category_load_seconds} seconds")
     except Exception as e:
         conn.rollback()
-        print(f"Error storing wiki in database: {e}")
-        return False
+        print(f"Error loading category hierarchy: {e}")
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+
+# Function to write category wikis with the given cursor; the caller commits.
+# Each category is matched to at most one wiki: by title first, then by display title
+# for the wikis whose title matched nothing. Returns (updated, inserted, tag links).
+def write_wiki_rows(cursor, category_items):
+    # One row per wikiid and per title, the last one seen wins
+    rows_by_title = {}
+    for wiki, tags, image_path in category_items:
+        rows_by_title[wiki.get('title')] = (
+            wiki.get('title'),
+            wiki.get('display_title'),
+            wiki.get('wikiid'),
+            wiki.get('namespace'),
+            wiki.get('summary'),
+            json.dumps(wiki),
+            image_path
+        )
+    rows = list({row[2]: row for row in rows_by_title.values()}.values())
+    row_template = "(%s, %s, %s::integer, %s, %s, %s::jsonb, %s)"
+    update_query = """
+        UPDATE categories c
+        SET wikiid = v.wikiid,
+            summary = v.summary,
+            namespace = v.namespace,
+            raw_data = v.raw_data,
+            image_url = COALESCE(v.image_url, c.image_url),
+            updated_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS v(title, display_title, wikiid, namespace, summary, raw_data, image_url)
+    """
+    
+    # Update the categories whose title matches
+    updated = psycopg2.extras.execute_values(cursor, update_query + """
+        WHERE c.title = v.title
+        RETURNING c.id, v.wikiid
+    """, rows, template=row_template, page_size=1000, fetch=True)
+    updated_category_ids = [row[0] for row in updated]
+    updated_ids = {row[1] for row in updated}
+    
+    # Then by display title, for unmatched wikis only and never a category updated above
+    by_display_title = {row[1]: row for row in rows if row[2] not in updated_ids and row[1]}
+    if by_display_title:
+        # execute_values takes no other parameters, so the ids are rendered into the statement
+        excluded_ids = cursor.mogrify("%s::integer[]", (updated_category_ids,)).decode()
+        updated = psycopg2.extras.execute_values(cursor, update_query + f"""
+            WHERE c.display_title = v.display_title
+              AND c.id != ALL({excluded_ids})
+            RETURNING c.id, v.wikiid
+        """, list(by_display_title.values()), template=row_template, page_size=1000, fetch=True)
+        updated_ids |= {row[1] for row in updated}
+    
+    # Insert the rest as new categories
+    inserts = [row for row in rows if row[2] not in updated_ids]
+    if inserts:
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO categories
+            (title, display_title, wikiid, namespace, summary, raw_data, image_url)
+            VALUES %s
+        """, inserts, template=row_template, page_size=1000)
+    
+    # Add tags and link them to their wikis
+    tag_links = {(wiki.get('wikiid'), tag_name) for wiki, tags, image_path in category_items for tag_name in (tags or [])}
+    if tag_links:
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO tags (name)
+            VALUES %s
+            ON CONFLICT (name) DO NOTHING
+        """, [(tag_name,) for tag_name in sorted({tag_name for wiki_id, tag_name in tag_links})], page_size=1000)
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO wiki_tags (wiki_id, tag_id)
+            SELECT v.wiki_id, t.id
+            FROM (VALUES %s) AS v(wiki_id, name)
+            JOIN tags t ON t.name = v.name
+            ON CONFLICT DO NOTHING
+        """, sorted(tag_links), template="(%s::integer, %s)", page_size=1000)
+    
+    return len(updated_ids), len(inserts), len(tag_links)
+
+# Function to store a batch of (wiki, tags, image s3 path) in one transaction.
+# Only CATEGORY wikis are kept in the database; they update the matching category or add a new one.
+# If the batch fails, its wikis are retried one per transaction so one bad wiki only loses itself.
+# Returns the number of wikis handled.
+def store_wikis_in_db(items, conn):
+    category_items = [(wiki, tags, image_path) for wiki, tags, image_path in items if wiki.get('namespace') == 'CATEGORY']
+    if not category_items:
+        return len(items)
+    
+    try:
+        cursor = conn.cursor()
+        updated, inserted, tag_links = write_wiki_rows(cursor, category_items)
+        conn.commit()
+        print(f"Stored {len(category_items)} category wikis ({updated} updated, {inserted} new, {tag_links} tag links)")
+        return len(items)
+    except Exception as e:
+        conn.rollback()
+        print(f"Error storing wikis in database: {e}")
+        if len(category_items) == 1:
+            return len(items) - 1
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+    
+    # Fall back to one transaction per wiki
+    failed = 0
+    for item in category_items:
+        try:
+            cursor = conn.cursor()
+            write_wiki_rows(cursor, [item])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            failed += 1
+            print(f"Error storing wiki {item[0].get('title')}: {e}")
+        finally:
+            cursor.close()
+    print(f"Stored {len(category_items) - failed} of {len(category_items)} category wikis one at a time")
+    return len(items) - failed
+
+# Function to download all media referenced by a guide, keyed by media id
+def download_guide_media(guide_data, guide_details):
+    media_paths = {}
+    
+    if guide_details and 'steps' in guide_details:
+        for step in guide_details['steps']:
+            if 'media' in step and 'data' in step['media']:
+                for media_item in step['media']['data']:
+                    if 'original' in media_item and str(media_item['id']) not in media_paths:
+                        media_paths[str(media_item['id'])] = download_media(
+                            media_item['original'], 'images', media_item['id']
+                        )
+    
+    if 'image' in guide_data and guide_data['image'] and 'original' in guide_data['image']:
+        image = guide_data['image']
+        if str(image['id']) not in media_paths:
+            media_paths[str(image['id'])] = download_media(image['original'], 'images', image['id'])
+    
+    return media_paths
+
+# Function to get the S3 path for a media item, downloading it unless already done
+def resolve_media(media_paths, url, media_type, media_id):
+    if media_paths is not None:
+        return media_paths.get(str(media_id))
+    return download_media(url, media_type, media_id)
+
+# Statement that builds the lean /api/guides/<guide_id> document for one guide
+# in Postgres: steps carry the lines of their raw_data, not the whole blob.
+# Media carry s3_path only; the API adds presigned URLs when serving.
+guide_document_query = """
+    INSERT INTO guide_documents (guide_id, external_id, document)
+    SELECT g.id, g.external_id, json_build_object(
+        'id', g.id,
+        'external_id', g.external_id,
+        'title', g.title,
+        'subject', g.subject,
+        'type', g.type,
+        'difficulty', g.difficulty,
+        'category', g.category,
+        'image_path', (
+            SELECT m.s3_path FROM media m
+            WHERE m.guide_id = g.id AND m.step_id IS NULL
+            ORDER BY m.id LIMIT 1
+        ),
+        'steps', COALESCE((
+            SELECT json_agg(json_build_object(
+                'id', s.id,
+                'external_id', s.external_id,
+                'orderby', s.orderby,
+                'title', s.title,
+                'lines', s.raw_data->'lines',
+                'media', COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'id', m.id,
+                        'media_type', m.media_type,
+                        'external_id', m.external_id,
+                        's3_path', m.s3_path
+                    ) ORDER BY m.id)
+                    FROM media m
+                    WHERE m.guide_id = g.id AND m.step_id = s.id
+                ), '[]'::json)
+            ) ORDER BY s.orderby)
+            FROM steps s
+            WHERE s.guide_id = g.id
+        ), '[]'::json),
+        'tags', COALESCE((
+            SELECT json_agg(json_build_object('id', t.id, 'name', t.name) ORDER BY t.id)
+            FROM tags t
+            JOIN guide_tags gt ON t.id = gt.tag_id
+            WHERE gt.guide_id = g.id
+        ), '[]'::json)
+    )
+    FROM guides g
+    WHERE g.id = %s
+    ON CONFLICT (guide_id) DO UPDATE SET
+        external_id = EXCLUDED.external_id,
+        document = EXCLUDED.document,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Function to build documents for stored guides that don't have one yet
+def rebuild_guide_documents(conn, batch_size=500):
+    cursor = conn.cursor()
+    rebuilt = 0
+    try:
+        while True:
+            cursor.execute("""
+                SELECT g.id FROM guides g
+                LEFT JOIN guide_documents d ON g.id = d.guide_id
+                WHERE d.guide_id IS NULL
+                ORDER BY g.id
+                LIMIT %s
+            """, (batch_size,))
+            guide_ids = [row[0] for row in cursor.fetchall()]
+            if not guide_ids:
+                break
+            for guide_id in guide_ids:
+                cursor.execute(guide_document_query, (guide_id,))
+            conn.commit()
+            rebuilt += len(guide_ids)
+            print(f"Built {rebuilt} guide documents")
+    finally:
+        cursor.close()
+    return rebuilt
 
 # Function to store guide in database
-def store_guide_in_db(guide_data, guide_details, tags, conn):
+# media_paths, if given, holds S3 paths already downloaded by download_guide_media
+def store_guide_in_db(guide_data, guide_details, tags, conn, media_paths=None):
     try:
         cursor = conn.cursor()
         
-        # Insert guide
+        # Insert guide, resolving its category in the same statement
         cursor.execute("""
             INSERT INTO guides 
-            (source_id, external_id, title, subject, type, difficulty, category, locale, 
+            (source_id, external_id, title, subject, type, difficulty, category, category_id, locale, 
              flags, summary, public, modified_date, raw_data)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            VALUES (%s, %s, %s, %s, %s, %s, %s,
+                    (SELECT id FROM categories WHERE title = %s OR display_title = %s LIMIT 1),
+                    %s, %s, %s, %s, %s, %s)
             ON CONFLICT (source_id, external_id) 
             DO UPDATE SET 
                 title = EXCLUDED.title,
@@ -423,6 +1116,7 @@ def store_guide_in_db(guide_data, guide_details, tags, conn):
                 type = EXCLUDED.type,
                 difficulty = EXCLUDED.difficulty,
                 category = EXCLUDED.category,
+                category_id = COALESCE(EXCLUDED.category_id, guides.category_id),
                 locale = EXCLUDED.locale,
                 flags = EXCLUDED.flags,
                 summary = EXCLUDED.summary,
@@ -439,6 +1133,8 @@ def store_guide_in_db(guide_data, guide_details, tags, conn):
             guide_data.get('type', ''),
             guide_details.get('difficulty', {}).get('name') if guide_details and 'difficulty' in guide_details else None,
             guide_data.get('category', ''),
+            guide_data.get('category') or None,
+            guide_data.get('category') or None,
             guide_data.get('locale', 'en'),
             json.dumps(guide_data.get('flags', [])) if 'flags' in guide_data else None,
             guide_data.get('summary', ''),
@@ -450,109 +1146,106 @@ def store_guide_in_db(guide_data, guide_details, tags, conn):
         guide_id = cursor.fetchone()[0]
         print(f"Stored/updated guide in database with ID: {guide_id}")
         
-        # Try to link guide to category
-        if guide_data.get('category'):
-            cursor.execute("""
-                SELECT id FROM categories 
-                WHERE title = %s OR display_title = %s
-                LIMIT 1
-            """, (guide_data.get('category'), guide_data.get('category')))
-            
-            result = cursor.fetchone()
-            if result:
-                category_id = result[0]
-                cursor.execute("""
-                    UPDATE guides
-                    SET category_id = %s
-                    WHERE id = %s
-                """, (category_id, guide_id))
-                print(f"Linked guide {guide_id} to category {category_id}")
-        
-        # Process steps if available
+        # Process steps if available: one multi-row upsert for all steps
         if guide_details and 'steps' in guide_details:
+            step_rows = {}
             for step in guide_details['steps']:
-                try:
-                    cursor.execute("""
-                        INSERT INTO steps
-                        (guide_id, external_id, orderby, title, raw_data)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (guide_id, external_id) 
-                        DO UPDATE SET 
-                            orderby = EXCLUDED.orderby,
-                            title = EXCLUDED.title,
-                            raw_data = EXCLUDED.raw_data,
-                            updated_at = CURRENT_TIMESTAMP
-                        RETURNING id
-                    """, (
-                        guide_id,
-                        str(step.get('stepid', '')),
-                        step.get('orderby', 0),
-                        step.get('title', ''),
-                        json.dumps(step)
-                    ))
-                    
-                    step_id = cursor.fetchone()[0]
-                    print(f"Stored/updated step with ID: {step_id}")
-                    
-                    # Process media for step
-                    if 'media' in step and 'data' in step['media']:
-                        for media_item in step['media']['data']:
-                            if 'original' in media_item:
-                                try:
-                                    media_type = 'images'
-                                    s3_path = download_media(
-                                        media_item['original'], 
-                                        media_type, 
-                                        media_item['id']
-                                    )
-                                    
-                                    if s3_path:
-                                        cursor.execute("""
-                                            INSERT INTO media
-                                            (guide_id, step_id, media_type, external_id, original_url, s3_path, metadata)
-                                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                                            ON CONFLICT (guide_id, step_id, external_id) 
-                                            DO UPDATE SET 
-                                                original_url = EXCLUDED.original_url,
-                                                s3_path = EXCLUDED.s3_path
-                                            RETURNING id
-                                        """, (
-                                            guide_id,
-                                            step_id,
-                                            media_type,
-                                            str(media_item['id']),
-                                            media_item['original'],
-                                            s3_path,
-                                            json.dumps(media_item)
-                                        ))
-                                        
-                                        media_id = cursor.fetchone()[0]
-                                        print(f"Stored/updated media with ID: {media_id}")
-                                except Exception as e:
-                                    print(f"Error processing step media: {e}")
-                except Exception as e:
-                    print(f"Error processing step: {e}")
+                external_id = str(step.get('stepid', ''))
+                step_rows[external_id] = (
+                    guide_id,
+                    external_id,
+                    step.get('orderby', 0),
+                    step.get('title', ''),
+                    json.dumps(step)
+                )
+            
+            step_ids = {}
+            if step_rows:
+                results = psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO steps
+                    (guide_id, external_id, orderby, title, raw_data)
+                    VALUES %s
+                    ON CONFLICT (guide_id, external_id) 
+                    DO UPDATE SET 
+                        orderby = EXCLUDED.orderby,
+                        title = EXCLUDED.title,
+                        raw_data = EXCLUDED.raw_data,
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING external_id, id
+                """, list(step_rows.values()), fetch=True)
+                step_ids = dict(results)
+                print(f"Stored/updated {len(step_ids)} steps")
+            
+            # Collect media for all steps, then write them with one multi-row upsert
+            media_rows = {}
+            for step in guide_details['steps']:
+                step_id = step_ids.get(str(step.get('stepid', '')))
+                if step_id is None or 'media' not in step or 'data' not in step['media']:
+                    continue
+                for media_item in step['media']['data']:
+                    if 'original' in media_item:
+                        try:
+                            media_type = 'images'
+                            s3_path = resolve_media(
+                                media_paths,
+                                media_item['original'], 
+                                media_type, 
+                                media_item['id']
+                            )
+                            
+                            if s3_path:
+                                media_rows[(step_id, str(media_item['id']))] = (
+                                    guide_id,
+                                    step_id,
+                                    media_type,
+                                    str(media_item['id']),
+                                    media_item['original'],
+                                    s3_path,
+                                    json.dumps(media_item)
+                                )
+                        except Exception as e:
+                            print(f"Error processing step media: {e}")
+            
+            if media_rows:
+                psycopg2.extras.execute_values(cursor, """
+                    INSERT INTO media
+                    (guide_id, step_id, media_type, external_id, original_url, s3_path, metadata)
+                    VALUES %s
+                    ON CONFLICT (guide_id, step_id, external_id) 
+                    DO UPDATE SET 
+                        original_url = EXCLUDED.original_url,
+                        s3_path = EXCLUDED.s3_path
+                """, list(media_rows.values()))
+                print(f"Stored/updated {len(media_rows)} step media items")
         
         # Process guide image
         if 'image' in guide_data and guide_data['image'] and 'original' in guide_data['image']:
             try:
                 media_type = 'images'
-                s3_path = download_media(
+                s3_path = resolve_media(
+                    media_paths,
                     guide_data['image']['original'], 
                     media_type, 
                     guide_data['image']['id']
                 )
                 
                 if s3_path:
+                    # Upsert the image and point the guide at it in one statement
                     cursor.execute("""
-                        INSERT INTO media
-                        (guide_id, step_id, media_type, external_id, original_url, s3_path, metadata)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (guide_id, step_id, external_id) 
-                        DO UPDATE SET 
-                            original_url = EXCLUDED.original_url,
-                            s3_path = EXCLUDED.s3_path
-                        RETURNING id
+                        WITH image AS (
+                            INSERT INTO media
+                            (guide_id, step_id, media_type, external_id, original_url, s3_path, metadata)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                            ON CONFLICT (guide_id, step_id, external_id) 
+                            DO UPDATE SET 
+                                original_url = EXCLUDED.original_url,
+                                s3_path = EXCLUDED.s3_path
+                            RETURNING id
+                        )
+                        UPDATE guides 
+                        SET image_id = (SELECT id FROM image)
+                        WHERE id = %s
+                        RETURNING image_id
                     """, (
                         guide_id,
                         None,  # No step_id for guide main image
@@ -560,45 +1253,34 @@ def store_guide_in_db(guide_data, guide_details, tags, conn):
                         str(guide_data['image']['id']),
                         guide_data['image']['original'],
                         s3_path,
-                        json.dumps(guide_data['image'])
+                        json.dumps(guide_data['image']),
+                        guide_id
                     ))
                     
                     media_id = cursor.fetchone()[0]
-                    
-                    # Update the guide with the image ID
-                    cursor.execute("""
-                        UPDATE guides 
-                        SET image_id = %s
-                        WHERE id = %s
-                    """, (media_id, guide_id))
-                    
                     print(f"Stored/updated guide main image with ID: {media_id}")
             except Exception as e:
                 print(f"Error processing guide main image: {e}")
         
-        # Process tags
+        # Process tags: upsert all tag names, then link them with a single insert
         if tags:
-            for tag_name in tags:
-                try:
-                    # Insert or get tag
-                    cursor.execute("""
-                        INSERT INTO tags (name)
-                        VALUES (%s)
-                        ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
-                        RETURNING id
-                    """, (tag_name,))
-                    tag_id = cursor.fetchone()[0]
-                    
-                    # Link tag to guide
-                    cursor.execute("""
-                        INSERT INTO guide_tags (guide_id, tag_id)
-                        VALUES (%s, %s)
-                        ON CONFLICT DO NOTHING
-                    """, (guide_id, tag_id))
-                    
-                    print(f"Added tag '{tag_name}' to guide")
-                except Exception as e:
-                    print(f"Error processing tag '{tag_name}': {e}")
+            tag_names = list(dict.fromkeys(tags))
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO tags (name)
+                VALUES %s
+                ON CONFLICT (name) DO NOTHING
+            """, [(tag_name,) for tag_name in tag_names])
+            
+            cursor.execute("""
+                INSERT INTO guide_tags (guide_id, tag_id)
+                SELECT %s, id FROM tags WHERE name = ANY(%s)
+                ON CONFLICT DO NOTHING
+            """, (guide_id, tag_names))
+            
+            print(f"Added {len(tag_names)} tags to guide")
+        
+        # Rebuild the document the API serves for this guide
+        cursor.execute(guide_document_query, (guide_id,))
         
         conn.commit()
         return guide_id
@@ -689,11 +1371,11 @@ def fetch_and_store_categories():
             except Exception as e:
                 print(f"Error saving categories hierarchy to S3: {e}")
             
-            # Process each category
+            # Bulk-load the whole hierarchy on one connection
             conn = psycopg2.connect(**db_params)
             try:
-                # Process the category hierarchy recursively
-                process_category_hierarchy(categories)
+                load_category_hierarchy(categories, conn)
+                bump_data_version(conn)
                 print(f"Processed {categories_processed} categories")
             finally:
                 conn.close()
@@ -701,137 +1383,716 @@ def fetch_and_store_categories():
             print("No categories returned from API")
     except Exception as e:
         print(f"Error fetching categories: {e}")
+        raise
 
-# Function to fetch all wikis, store them and related data
-def fetch_and_store_wikis(namespace='CATEGORY', batch_size=20):
-    global wikis_processed
-    
+# Function to save raw API data to the raw bucket
+def save_raw_json(key, data):
+    try:
+        s3_client.put_object(Bucket=RAW_BUCKET, Key=key, Body=json.dumps(data))
+    except Exception as e:
+        print(f"Error saving {key} to S3: {e}")
+
+# Function to run a blocking call (API request, S3 put, DB write) on an executor thread
+async def run_blocking(executor, function, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+# Function to page through one wiki namespace and queue its wikis for tag fetching
+async def list_wikis(namespace, executor, tag_queue):
     offset = 0
-    total_wikis = 0
-    
     try:
-        conn = psycopg2.connect(**db_params)
-        
-        while True:
-            # Fetch a batch of wikis
-            wikis = fetch_wikis(namespace, limit=batch_size, offset=offset)
+        while not shutdown_event.is_set():
+            list_start = time.time()
+            wikis = await run_blocking(executor, fetch_wikis, namespace, WIKI_LIST_BATCH_SIZE, offset)
+            record_stage('wiki_list', time.time() - list_start)
             
-            if not wikis or len(wikis) == 0:
+            if not wikis:
                 print(f"No more wikis returned for namespace {namespace}, stopping")
                 break
             
-            print(f"Fetched {len(wikis)} wikis for namespace {namespace}")
-            
-            # Store raw wikis list data in S3
-            try:
-                s3_client.put_object(
-                    Bucket=RAW_BUCKET,
-                    Key=f"ifixit/wikis/{namespace}/list/{offset}-{offset+len(wikis)}.json",
-                    Body=json.dumps(wikis)
-                )
-            except Exception as e:
-                print(f"Error saving wikis list to S3: {e}")
+            await run_blocking(executor, save_raw_json, f"ifixit/wikis/{namespace}/list/{offset}-{offset+len(wikis)}.json", wikis)
             
-            # Process each wiki
             for wiki in wikis:
-                wiki_id = wiki.get('wikiid')
-                wiki_title = wiki.get('title')
-                
-                if not wiki_id or not wiki_title:
-                    continue
-                
-                print(f"Processing wiki {wiki_id}: {wiki_title}")
-                
-                # Store current wiki data
-                try:
-                    # Fetch wiki tags
-                    tags = fetch_wiki_tags(namespace, wiki_title)
-                    
-                    if tags:
-                        # Store tags in S3
-                        try:
-                            s3_client.put_object(
-                                Bucket=RAW_BUCKET,
-                                Key=f"ifixit/wikis/{namespace}/{wiki_id}/tags.json",
-                                Body=json.dumps(tags)
-                            )
-                        except Exception as e:
-                            print(f"Error saving wiki tags to S3: {e}")
-                    
-                    # Store wiki in database
-                    if store_wiki_in_db(wiki, tags, conn):
-                        wikis_processed += 1
-                        print(f"Successfully processed wiki {wiki_id}")
-                except Exception as e:
-                    print(f"Error processing wiki {wiki_id}: {e}")
-                
-                # Be nice to the API - add small delay between requests
-                time.sleep(1)
+                if wiki.get('wikiid') and wiki.get('title'):
+                    await tag_queue.put((namespace, wiki))
             
-            # Update offset for next batch
             offset += len(wikis)
-            total_wikis += len(wikis)
-            print(f"Processed {offset} wikis for namespace {namespace}")
-            
-            # Save checkpoint periodically
-            now = datetime.now()
-            if (now - last_checkpoint_time).total_seconds() >= checkpoint_interval:
-                save_checkpoint()
-            
-            # Display progress periodically
-            if (now - last_checkpoint_time).total_seconds() >= stats_interval:
-                display_progress()
+            print(f"Listed {offset} wikis for namespace {namespace}")
         
-        print(f"Completed fetching {total_wikis} wikis for namespace {namespace}")
+        print(f"Stopped listing wikis for namespace {namespace} at offset {offset}")
     except Exception as e:
-        print(f"Error in fetch_and_store_wikis: {e}")
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+        print(f"Error listing wikis for namespace {namespace}: {e}")
 
-# Main function
-def main():
-    global current_offset, guides_processed, wikis_processed, categories_processed, media_downloaded, start_time, last_checkpoint_time
-    
-    print(f"Starting iFixit data fetcher at {datetime.now()}")
-    
-    # Load checkpoint if exists
-    if load_checkpoint():
-        # Checkpoint found, current_offset has been updated
-        pass
-    else:
-        # No checkpoint, start from beginning
-        current_offset = 0
-        guides_processed = 0
-        wikis_processed = 0
-        categories_processed = 0
-        media_downloaded = 0
+# Function run by each tag worker: fetches a wiki's tags and image, then hands it to the writer
+async def fetch_wiki_extras(executor, tag_queue, write_queue):
+    while True:
+        item = await tag_queue.get()
+        if item is None:
+            break
+        
+        namespace, wiki = item
+        try:
+            tags_start = time.time()
+            tags = await run_blocking(executor, fetch_wiki_tags, namespace, wiki['title'])
+            if tags:
+                await run_blocking(executor, save_raw_json, f"ifixit/wikis/{namespace}/{wiki['wikiid']}/tags.json", tags)
+            
+            # Category images are uploaded here so the writer's transaction only touches the database
+            image_path = None
+            image = wiki.get('image')
+            if wiki.get('namespace') == 'CATEGORY' and image and 'original' in image:
+                image_path = await run_blocking(executor, download_media, image['original'], 'images', image['id'])
+            record_stage('wiki_tags', time.time() - tags_start)
+            
+            await write_queue.put((wiki, tags, image_path))
+        except Exception as e:
+            print(f"Error processing wiki {wiki.get('wikiid')}: {e}")
+
+# Function run by the single writer: stores wikis in batches on its own connection
+async def write_wikis(db_executor, write_queue, conn):
+    global wikis_processed
     
-    # Record start time
-    start_time = datetime.now()
-    last_checkpoint_time = datetime.now()
+    batch = []
+    done = False
+    while not done:
+        try:
+            item = await asyncio.wait_for(write_queue.get(), timeout=WIKI_WRITE_FLUSH_SECONDS)
+            if item is None:
+                done = True
+            else:
+                batch.append(item)
+                if len(batch) < WIKI_WRITE_BATCH_SIZE:
+                    continue
+        except asyncio.TimeoutError:
+            pass
+        
+        if batch:
+            store_start = time.time()
+            stored = await run_blocking(db_executor, store_wikis_in_db, batch, conn)
+            with stats_lock:
+                wikis_processed += stored
+            record_stage('wiki_store', time.time() - store_start, len(batch))
+            batch = []
+        
+        # Save checkpoint and display progress periodically
+        now = datetime.now()
+        if (now - last_checkpoint_time).total_seconds() >= checkpoint_interval:
+            save_checkpoint()
+        if (now - last_checkpoint_time).total_seconds() >= stats_interval:
+            display_progress()
+
+# Function to crawl all wiki namespaces concurrently: one lister per namespace,
+# WIKI_TAG_WORKERS tag fetchers and a single batched database writer
+async def crawl_wikis(namespaces=WIKI_NAMESPACES):
+    executor = ThreadPoolExecutor(max_workers=WIKI_TAG_WORKERS + len(namespaces), thread_name_prefix='wiki')
+    db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wiki-db')
     
+    # Bounded queues keep listing from running far ahead of tag fetching and writing
+    tag_queue = asyncio.Queue(maxsize=WIKI_TAG_WORKERS * 4)
+    write_queue = asyncio.Queue(maxsize=WIKI_WRITE_BATCH_SIZE * 2)
+    
+    crawl_start = time.time()
+    conn = psycopg2.connect(**db_params)
     try:
-        # First, fetch and store categories
-        print("=== Fetching Categories ===")
-        fetch_and_store_categories()
+        writer = asyncio.create_task(write_wikis(db_executor, write_queue, conn))
+        workers = [asyncio.create_task(fetch_wiki_extras(executor, tag_queue, write_queue)) for _ in range(WIKI_TAG_WORKERS)]
         
-        # Next, fetch and store wikis for each namespace
-        print("=== Fetching Wikis ===")
-        for namespace in ['CATEGORY', 'ITEM', 'INFO']:
-            print(f"Fetching wikis for namespace: {namespace}")
-            fetch_and_store_wikis(namespace)
+        await asyncio.gather(*(list_wikis(namespace, executor, tag_queue) for namespace in namespaces))
         
-        # Now fetch guides
-        print("=== Fetching Guides ===")
-        conn = psycopg2.connect(**db_params)
+        for _ in workers:
+            await tag_queue.put(None)
+        await asyncio.gather(*workers)
+        await write_queue.put(None)
+        await writer
         
-        batch_size = 20  # Number of guides to fetch per API call
+        print(f"Completed fetching wikis for {', '.join(namespaces)} in {round(time.time() - crawl_start, 2)} seconds")
+    finally:
+        conn.close()
+        executor.shutdown(wait=False)
+        db_executor.shutdown(wait=False)
+
+# Function to refresh the guide counts read by /api/stats and /api/tags.
+# With categories/tag names given only those rows are recomputed; with None, all of them.
+def refresh_aggregates(conn, categories=None, tag_names=None):
+    try:
+        cursor = conn.cursor()
         
-        while True:
+        if categories is None or categories:
+            cursor.execute("""
+                INSERT INTO category_stats (category_id, title, display_title, guide_count)
+                SELECT c.id, c.title, c.display_title, COUNT(g.id)
+                FROM categories c
+                LEFT JOIN guides g ON c.title = g.category
+                WHERE %(titles)s::text[] IS NULL OR c.title = ANY(%(titles)s)
+                GROUP BY c.id, c.title, c.display_title
+                ON CONFLICT (category_id) DO UPDATE SET
+                    title = EXCLUDED.title,
+                    display_title = EXCLUDED.display_title,
+                    guide_count = EXCLUDED.guide_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, {'titles': None if categories is None else list(categories)})
+        
+        if tag_names is None or tag_names:
+            cursor.execute("""
+                INSERT INTO tag_stats (tag_id, name, guide_count)
+                SELECT t.id, t.name, COUNT(gt.guide_id)
+                FROM tags t
+                LEFT JOIN guide_tags gt ON t.id = gt.tag_id
+                WHERE %(names)s::text[] IS NULL OR t.name = ANY(%(names)s)
+                GROUP BY t.id, t.name
+                ON CONFLICT (tag_id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    guide_count = EXCLUDED.guide_count,
+                    updated_at = CURRENT_TIMESTAMP
+            """, {'names': None if tag_names is None else list(tag_names)})
+        
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error refreshing aggregates: {e}")
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+
+# Function to resolve category_id for guides stored before their category existed.
+# The guide stage runs alongside the category and wiki stages, so a guide can be
+# stored first; the upsert keeps an existing category_id but never fills a missing one.
+def backfill_guide_categories(conn):
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE guides g
+            SET category_id = (
+                SELECT id FROM categories c
+                WHERE c.title = g.category OR c.display_title = g.category
+                LIMIT 1
+            )
+            WHERE g.category_id IS NULL AND g.category IS NOT NULL AND g.category != ''
+              AND EXISTS (
+                SELECT 1 FROM categories c
+                WHERE c.title = g.category OR c.display_title = g.category
+              )
+        """)
+        print(f"Resolved categories for {cursor.rowcount} guides")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error backfilling guide categories: {e}")
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+
+# Function to bump the data version, which invalidates the API server's response cache and ETags
+def bump_data_version(conn):
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE data_version
+            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error bumping data version: {e}")
+    finally:
+        if 'cursor' in locals() and cursor:
+            cursor.close()
+
+# Function run by pipeline workers: fetch guide details, tags and media for one guide
+def fetch_guide_bundle(guide):
+    guide_id = guide.get('guideid')
+    
+    print(f"Processing guide {guide_id}: {guide.get('title', 'No title')}")
+    
+    # Fetch detailed guide info
+    stage_start = time.time()
+    guide_details = fetch_guide(guide_id)
+    tags = None
+    
+    if guide_details:
+        # Store raw guide details in S3
+        try:
+            s3_client.put_object(
+                Bucket=RAW_BUCKET,
+                Key=f"ifixit/guides/{guide_id}/details.json",
+                Body=json.dumps(guide_details)
+            )
+            print(f"Saved guide details to S3 for guide {guide_id}")
+        except Exception as e:
+            print(f"Error saving guide details to S3: {e}")
+        
+        # Fetch tags
+        tags = fetch_guide_tags(guide_id)
+        
+        if tags:
+            # Store tags in S3
+            try:
+                s3_client.put_object(
+                    Bucket=RAW_BUCKET,
+                    Key=f"ifixit/guides/{guide_id}/tags.json",
+                    Body=json.dumps(tags)
+                )
+                print(f"Saved guide tags to S3 for guide {guide_id}")
+            except Exception as e:
+                print(f"Error saving guide tags to S3: {e}")
+    record_stage('fetch', time.time() - stage_start)
+    
+    media_paths = None
+    if guide_details:
+        stage_start = time.time()
+        media_paths = download_guide_media(guide, guide_details)
+        record_stage('media', time.time() - stage_start)
+    
+    return guide_details, tags, media_paths
+
+# Function to keep only guides that are new or modified since they were last stored
+def filter_changed_guides(guides, conn):
+    global guides_skipped
+    
+    external_ids = [str(guide.get('guideid')) for guide in guides if guide.get('guideid')]
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT external_id, modified_date
+            FROM guides
+            WHERE source_id = %s AND external_id = ANY(%s)
+        """, (1, external_ids))
+        stored_dates = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    
+    changed_guides = []
+    for guide in guides:
+        external_id = str(guide.get('guideid', ''))
+        stored_date = stored_dates.get(external_id)
+        modified_date = guide.get('modified_date')
+        
+        if stored_date is not None and modified_date is not None and int(modified_date) <= stored_date:
+            guides_skipped += 1
+            continue
+        changed_guides.append(guide)
+    
+    print(f"{len(changed_guides)} of {len(guides)} guides are new or modified")
+    return changed_guides
+
+# Work items this fetcher holds a lease on; the lease heartbeat renews them
+lease_lock = threading.Lock()
+held_leases = set()
+
+# Function to queue work items (work_key, payload) for this crawl; items already queued are left as they are.
+# The caller commits, so items can be queued in the same transaction that completes other work.
+def enqueue_work(conn, kind, items):
+    cursor = conn.cursor()
+    try:
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO crawl_work (crawl_id, kind, work_key, payload)
+            VALUES %s
+            ON CONFLICT (crawl_id, kind, work_key) DO NOTHING
+        """, [
+            (CRAWL_ID, kind, str(work_key), json.dumps(payload) if payload is not None else None)
+            for work_key, payload in items
+        ], page_size=1000)
+    finally:
+        cursor.close()
+
+# Function to lease up to limit claimable work items of the given kinds.
+# Rows locked by another fetcher's claim are skipped rather than waited on.
+def claim_work(conn, kinds, limit, work_key=None):
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        # Leases that expired on their last allowed attempt are given up on
+        cursor.execute("""
+            UPDATE crawl_work
+            SET status = 'failed',
+                last_error = COALESCE(last_error, 'lease expired'),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM crawl_work
+                WHERE crawl_id = %s AND kind = ANY(%s) AND status = 'leased'
+                  AND available_at < CURRENT_TIMESTAMP AND attempts >= %s
+                FOR UPDATE SKIP LOCKED
+            )
+        """, (CRAWL_ID, kinds, LEASE_MAX_ATTEMPTS))
+        
+        # Pending items past their retry backoff and leased items whose lease expired are claimable.
+        # Guides go before guide list pages, so listing doesn't run far ahead of fetching.
+        cursor.execute("""
+            UPDATE crawl_work w
+            SET status = 'leased',
+                leased_by = %s,
+                attempts = w.attempts + 1,
+                available_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT id FROM crawl_work
+                WHERE crawl_id = %s AND kind = ANY(%s) AND (%s::text IS NULL OR work_key = %s)
+                  AND status IN ('pending', 'leased') AND available_at <= CURRENT_TIMESTAMP
+                  AND attempts < %s
+                ORDER BY kind = 'guide_list', id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) claimable
+            WHERE w.id = claimable.id
+            RETURNING w.id, w.kind, w.work_key, w.payload, w.attempts
+        """, (WORKER_ID, LEASE_SECONDS, CRAWL_ID, kinds, work_key, work_key, LEASE_MAX_ATTEMPTS, limit))
+        items = cursor.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    with lease_lock:
+        held_leases.update(item['id'] for item in items)
+    return items
+
+# Function to finish a leased work item: done, back to pending with backoff (error), or released untouched.
+# Anything else pending on the connection is committed with it. Returns False if the lease was lost.
+def finish_work(conn, item, error=None, release=False):
+    with lease_lock:
+        held_leases.discard(item['id'])
+    
+    if error is not None:
+        # Drop whatever the failed attempt wrote
+        conn.rollback()
+        print(f"Work item {item['kind']} {item['work_key']} failed on attempt {item['attempts']}: {error}")
+    
+    cursor = conn.cursor()
+    try:
+        if release:
+            cursor.execute("""
+                UPDATE crawl_work
+                SET status = 'pending', leased_by = NULL, attempts = attempts - 1,
+                    available_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND leased_by = %s AND status = 'leased'
+            """, (item['id'], WORKER_ID))
+        elif error is not None:
+            cursor.execute("""
+                UPDATE crawl_work
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    leased_by = NULL,
+                    available_at = CURRENT_TIMESTAMP + make_interval(secs => %s * attempts),
+                    last_error = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND leased_by = %s AND status = 'leased'
+            """, (LEASE_MAX_ATTEMPTS, RETRY_DELAY_SECONDS, str(error), item['id'], WORKER_ID))
+        else:
+            cursor.execute("""
+                UPDATE crawl_work
+                SET status = 'done', updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND leased_by = %s AND status = 'leased'
+            """, (item['id'], WORKER_ID))
+        owned = cursor.rowcount > 0
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    if not owned:
+        print(f"Lease on work item {item['kind']} {item['work_key']} expired and was taken over")
+    return owned
+
+# Function to check whether any work of the given kinds is still pending or leased in this crawl
+def has_open_work(conn, kinds):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM crawl_work
+                WHERE crawl_id = %s AND kind = ANY(%s) AND status IN ('pending', 'leased')
+            )
+        """, (CRAWL_ID, kinds))
+        open_work = cursor.fetchone()[0]
+        conn.commit()
+        return open_work
+    finally:
+        cursor.close()
+
+# Function to count work items of the given kinds that failed for good in this crawl
+def count_failed_work(conn, kinds):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM crawl_work
+            WHERE crawl_id = %s AND kind = ANY(%s) AND status = 'failed'
+        """, (CRAWL_ID, kinds))
+        failed = cursor.fetchone()[0]
+        conn.commit()
+        return failed
+    finally:
+        cursor.close()
+
+# Function to get the status of one work item in this crawl
+def get_work_status(conn, kind, work_key):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT status FROM crawl_work
+            WHERE crawl_id = %s AND kind = %s AND work_key = %s
+        """, (CRAWL_ID, kind, work_key))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+
+# Function run by the lease heartbeat thread: extends the leases this fetcher holds while it works on them
+def renew_leases():
+    conn = None
+    while not shutdown_event.wait(LEASE_SECONDS / 3):
+        with lease_lock:
+            lease_ids = list(held_leases)
+        if not lease_ids:
+            continue
+        
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(**db_params)
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE crawl_work
+                SET available_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s) AND leased_by = %s AND status = 'leased'
+            """, (LEASE_SECONDS, lease_ids, WORKER_ID))
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            print(f"Error renewing leases: {e}")
+            if conn is not None:
+                conn.close()
+            conn = None
+
+# Function to process a leased guide list page: queue its guides, and the page
+# GUIDE_LIST_LOOKAHEAD pages ahead, in the transaction that completes it
+def process_guide_list(item, conn):
+    offset = int(item['work_key'])
+    next_offset = offset + GUIDE_LIST_LOOKAHEAD * GUIDE_LIST_BATCH_SIZE
+    try:
+        guides = fetch_guides(limit=GUIDE_LIST_BATCH_SIZE, offset=offset)
+        if guides is None:
+            raise Exception(f"guide list at offset {offset} could not be fetched")
+        
+        if guides:
+            save_raw_json(f"ifixit/guides/list/{offset}-{offset+GUIDE_LIST_BATCH_SIZE}.json", guides)
+            
+            # In incremental mode, only guides that changed are queued
+            pending_guides = filter_changed_guides(guides, conn) if INCREMENTAL else guides
+            enqueue_work(conn, 'guide', [(guide['guideid'], guide) for guide in pending_guides if guide.get('guideid')])
+            enqueue_work(conn, 'guide_list', [(next_offset, None)])
+        
+        finish_work(conn, item)
+        print(f"Queued {len(guides)} guides from list offset {offset}")
+    except Exception as e:
+        finish_work(conn, item, error=e)
+        if item['attempts'] < LEASE_MAX_ATTEMPTS:
+            # The page is retried, and queues the next one when it succeeds or runs out of attempts
+            return
+        
+        # This page failed for good; the pages after it in its lookahead chain must still be
+        # crawled, unless the chain has failed so often in a row that it is past the end of the list
+        failed_pages = (item['payload'] or {}).get('failed_pages', 0) + 1
+        if failed_pages >= GUIDE_LIST_MAX_FAILED_PAGES:
+            print(f"Guide list chain stopped at offset {offset} after {failed_pages} failed pages in a row")
+            return
+        enqueue_work(conn, 'guide_list', [(next_offset, {'failed_pages': failed_pages})])
+        conn.commit()
+
+# Function to crawl guides from the crawl_work queue (--distributed). Every fetcher
+# runs it; guide list pages and single guides are leased, so no two fetchers fetch the same one.
+def crawl_guides_distributed():
+    global guides_processed
+    
+    conn = psycopg2.connect(**db_params)
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+    try:
+        # Seed the first pages; every listed page queues the one GUIDE_LIST_LOOKAHEAD pages after it
+        enqueue_work(conn, 'guide_list', [(page * GUIDE_LIST_BATCH_SIZE, None) for page in range(GUIDE_LIST_LOOKAHEAD)])
+        conn.commit()
+        bump_data_version(conn)
+        print(f"Crawling guides for crawl {CRAWL_ID} as {WORKER_ID} with {FETCH_WORKERS} guide fetch workers")
+        
+        while not shutdown_event.is_set():
+            items = claim_work(conn, ['guide', 'guide_list'], FETCH_WORKERS)
+            if not items:
+                if not has_open_work(conn, ['guide', 'guide_list']):
+                    failed = count_failed_work(conn, ['guide', 'guide_list'])
+                    print(f"No guide work left in crawl {CRAWL_ID}; {failed} guide list pages or guides failed after {LEASE_MAX_ATTEMPTS} attempts")
+                    break
+                # The rest is leased by other fetchers or waiting out a retry backoff
+                shutdown_event.wait(QUEUE_POLL_SECONDS)
+                continue
+            
+            for item in items:
+                if item['kind'] == 'guide_list':
+                    process_guide_list(item, conn)
+            
+            # Fetch the leased guides on the worker pool and store them on this thread
+            futures = [
+                (item, executor.submit(fetch_guide_bundle, item['payload']))
+                for item in items if item['kind'] == 'guide'
+            ]
+            
+            batch_stored = 0
+            batch_categories = set()
+            batch_tags = set()
+            for item, future in futures:
+                guide = item['payload']
+                try:
+                    guide_details, tags, media_paths = future.result()
+                    if not guide_details:
+                        raise Exception("guide details could not be fetched")
+                    
+                    stage_start = time.time()
+                    db_guide_id = store_guide_in_db(guide, guide_details, tags, conn, media_paths)
+                    record_stage('store', time.time() - stage_start)
+                    if not db_guide_id:
+                        raise Exception("guide could not be stored")
+                    
+                    finish_work(conn, item)
+                    guides_processed += 1
+                    batch_stored += 1
+                    if guide.get('category'):
+                        batch_categories.add(guide['category'])
+                    batch_tags.update(tags or [])
+                except Exception as e:
+                    finish_work(conn, item, error=e)
+            
+            # Refresh the counts for the categories and tags this batch touched
+            if futures:
+                refresh_aggregates(conn, batch_categories, batch_tags)
+                if batch_stored:
+                    bump_data_version(conn)
+            
+            # Display progress periodically
+            if (datetime.now() - last_checkpoint_time).total_seconds() >= stats_interval:
+                save_checkpoint()
+                display_progress()
+    finally:
+        executor.shutdown(wait=True)
+        conn.close()
+
+# Function to run a stage that only one fetcher of a distributed crawl should run.
+# The fetcher that leases the stage runs it; the others wait until it is done.
+def run_leased_stage(stage, run):
+    conn = psycopg2.connect(**db_params)
+    try:
+        enqueue_work(conn, 'stage', [(stage, None)])
+        conn.commit()
+        
+        while not shutdown_event.is_set():
+            items = claim_work(conn, ['stage'], 1, work_key=stage)
+            if items:
+                try:
+                    run()
+                except Exception as e:
+                    finish_work(conn, items[0], error=e)
+                    raise
+                
+                if shutdown_event.is_set():
+                    finish_work(conn, items[0], release=True)
+                    return 'interrupted'
+                finish_work(conn, items[0])
+                return 'done'
+            
+            status = get_work_status(conn, 'stage', stage)
+            if status in ('done', 'failed'):
+                print(f"Stage {stage} {status} on another fetcher")
+                return status
+            shutdown_event.wait(QUEUE_POLL_SECONDS)
+        
+        return 'interrupted'
+    finally:
+        conn.close()
+
+# Function to fetch all wikis (crawl stage wrapper around the async crawler)
+def fetch_and_store_wikis():
+    asyncio.run(crawl_wikis(WIKI_NAMESPACES))
+
+# Function to fetch and store a batch of guides. Details, tags and media are fetched
+# concurrently on the worker pool; results are stored on this thread in list order.
+# Guides whose fetch or store fails are kept in failed_guides (saved with the checkpoint),
+# so moving the list offset past them doesn't lose them.
+def process_guide_batch(guides, conn, executor):
+    global guides_processed
+    
+    futures = [
+        (guide, executor.submit(fetch_guide_bundle, guide))
+        for guide in guides if guide.get('guideid')
+    ]
+    
+    batch_stored = 0
+    batch_categories = set()
+    batch_tags = set()
+    for guide, future in futures:
+        guide_id = guide.get('guideid')
+        
+        try:
+            guide_details, tags, media_paths = future.result()
+        except Exception as e:
+            print(f"Error fetching guide {guide_id}: {e}")
+            guide_details = None
+        
+        db_guide_id = None
+        if guide_details:
+            # Store in database
+            stage_start = time.time()
+            db_guide_id = store_guide_in_db(guide, guide_details, tags, conn, media_paths)
+            record_stage('store', time.time() - stage_start)
+        
+        with stats_lock:
+            if db_guide_id:
+                guides_processed += 1
+                failed_guides.pop(guide_id, None)
+            else:
+                failed_guides[guide_id] = guide
+        if db_guide_id:
+            batch_stored += 1
+            if guide.get('category'):
+                batch_categories.add(guide['category'])
+            batch_tags.update(tags or [])
+            print(f"Successfully processed guide {guide_id}")
+        else:
+            print(f"Guide {guide_id} failed, it will be retried")
+        
+        # Check if it's time to save a checkpoint
+        now = datetime.now()
+        if (now - last_checkpoint_time).total_seconds() >= checkpoint_interval:
+            save_checkpoint()
+            
+        # Check if it's time to display progress stats
+        if (now - last_checkpoint_time).total_seconds() >= stats_interval:
+            display_progress()
+    
+    # Refresh the counts for the categories and tags this batch touched
+    refresh_aggregates(conn, batch_categories, batch_tags)
+    if batch_stored:
+        bump_data_version(conn)
+
+# Function to fetch all guides from the checkpoint offset and store them
+def fetch_and_store_guides():
+    global current_offset
+    
+    conn = psycopg2.connect(**db_params)
+    bump_data_version(conn)
+    
+    batch_size = GUIDE_LIST_BATCH_SIZE  # Number of guides to fetch per API call
+    executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+    print(f"Using {FETCH_WORKERS} guide fetch workers starting at {API_RATE_LIMIT} requests/second")
+    
+    try:
+        while not shutdown_event.is_set():
             guides = fetch_guides(limit=batch_size, offset=current_offset)
             
-            if not guides or len(guides) == 0:
+            if guides is None:
+                # The list request failed: fail the stage so the next run resumes at this offset
+                raise Exception(f"Failed to fetch the guide list at offset {current_offset}")
+            
+            if len(guides) == 0:
                 print(f"No guides returned for offset {current_offset}, stopping")
                 break
                 
@@ -848,60 +2109,9 @@ def main():
             except Exception as e:
                 print(f"Error saving guide list to S3: {e}")
             
-            for guide in guides:
-                guide_id = guide.get('guideid')
-                if not guide_id:
-                    continue
-                    
-                print(f"Processing guide {guide_id}: {guide.get('title', 'No title')}")
-                
-                # Fetch detailed guide info
-                guide_details = fetch_guide(guide_id)
-                
-                if guide_details:
-                    # Store raw guide details in S3
-                    try:
-                        s3_client.put_object(
-                            Bucket=RAW_BUCKET,
-                            Key=f"ifixit/guides/{guide_id}/details.json",
-                            Body=json.dumps(guide_details)
-                        )
-                        print(f"Saved guide details to S3 for guide {guide_id}")
-                    except Exception as e:
-                        print(f"Error saving guide details to S3: {e}")
-                    
-                    # Fetch tags
-                    tags = fetch_guide_tags(guide_id)
-                    
-                    if tags:
-                        # Store tags in S3
-                        try:
-                            s3_client.put_object(
-                                Bucket=RAW_BUCKET,
-                                Key=f"ifixit/guides/{guide_id}/tags.json",
-                                Body=json.dumps(tags)
-                            )
-                            print(f"Saved guide tags to S3 for guide {guide_id}")
-                        except Exception as e:
-                            print(f"Error saving guide tags to S3: {e}")
-                    
-                    # Store in database
-                    db_guide_id = store_guide_in_db(guide, guide_details, tags, conn)
-                    if db_guide_id:
-                        guides_processed += 1
-                        print(f"Successfully processed guide {guide_id}")
-                
-                # Check if it's time to save a checkpoint
-                now = datetime.now()
-                if (now - last_checkpoint_time).total_seconds() >= checkpoint_interval:
-                    save_checkpoint()
-                    
-                # Check if it's time to display progress stats
-                if (now - last_checkpoint_time).total_seconds() >= stats_interval:
-                    display_progress()
-                
-                # Be nice to the API - add small delay between requests
-                time.sleep(2)
+            # In incremental mode, only guides that changed get details, tags and media fetched
+            pending_guides = filter_changed_guides(guides, conn) if INCREMENTAL else guides
+            process_guide_batch(pending_guides, conn, executor)
             
             # Update offset for next batch
             current_offset += len(guides)
@@ -912,11 +2122,30 @@ def main():
             
             # Display progress after each batch
             display_progress()
-            
-        # After guides, fetch some product information
-        # This is just a sample of products - we don't know all product codes
-        print("=== Fetching Sample Products ===")
         
+        if failed_guides and not shutdown_event.is_set():
+            # Give every guide that failed during the list one more attempt
+            print(f"Retrying {len(failed_guides)} failed guides")
+            process_guide_batch(list(failed_guides.values()), conn, executor)
+            save_checkpoint()
+            if failed_guides:
+                raise Exception(f"{len(failed_guides)} guides still failed, they are retried on the next run")
+        
+        if INCREMENTAL and not shutdown_event.is_set():
+            # The whole list was compared, so the next incremental run starts from the top
+            current_offset = 0
+            save_checkpoint()
+    finally:
+        executor.shutdown(wait=True)
+        conn.close()
+
+# Function to fetch a sample of products, using guide categories as product codes.
+# This is just a sample of products - we don't know all product codes
+def fetch_and_store_products():
+    global products_processed
+    
+    conn = psycopg2.connect(**db_params)
+    try:
         # Try to get some product codes from the database
         cursor = conn.cursor()
         cursor.execute("""
@@ -930,6 +2159,8 @@ def main():
         
         # Use these categories to get product suggestions
         for category in categories:
+            if shutdown_event.is_set():
+                break
             try:
                 suggestions = fetch_suggestions(category)
                 
@@ -944,15 +2175,132 @@ def main():
                             
                             if product_info:
                                 # Store product info in database
-                                store_product_in_db(product_info, conn)
-                                
-                                # Be nice to the API
-                                time.sleep(1)
+                                if store_product_in_db(product_info, conn):
+                                    products_processed += 1
             except Exception as e:
                 print(f"Error fetching product info for category {category}: {e}")
-        
+    finally:
         conn.close()
+
+# Function to refresh all aggregates once categories, wikis and guides are in.
+# Guides stored before their category get it resolved first; the full refresh
+# also catches guides that moved out of a category.
+def refresh_all_aggregates():
+    conn = psycopg2.connect(**db_params)
+    try:
+        backfill_guide_categories(conn)
+        refresh_aggregates(conn)
+        bump_data_version(conn)
+    finally:
+        conn.close()
+
+# Crawl stages and the stages each one needs finished first. Stages with no
+# dependency path between them (e.g. wikis and guides) run at the same time.
+# In a distributed crawl, stages with a distributed_run are run by every fetcher
+# and the others by whichever fetcher leases them first.
+FETCH_STAGES = {
+    'categories': {'run': fetch_and_store_categories, 'depends_on': []},
+    'wikis': {'run': fetch_and_store_wikis, 'depends_on': ['categories']},  # wikis enrich the loaded categories
+    'guides': {'run': fetch_and_store_guides, 'distributed_run': crawl_guides_distributed, 'depends_on': []},
+    'products': {'run': fetch_and_store_products, 'depends_on': ['guides']},  # product codes come from guide categories
+    'aggregates': {'run': refresh_all_aggregates, 'depends_on': ['categories', 'wikis', 'guides']}  # also backfills guides.category_id
+}
+
+# Function to run one crawl stage on a scheduler thread and record how it ended
+def run_stage(stage, spec):
+    with stats_lock:
+        stage_runs[stage] = {'status': 'running', 'started_at': datetime.now().isoformat(), 'finished_at': None, 'seconds': None}
+    print(f"=== Stage {stage} started ===")
+    
+    stage_start = time.time()
+    try:
+        if DISTRIBUTED and 'distributed_run' not in spec:
+            status = run_leased_stage(stage, spec['run'])
+        else:
+            (spec['distributed_run'] if DISTRIBUTED else spec['run'])()
+            status = 'interrupted' if shutdown_event.is_set() else 'done'
+    except Exception as e:
+        print(f"Error in stage {stage}: {e}")
+        status = 'failed'
+    
+    with stats_lock:
+        stage_runs[stage].update({
+            'status': status,
+            'finished_at': datetime.now().isoformat(),
+            'seconds': round(time.time() - stage_start, 2)
+        })
+    print(f"=== Stage {stage} {status} after {stage_runs[stage]['seconds']} seconds ===")
+    save_checkpoint()
+
+# Function to run the crawl stages, starting each one as soon as its dependencies are done
+def run_stages(stages):
+    pending = {}
+    for stage, spec in stages.items():
+        if stage_runs.get(stage, {}).get('status') == 'done':
+            print(f"Stage {stage} already done in checkpoint, skipping")
+        else:
+            pending[stage] = spec
+    
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix='stage')
+    try:
+        while pending and not shutdown_event.is_set():
+            for stage, spec in list(pending.items()):
+                statuses = [stage_runs.get(dependency, {}).get('status') for dependency in spec['depends_on']]
+                if all(status == 'done' for status in statuses):
+                    running[executor.submit(run_stage, stage, spec)] = stage
+                    del pending[stage]
+            
+            if not running:
+                break
+            
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                running.pop(future)
         
+        # Whatever is still pending was stopped by a shutdown or needs a stage that did not finish
+        for stage in pending:
+            print(f"Stage {stage} not run (needs {', '.join(pending[stage]['depends_on']) or 'nothing'})")
+    finally:
+        executor.shutdown(wait=True)
+
+# Main function
+def main():
+    global current_offset, guides_processed, guides_skipped, wikis_processed, categories_processed, products_processed, media_downloaded, start_time, last_checkpoint_time
+    
+    print(f"Starting iFixit data fetcher at {datetime.now()}{' (incremental)' if INCREMENTAL else ''}")
+    
+    if DISTRIBUTED:
+        # Progress is shared through crawl_work; leases are renewed while this fetcher works
+        print(f"Joining distributed crawl {CRAWL_ID} as {WORKER_ID}")
+        threading.Thread(target=renew_leases, daemon=True).start()
+    # Load checkpoint if exists
+    elif load_checkpoint():
+        # Checkpoint found, current_offset and finished stages have been restored
+        pass
+    else:
+        # No checkpoint, start from beginning
+        current_offset = 0
+        guides_processed = 0
+        guides_skipped = 0
+        wikis_processed = 0
+        categories_processed = 0
+        products_processed = 0
+        media_downloaded = 0
+    
+    # Record start time
+    start_time = datetime.now()
+    last_checkpoint_time = datetime.now()
+    
+    try:
+        run_stages(FETCH_STAGES)
+        
+        if all(stage_runs.get(stage, {}).get('status') == 'done' for stage in FETCH_STAGES):
+            # Every stage finished, so the next run starts them all again
+            total_seconds = round((datetime.now() - start_time).total_seconds(), 2)
+            print(f"All stages done in {total_seconds} seconds")
+            stage_runs.clear()
+            save_checkpoint()
     except Exception as e:
         print(f"Error in main process: {e}")
         # Save checkpoint in case of error
@@ -960,9 +2308,19 @@ def main():
     
     print(f"Completed iFixit data fetcher at {datetime.now()}")
     print(f"Total guides processed: {guides_processed}")
+    print(f"Total guides skipped (unchanged): {guides_skipped}")
     print(f"Total wikis processed: {wikis_processed}")
     print(f"Total categories processed: {categories_processed}")
+    print(f"Total products processed: {products_processed}")
     print(f"Total media downloaded: {media_downloaded}")
 
 if __name__ == "__main__":
-    main()
+    if REBUILD_DOCUMENTS:
+        conn = psycopg2.connect(**db_params)
+        try:
+            rebuild_guide_documents(conn)
+            bump_data_version(conn)
+        finally:
+            conn.close()
+    else:
+        main()
@@ -17,10 +17,11 @@ echo "=== API SERVER STATUS ==="
 if [ -f "$API_PID_FILE" ] && ps -p $(cat "$API_PID_FILE") > /dev/null; then
     echo "Status: RUNNING with PID $(cat $API_PID_FILE)"
     echo "Uptime: $(ps -o etime= -p $(cat $API_PID_FILE))"
+    echo "Workers: $(pgrep -P $(cat $API_PID_FILE) | wc -l)"
 else
     echo "Status: NOT RUNNING! Restarting..."
-    nohup python3 enhanced_api_server.py > logs/api_server.log 2>&1 &
-    echo $! > "$API_PID_FILE"
+    gunicorn -c gunicorn.conf.py 'enhanced_api_server:create_app()'
+    sleep 2
     echo "API server restarted with PID $(cat $API_PID_FILE)"
 fi
 echo
@@ -91,24 +92,15 @@ try:
     )
     cursor = conn.cursor()
     
-    # Get counts of different tables
-    cursor.execute('SELECT COUNT(*) FROM guides')
-    guide_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM steps')
-    step_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM media')
-    media_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM categories')
-    category_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM tags')
-    tag_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM products')
-    product_count = cursor.fetchone()[0]
+    # Get counts of different tables (kept by triggers in entity_counts)
+    cursor.execute('SELECT name, value FROM entity_counts')
+    counts = dict(cursor.fetchall())
+    guide_count = counts.get('guides', 0)
+    step_count = counts.get('steps', 0)
+    media_count = counts.get('media', 0)
+    category_count = counts.get('categories', 0)
+    tag_count = counts.get('tags', 0)
+    product_count = counts.get('products', 0)
     
     print(f'Guides: {guide_count}, Steps: {step_count}, Media: {media_count}')
     print(f'Categories: {category_count}, Tags: {tag_count}, Products: {product_count}')
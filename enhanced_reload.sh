@@ -0,0 +1,29 @@
+#!/bin/bash
+
+# Graceful reload of the API server onto new code: USR2 makes gunicorn start a
+# new master (which preloads the new code), then the old master is stopped with
+# TERM, which lets its workers finish in-flight requests.
+
+PID_FILE="api_server.pid"
+
+if [ ! -f "$PID_FILE" ] || ! ps -p $(cat "$PID_FILE") > /dev/null; then
+    echo "API server is not running"
+    exit 1
+fi
+
+OLD_PID=$(cat "$PID_FILE")
+echo "Starting new master next to PID $OLD_PID"
+kill -USR2 "$OLD_PID"
+
+# The new master writes its own PID to the pid file once it is up
+for i in $(seq 1 30); do
+    sleep 1
+    if [ -f "$PID_FILE" ] && [ "$(cat "$PID_FILE")" != "$OLD_PID" ] && ps -p $(cat "$PID_FILE") > /dev/null; then
+        echo "New master running with PID $(cat "$PID_FILE"), stopping old master $OLD_PID"
+        kill -TERM "$OLD_PID"
+        exit 0
+    fi
+done
+
+echo "New master did not come up within 30 seconds; old master $OLD_PID keeps serving (see logs/api_server.log)"
+exit 1
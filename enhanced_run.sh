@@ -31,8 +31,8 @@ echo "=== Fetching initial data ==="
 python3 enhanced_ifixit_fetcher.py
 
 echo "=== Starting API server ==="
-nohup python3 enhanced_api_server.py > logs/api_server.log 2>&1 &
-echo $! > api_server.pid
+gunicorn -c gunicorn.conf.py 'enhanced_api_server:create_app()'
+sleep 2
 echo "API server started with PID $(cat api_server.pid)"
 
 echo "=== Starting web server for UI access ==="
@@ -55,6 +55,8 @@ echo "- GET /api/products          # List all products"
 echo "- GET /api/products/{itemcode} # Get specific product"
 echo "- GET /api/tags              # List all tags"
 echo "- GET /api/search?q={query}  # Search across all content"
+echo "- GET /api/export/guides     # Stream all guides as NDJSON (also categories, products)"
 echo "- GET /api/stats             # Get system statistics"
 echo ""
 echo "Run './monitor.sh' to check system status."
+echo "Run './enhanced_reload.sh' to reload the API server onto new code without dropping requests."
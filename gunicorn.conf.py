@@ -0,0 +1,44 @@
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# gunicorn settings for enhanced_api_server.py:
+#   gunicorn -c gunicorn.conf.py 'enhanced_api_server:create_app()'
+# Graceful reload: ./enhanced_reload.sh (starts a new master on the new code,
+# then drains the old one). kill -HUP only restarts workers on the preloaded code.
+
+bind = os.getenv('API_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('API_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('API_THREADS', '4'))  # requests served concurrently per worker
+
+# Load the app once in the master; workers share its memory copy-on-write
+preload_app = True
+
+timeout = int(os.getenv('API_TIMEOUT', '60'))  # seconds before a silent worker is restarted
+graceful_timeout = int(os.getenv('API_GRACEFUL_TIMEOUT', '30'))  # seconds workers get to finish requests on reload/stop
+keepalive = 5
+
+# Restart workers now and then so a slow leak can't grow without bound
+max_requests = int(os.getenv('API_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+
+pidfile = 'api_server.pid'
+accesslog = 'logs/api_access.log'
+errorlog = 'logs/api_server.log'
+daemon = os.getenv('API_DAEMON', '1') == '1'
+
+# Every worker has its own pool of up to DB_POOL_MAX connections (default: threads), so the
+# server opens up to workers x DB_POOL_MAX, twice that while enhanced_reload.sh drains the
+# old master. Keep it below Postgres max_connections.
+def when_ready(server):
+    from enhanced_api_server import DB_POOL_MAX
+    server.log.info(f"Up to {workers * DB_POOL_MAX} database connections ({workers} workers x DB_POOL_MAX={DB_POOL_MAX})")
+
+# Each worker needs its own database pool and S3/Redis clients
+def post_fork(server, worker):
+    import enhanced_api_server
+    enhanced_api_server.init_worker()
+    server.log.info(f"Worker {worker.pid} initialized")
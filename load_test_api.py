@@ -0,0 +1,56 @@
+import sys
+import os
+from dotenv import load_dotenv
+from benchmark_utils import percentile, detail_routes, run_load
+
+load_dotenv()
+
+# Load test for the main API routes: CONCURRENCY client threads request the
+# routes round-robin for DURATION seconds against a running server, then
+# p50/p95/p99 latency, error count and throughput are reported per route.
+#   python3 load_test_api.py [concurrency] [seconds] [--no-cache]
+# --no-cache adds a unique _bench parameter to every request so responses
+# come from the handlers rather than the response cache.
+
+API_URL = os.getenv('API_URL', 'http://localhost:5000')
+CONCURRENCY = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 16
+DURATION = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 30
+NO_CACHE = '--no-cache' in sys.argv
+
+# Function to pick the routes to test, using real ids from the API
+def build_routes():
+    routes = [
+        '/api/guides?limit=20',
+        '/api/categories',
+        '/api/products?limit=20',
+        '/api/tags?limit=100&sort=popularity',
+        '/api/search?q=battery',
+        '/api/stats'
+    ]
+    return routes + detail_routes(API_URL, ['guide', 'category'])
+
+if __name__ == "__main__":
+    routes = build_routes()
+    print(f"Load testing {API_URL} with {CONCURRENCY} clients for {DURATION}s{' (bypassing the response cache)' if NO_CACHE else ''}")
+
+    results = run_load(API_URL, routes, CONCURRENCY, DURATION, no_cache=NO_CACHE, headers={'Accept-Encoding': 'gzip'})
+
+    print(f"{'route':<45} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    total_requests = 0
+    all_latencies = []
+    for route in routes:
+        route_results = results.get(route, [])
+        if not route_results:
+            continue
+        latencies = sorted(latency for latency, ok in route_results)
+        errors = sum(1 for latency, ok in route_results if not ok)
+        total_requests += len(route_results)
+        all_latencies.extend(latencies)
+        print(f"{route[:45]:<45} {len(route_results):>8} {errors:>6} "
+              f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} {percentile(latencies, 0.99):>8.1f}")
+
+    if all_latencies:
+        all_latencies.sort()
+        print(f"{'all routes':<45} {total_requests:>8} {'':>6} "
+              f"{percentile(all_latencies, 0.5):>8.1f} {percentile(all_latencies, 0.95):>8.1f} {percentile(all_latencies, 0.99):>8.1f}")
+        print(f"Throughput: {total_requests / DURATION:.1f} requests/second")